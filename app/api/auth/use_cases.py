@@ -5,11 +5,16 @@ from fastapi import HTTPException, status
 from sqlalchemy.exc import IntegrityError
 
 from app.commons.logging import logger
+from app.commons.notification_targets import (
+    DeviceEndpointCache,
+    NotificationTargetCache,
+)
 from app.commons.redis_cache import RedisCache
+from app.commons.response_cache import ResponseCache, chat_scope
 from app.commons.types import CacheType, TokenType
 from app.commons.utils import generate_random_token, generate_two_fa_code
 from app.db import AsyncSession
-from app.models import Session, User
+from app.models import Chat, Session, User
 from app.settings import settings
 
 from .schema import LoginResponse, RefreshResponse, TwoFaRequest, TwoFaResponse
@@ -165,11 +170,15 @@ class Logout:
     ) -> None:
         async with self.async_session.begin() as session:
             await Session.delete(session, user_id, refresh_token)
+            chat_ids = await Chat.read_ids_by_user_id(session, user_id)
 
             # Remove the old access_token
             await self.redis_cache.delete(f"{user_id}:{access_token}")
 
-            return None
+        # ログアウトした端末にプッシュ通知を送らない
+        await DeviceEndpointCache().invalidate([user_id])
+        await NotificationTargetCache().invalidate(chat_ids)
+        return None
 
 
 class Unregister:
@@ -180,8 +189,13 @@ class Unregister:
     async def execute(self, user_id: int) -> None:
         async with self.async_session.begin() as session:
             await User.delete(session, user_id)
+            chat_ids = await Chat.read_ids_by_user_id(session, user_id)
 
             # Remove all the old access_tokens
             await self.redis_cache.delete_with_prefix(str(user_id))
 
-            return None
+        # 参加しているチャットの参加者一覧から退会前のプロフィールを消す
+        await ResponseCache.invalidate(chat_scope(i) for i in chat_ids)
+        await DeviceEndpointCache().invalidate([user_id])
+        await NotificationTargetCache().invalidate(chat_ids)
+        return None
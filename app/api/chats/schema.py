@@ -9,6 +9,12 @@ class ReadAllChatRequest(BaseModel):
     desc: bool
 
 
+class StreamAllChatRequest(ReadAllChatRequest):
+    offset: conint(ge=0) = 0  # type: ignore
+    limit: conint(ge=0, le=1000) = 1000  # type: ignore
+    desc: bool = False
+
+
 class ReadChatResponse(ChatSchema):
     pass
 
@@ -21,8 +27,15 @@ class ReadChatParticipantResponse(MaskedUserSchema):
     pass
 
 
+class ReadAllChatParticipantRequest(BaseModel):
+    # 前のページの next_cursor (ユーザーID) を指定すると、その次から取得する
+    cursor: conint(ge=0) = 0  # type: ignore
+    limit: conint(ge=1, le=1000) = 100  # type: ignore
+
+
 class ReadAllChatParticipantResponse(BaseModel):
     participants: list[ReadChatParticipantResponse]
+    next_cursor: int | None = None
 
 
 class CreateChatRequest(BaseModel):
@@ -38,4 +51,21 @@ class CreateChatRequest(BaseModel):
 
 
 class CreateChatResponse(ChatSchema):
-    pass
+    unresolved_participant_names: list[str] = Field(
+        [], description="Participant names that did not match any user."
+    )
+
+
+class AddChatParticipantRequest(BaseModel):
+    participant_names: list[constr(min_length=1, max_length=20)] = Field(  # type: ignore
+        ..., min_length=1
+    )
+
+
+class AddChatParticipantResponse(BaseModel):
+    participant_ids: list[int] = Field(
+        ..., description="IDs of the users added as participants."
+    )
+    unresolved_participant_names: list[str] = Field(
+        [], description="Participant names that did not match any user."
+    )
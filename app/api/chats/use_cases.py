@@ -1,15 +1,26 @@
 from typing import AsyncIterator
 
 from fastapi import HTTPException, status
-from sqlalchemy import select
 
-from app.commons.types import ChatType
+from app.commons.chat_membership import (
+    ChatMembershipCache,
+    authorize,
+    publish_membership_event,
+)
+from app.commons.chat_purge import wake_chat_purge
+from app.commons.notification_targets import NotificationTargetCache
+from app.commons.response_cache import ResponseCache, chat_scope, user_scope
+from app.commons.types import ChatEventType, ChatType
 from app.db import AsyncSession
-from app.models import Chat, ChatParticipants, User
+from app.models import Chat, ChatEvent, ChatParticipants, User
+from app.settings import settings
 
 from .schema import (
+    AddChatParticipantRequest,
+    AddChatParticipantResponse,
     CreateChatRequest,
     CreateChatResponse,
+    ReadAllChatParticipantRequest,
     ReadAllChatParticipantResponse,
     ReadAllChatRequest,
     ReadAllChatResponse,
@@ -21,6 +32,7 @@ from .schema import (
 class ReadAllChat:
     def __init__(self, session: AsyncSession) -> None:
         self.async_session = session
+        self.response_cache = ResponseCache("chats")
 
     async def execute(
         self, user_id: int, params: ReadAllChatRequest
@@ -29,60 +41,92 @@ class ReadAllChat:
             async for chat in Chat.read_all(session, user_id, **params.model_dump()):
                 yield ReadChatResponse.model_validate(chat)  # type: ignore
 
+    async def stream(
+        self, user_id: int, params: ReadAllChatRequest
+    ) -> AsyncIterator[ReadChatResponse]:
+        # クライアントの受信を待つ間はセッションを保持しないよう、
+        # STREAM_BATCH_SIZE件ずつ別のセッションで読み込み、IDで続きを取得する
+        offset, remaining, after_id = params.offset, params.limit, None
+        while True:
+            limit = min(remaining, settings.STREAM_BATCH_SIZE)
+            async with self.async_session() as session:
+                chats = [
+                    ReadChatResponse.model_validate(chat)
+                    async for chat in Chat.read_all(
+                        session, user_id, offset, limit, params.desc, after_id
+                    )
+                ]
+            for chat in chats:
+                yield chat
+
+            remaining -= len(chats)
+            if len(chats) < limit or remaining == 0:
+                break
+            offset, after_id = 0, chats[-1].id
+
+    async def execute_cached(
+        self, user_id: int, params: ReadAllChatRequest
+    ) -> list[ReadChatResponse]:
+        # チャットの作成・削除や参加者の変更でユーザーのバージョンが更新される
+        async def compute() -> list[dict]:
+            return [
+                chat.model_dump(mode="json")
+                async for chat in self.execute(user_id, params)
+            ]
+
+        chats = await self.response_cache.read(
+            user_scope(user_id), params.model_dump_json(), compute
+        )
+        return [ReadChatResponse.model_validate(chat) for chat in chats]
+
 
 class ReadAllChatParticipant:
     def __init__(self, session: AsyncSession) -> None:
         self.async_session = session
+        self.response_cache = ResponseCache("participants")
 
     async def execute(
         self,
         user_id: int,
         chat_id: int,
-    ) -> AsyncIterator[ReadAllChatParticipantResponse]:
+        params: ReadAllChatParticipantRequest,
+    ) -> ReadAllChatParticipantResponse:
         async with self.async_session() as session:
             # チャットの関係者でない場合は403エラーを返却する
-            if (
-                not (
-                    await session.execute(
-                        select(Chat).where(
-                            Chat.id == chat_id, Chat.created_by == user_id
-                        )
-                    )
-                ).scalar()
-                and not (
-                    await session.execute(
-                        select(ChatParticipants).where(
-                            ChatParticipants.chat_id == chat_id,
-                            ChatParticipants.user_id == user_id,
-                        )
-                    )
-                ).scalar()
-            ):
-                raise HTTPException(
-                    status_code=status.HTTP_403_FORBIDDEN, detail=["Forbidden"]
-                )
+            await authorize(session, chat_id, user_id)
 
-            # Chatを取得
-            chat = await Chat.read_by_id(session, chat_id)
-            if not chat:
-                raise HTTPException(
-                    status_code=status.HTTP_404_NOT_FOUND, detail=["Chat not found."]
+            # 次のページの有無を判定するため1件多く取得する
+            participants = [
+                ReadChatParticipantResponse.model_validate(dict(row))
+                async for row in Chat.read_participants(
+                    session, chat_id, params.cursor, params.limit + 1
                 )
+            ]
+
+        next_cursor = None
+        if len(participants) > params.limit:
+            participants = participants[: params.limit]
+            next_cursor = participants[-1].id
+        return ReadAllChatParticipantResponse(
+            participants=participants, next_cursor=next_cursor
+        )
+
+    async def execute_cached(
+        self, user_id: int, chat_id: int, params: ReadAllChatParticipantRequest
+    ) -> ReadAllChatParticipantResponse:
+        # キャッシュを返す前にも関係者であることを確認する
+        async with self.async_session() as session:
+            await authorize(session, chat_id, user_id)
 
-            # ChatParticipants.read_allを利用してチャット参加者を取得
-            participant_ids = []
-            participants = ChatParticipants.read_all(session, chat_id, 0, 10, False)
-            async for participant in participants:
-                participant_ids.append(participant.user_id)
-            participant_ids.append(chat.created_by)
+        # 参加者の変更や参加者のプロフィールの変更でチャットのバージョンが更新される
+        async def compute() -> dict:
+            response = await self.execute(user_id, chat_id, params)
+            return response.model_dump(mode="json")
 
-            # User.read_by_idsを利用してユーザーオブジェクトを取得
-            async for user in User.read_all_by_ids(session, participant_ids):
-                # ReadChatParticipantResponse.model_validateにユーザーリストを渡す
-                if not user.is_name_visible:
-                    user.first_name = "ANONYMOUS"
-                    user.last_name = "ANONYMOUS"
-                yield ReadChatParticipantResponse.model_validate(user)  # type: ignore
+        response = await self.response_cache.read(
+            chat_scope(chat_id), params.model_dump_json(), compute
+        )
+        return ReadAllChatParticipantResponse.model_validate(response)
 
 
 class CreateChat:
@@ -120,25 +164,34 @@ class CreateChat:
             session.add(chat)
             await session.flush()  # チャットIDを取得するためにflush
 
-            if request.participant_names:
-                # 参加者のユーザーIDを取得
-                participant_ids = await Chat.get_user_ids_by_names(
-                    session, request.participant_names
+            # ユーザー名に一致する参加者を1つのSQL文でまとめて作成
+            participant_ids, unresolved = await ChatParticipants.create_all_by_names(
+                session, chat.id, request.participant_names
+            )
+            if not participant_ids:
+                await session.rollback()
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    detail=["One or more participant names do not exist"],
                 )
 
-                if not participant_ids:
-                    await session.rollback()
-                    raise HTTPException(
-                        status_code=status.HTTP_400_BAD_REQUEST,
-                        detail=["One or more participant names do not exist"],
-                    )
+            # 作成者を含む参加者の同期用イベントを記録
+            await ChatEvent.create_membership_events(
+                session,
+                chat.id,
+                ChatEventType.PARTICIPANT_ADDED,
+                [user_id, *participant_ids],
+            )
 
-                # チャット参加者を作成
-                for user_id in participant_ids:
-                    new_participant = ChatParticipants(chat_id=chat.id, user_id=user_id)
-                    session.add(new_participant)
+            response = CreateChatResponse.model_validate(chat)
+            # 存在しないユーザー名は参加者にせずに返却する
+            response.unresolved_participant_names = unresolved
 
-            return CreateChatResponse.model_validate(chat)
+        # 作成者と参加者のチャット一覧を更新する
+        await ResponseCache.invalidate(
+            user_scope(i) for i in [user_id, *participant_ids]
+        )
+        return response
 
 
 class DeleteChat:
@@ -150,4 +203,110 @@ class DeleteChat:
             chat = await Chat.read_by_id_and_user_id(session, chat_id, user_id)
             if not chat:
                 return
+            members = await Chat.read_members(session, chat_id)
+            await ChatEvent.create_chat_deleted_events(session, chat_id, user_id)
             await Chat.delete(session, chat_id, user_id)
+
+        # 削除済みのチャットへの認可をキャッシュから返さない
+        await ChatMembershipCache().invalidate(chat_id)
+        await NotificationTargetCache().invalidate([chat_id])
+        created_by, participant_ids = members or (user_id, [])
+        await ResponseCache.invalidate(
+            [chat_scope(chat_id)]
+            + [user_scope(i) for i in {created_by, *participant_ids}]
+        )
+        # 接続中のWebSocketを閉じさせる
+        await publish_membership_event(
+            chat_id, ChatEventType.PARTICIPANT_REMOVED, {created_by, *participant_ids}
+        )
+        wake_chat_purge()
+
+
+async def _apply_membership_change(
+    chat_id: int, event_type: ChatEventType, user_ids: list[int]
+) -> None:
+    # 認可・通知先・一覧のキャッシュを無効化し、接続中のWebSocketに知らせる
+    await ChatMembershipCache().invalidate(chat_id)
+    await NotificationTargetCache().invalidate([chat_id])
+    await ResponseCache.invalidate(
+        [chat_scope(chat_id)] + [user_scope(i) for i in user_ids]
+    )
+    await publish_membership_event(chat_id, event_type, user_ids)
+
+
+class AddChatParticipant:
+    def __init__(self, session: AsyncSession) -> None:
+        self.async_session = session
+
+    async def execute(
+        self, user_id: int, chat_id: int, request: AddChatParticipantRequest
+    ) -> AddChatParticipantResponse:
+        async with self.async_session.begin() as session:
+            # 参加者を追加できるのはチャットの作成者のみ
+            members = await authorize(session, chat_id, user_id)
+            if members.created_by != user_id:
+                raise HTTPException(
+                    status_code=status.HTTP_403_FORBIDDEN, detail=["Forbidden"]
+                )
+
+            creator = await User.read_by_id(session, user_id)
+            if creator and creator.username in request.participant_names:
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    detail=["Creator cannot be included as a chat participant."],
+                )
+
+            # 既に参加しているユーザーは追加しない
+            participant_ids, unresolved = await ChatParticipants.create_all_by_names(
+                session, chat_id, request.participant_names
+            )
+            await ChatEvent.create_membership_events(
+                session, chat_id, ChatEventType.PARTICIPANT_ADDED, participant_ids
+            )
+            # 3人以上になったダイレクトチャットはグループチャットとして扱う
+            promoted = bool(participant_ids) and await Chat.promote_to_group(
+                session, chat_id
+            )
+
+        await _apply_membership_change(
+            chat_id, ChatEventType.PARTICIPANT_ADDED, participant_ids
+        )
+        if promoted:
+            # 既存の参加者のチャット一覧にもチャットの種類の変更を反映する
+            await ResponseCache.invalidate(
+                [user_scope(members.created_by)]
+                + [user_scope(i) for i in members.participant_ids]
+            )
+        return AddChatParticipantResponse(
+            participant_ids=participant_ids, unresolved_participant_names=unresolved
+        )
+
+
+class RemoveChatParticipant:
+    def __init__(self, session: AsyncSession) -> None:
+        self.async_session = session
+
+    async def execute(self, user_id: int, chat_id: int, participant_id: int) -> None:
+        async with self.async_session.begin() as session:
+            # 作成者は参加者を外すことができ、参加者は自分が退出できる
+            members = await authorize(session, chat_id, user_id)
+            if user_id not in (members.created_by, participant_id):
+                raise HTTPException(
+                    status_code=status.HTTP_403_FORBIDDEN, detail=["Forbidden"]
+                )
+
+            removed = await ChatParticipants.delete_all(
+                session, chat_id, [participant_id]
+            )
+            if not removed:
+                raise HTTPException(
+                    status_code=status.HTTP_404_NOT_FOUND,
+                    detail=["Participant not found."],
+                )
+            await ChatEvent.create_membership_events(
+                session, chat_id, ChatEventType.PARTICIPANT_REMOVED, removed
+            )
+
+        await _apply_membership_change(
+            chat_id, ChatEventType.PARTICIPANT_REMOVED, removed
+        )
@@ -1,17 +1,29 @@
 from fastapi import APIRouter, Body, Depends, Path, Request, status
-from fastapi_cache.decorator import cache
+from fastapi.responses import StreamingResponse
 
 from app.commons.authentication import AccessTokenAuthentication
+from app.commons.streaming import NDJSON_MEDIA_TYPE, ndjson_response
 from app.models.schema import AccessTokenSchema
 
 from .schema import (
+    AddChatParticipantRequest,
+    AddChatParticipantResponse,
     CreateChatRequest,
     CreateChatResponse,
+    ReadAllChatParticipantRequest,
     ReadAllChatParticipantResponse,
     ReadAllChatRequest,
     ReadAllChatResponse,
+    StreamAllChatRequest,
+)
+from .use_cases import (
+    AddChatParticipant,
+    CreateChat,
+    DeleteChat,
+    ReadAllChat,
+    ReadAllChatParticipant,
+    RemoveChatParticipant,
 )
-from .use_cases import CreateChat, DeleteChat, ReadAllChat, ReadAllChatParticipant
 
 router = APIRouter(prefix="/chats")
 
@@ -23,17 +35,33 @@ router = APIRouter(prefix="/chats")
     ],
     status_code=status.HTTP_200_OK,
 )
-@cache(expire=10)
 async def read_all_chats(
     query_params: ReadAllChatRequest = Depends(),
     schema: AccessTokenSchema = Depends(AccessTokenAuthentication.get_current_user),
     use_case: ReadAllChat = Depends(),
 ) -> ReadAllChatResponse:
     return ReadAllChatResponse(
-        chats=[chat async for chat in use_case.execute(schema.user_id, query_params)]
+        chats=await use_case.execute_cached(schema.user_id, query_params)
     )
 
 
+@router.get(
+    "/stream",
+    dependencies=[
+        Depends(AccessTokenAuthentication.get_current_user),
+    ],
+    status_code=status.HTTP_200_OK,
+    response_class=StreamingResponse,
+    responses={200: {"content": {NDJSON_MEDIA_TYPE: {}}}},
+)
+async def stream_all_chats(
+    query_params: StreamAllChatRequest = Depends(),
+    schema: AccessTokenSchema = Depends(AccessTokenAuthentication.get_current_user),
+    use_case: ReadAllChat = Depends(),
+) -> StreamingResponse:
+    return await ndjson_response(use_case.stream(schema.user_id, query_params))
+
+
 @router.get(
     "/{chat_id}/participants",
     dependencies=[
@@ -41,19 +69,46 @@ async def read_all_chats(
     ],
     status_code=status.HTTP_200_OK,
 )
-@cache(expire=10)
 async def read_all_chat_participants(
     request: Request,
     chat_id: int = Path(..., description=""),
+    query_params: ReadAllChatParticipantRequest = Depends(),
     schema: AccessTokenSchema = Depends(AccessTokenAuthentication.get_current_user),
     use_case: ReadAllChatParticipant = Depends(),
 ) -> ReadAllChatParticipantResponse:
-    return ReadAllChatParticipantResponse(
-        participants=[
-            participant
-            async for participant in use_case.execute(schema.user_id, chat_id)
-        ]
-    )
+    return await use_case.execute_cached(schema.user_id, chat_id, query_params)
+
+
+@router.post(
+    "/{chat_id}/participants",
+    dependencies=[
+        Depends(AccessTokenAuthentication.get_current_user),
+    ],
+    status_code=status.HTTP_200_OK,
+)
+async def add_chat_participants(
+    chat_id: int = Path(..., description=""),
+    request: AddChatParticipantRequest = Body(...),
+    schema: AccessTokenSchema = Depends(AccessTokenAuthentication.get_current_user),
+    use_case: AddChatParticipant = Depends(),
+) -> AddChatParticipantResponse:
+    return await use_case.execute(schema.user_id, chat_id, request)
+
+
+@router.delete(
+    "/{chat_id}/participants/{participant_id}",
+    dependencies=[
+        Depends(AccessTokenAuthentication.get_current_user),
+    ],
+    status_code=status.HTTP_204_NO_CONTENT,
+)
+async def remove_chat_participant(
+    chat_id: int = Path(..., description=""),
+    participant_id: int = Path(..., description=""),
+    schema: AccessTokenSchema = Depends(AccessTokenAuthentication.get_current_user),
+    use_case: RemoveChatParticipant = Depends(),
+) -> None:
+    await use_case.execute(schema.user_id, chat_id, participant_id)
 
 
 @router.post(
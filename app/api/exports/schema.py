@@ -0,0 +1,21 @@
+from pydantic import BaseModel, Field
+
+from app.models import MessageSchema
+
+
+class ExportMessageResponse(MessageSchema):
+    chat_id: int = Field(..., description="The ID of the chat.")
+
+
+class CreateExportResponse(BaseModel):
+    job_id: str = Field(..., description="The ID of the export job.")
+    status: str = Field(..., description="The status of the export job.")
+
+
+class ReadExportResponse(BaseModel):
+    job_id: str = Field(..., description="The ID of the export job.")
+    chat_id: int = Field(..., description="The ID of the exported chat.")
+    status: str = Field(..., description="The status of the export job.")
+    url: str | None = Field(
+        None, description="The presigned download link of the archive."
+    )
@@ -0,0 +1,157 @@
+import asyncio
+import contextlib
+import gzip
+import tempfile
+import time
+import uuid
+from pathlib import Path
+
+from fastapi import BackgroundTasks, HTTPException, status
+
+from app.commons.chat_membership import authorize
+from app.commons.logging import logger
+from app.commons.redis_cache import RedisCache
+from app.commons.storage import LocalStorage, get_storage
+from app.commons.types import CacheType, ExportStatus
+from app.db import AsyncSession
+from app.models import Message
+from app.settings import settings
+
+from .schema import CreateExportResponse, ExportMessageResponse, ReadExportResponse
+
+EXPORT_CONTENT_TYPE = "application/x-ndjson"
+ACTIVE_EXPORT_STATUSES = (ExportStatus.PENDING.value, ExportStatus.RUNNING.value)
+
+
+class CreateExport:
+    def __init__(
+        self, session: AsyncSession, background_tasks: BackgroundTasks
+    ) -> None:
+        self.async_session = session
+        self.background_tasks = background_tasks
+        self.cache = RedisCache(cache_type=CacheType.EXPORT_JOBS)
+        self.storage = get_storage()
+
+    async def execute(self, user_id: int, chat_id: int) -> CreateExportResponse:
+        async with self.async_session() as session:
+            # チャットの関係者でない場合は403エラーを返却する
+            await authorize(session, chat_id, user_id)
+
+        job: dict = {
+            "job_id": uuid.uuid4().hex,
+            "chat_id": chat_id,
+            "user_id": user_id,
+            "status": ExportStatus.PENDING.value,
+            "key": None,
+            "heartbeat_at": time.time(),
+        }
+        await self.cache.set(job["job_id"], job, settings.EXPORT_JOB_EXPIRY)
+
+        # レスポンス返却後にバックグラウンドで書き出す
+        self.background_tasks.add_task(self.export, job)
+        return CreateExportResponse(job_id=job["job_id"], status=job["status"])
+
+    async def export(self, job: dict) -> None:
+        await self._update(job, ExportStatus.RUNNING)
+        # プロセスが落ちた場合に失敗とみなせるよう、実行中は定期的に進捗を記録する
+        heartbeat_task = asyncio.create_task(self._heartbeat(job))
+        key = f"exports/{job['chat_id']}/{job['job_id']}.ndjson.gz"
+        try:
+            with tempfile.NamedTemporaryFile(suffix=".ndjson.gz") as file:
+                # バッチごとにgzipへ書き込み、メモリ使用量をバッチサイズ分に抑える
+                # 圧縮はイベントループを止めないようスレッドで行う
+                with gzip.GzipFile(fileobj=file, mode="wb") as archive:
+                    lines: list[bytes] = []
+                    async with self.async_session() as session:
+                        async for message in Message.read_all_for_export(
+                            session, job["chat_id"], settings.EXPORT_BATCH_SIZE
+                        ):
+                            line = ExportMessageResponse.model_validate(message)
+                            data = line.model_dump_json().encode("utf-8")
+                            lines.append(data + b"\n")
+                            if len(lines) >= settings.EXPORT_BATCH_SIZE:
+                                await asyncio.to_thread(archive.writelines, lines)
+                                lines = []
+                    if lines:
+                        await asyncio.to_thread(archive.writelines, lines)
+                    await asyncio.to_thread(archive.close)
+                file.flush()
+                await self.storage.upload_file(
+                    Path(file.name), key, EXPORT_CONTENT_TYPE
+                )
+        except Exception:
+            logger.exception(f"Failed to export chat {job['chat_id']}.")
+            export_status = ExportStatus.FAILED
+        else:
+            job["key"] = key
+            export_status = ExportStatus.COMPLETED
+        finally:
+            await self._stop(heartbeat_task)
+        await self._update(job, export_status)
+
+    async def _heartbeat(self, job: dict) -> None:
+        while True:
+            await asyncio.sleep(settings.EXPORT_HEARTBEAT_INTERVAL)
+            await self._update(job, ExportStatus.RUNNING)
+
+    async def _stop(self, task: asyncio.Task) -> None:
+        # 完了後に実行中へ戻さないよう、書き込み中の記録も待ってから終了する
+        task.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await task
+
+    async def _update(self, job: dict, export_status: ExportStatus) -> None:
+        job["status"] = export_status.value
+        job["heartbeat_at"] = time.time()
+        await self.cache.set(job["job_id"], job, settings.EXPORT_JOB_EXPIRY)
+
+
+class ReadExport:
+    def __init__(self, session: AsyncSession) -> None:
+        self.async_session = session
+        self.cache = RedisCache(cache_type=CacheType.EXPORT_JOBS)
+        self.storage = get_storage()
+
+    async def execute(self, user_id: int, job_id: str) -> ReadExportResponse:
+        job = await self.cache.get(job_id)
+        if not job or job["user_id"] != user_id:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND, detail=["Export not found."]
+            )
+
+        # 進捗の記録が途絶えたジョブは、実行していたプロセスが落ちたとみなす
+        heartbeat_at = job.get("heartbeat_at", 0)
+        if (
+            job["status"] in ACTIVE_EXPORT_STATUSES
+            and heartbeat_at + settings.EXPORT_JOB_TIMEOUT < time.time()
+        ):
+            job["status"] = ExportStatus.FAILED.value
+            await self.cache.set(job["job_id"], job, settings.EXPORT_JOB_EXPIRY)
+
+        url = None
+        if job["status"] == ExportStatus.COMPLETED.value and job["key"]:
+            # 有効期限付きのリンクを都度発行する
+            url = await self.storage.generate_url(
+                job["key"], settings.EXPORT_LINK_EXPIRY
+            )
+        return ReadExportResponse(
+            job_id=job["job_id"], chat_id=job["chat_id"], status=job["status"], url=url
+        )
+
+
+class DownloadExport:
+    def __init__(self) -> None:
+        self.storage = get_storage()
+
+    async def execute(self, token: str) -> Path:
+        # S3利用時は署名付きURLから直接ダウンロードする
+        path = (
+            self.storage.resolve(token)
+            if isinstance(self.storage, LocalStorage)
+            else None
+        )
+        if not path:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND, detail=["Export not found."]
+            )
+        return path
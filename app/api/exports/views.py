@@ -0,0 +1,53 @@
+from fastapi import APIRouter, Depends, Path, status
+from fastapi.responses import FileResponse
+
+from app.commons.authentication import AccessTokenAuthentication
+from app.models.schema import AccessTokenSchema
+
+from .schema import CreateExportResponse, ReadExportResponse
+from .use_cases import CreateExport, DownloadExport, ReadExport
+
+router = APIRouter(prefix="/exports")
+
+
+@router.post(
+    "/chat/{chat_id}",
+    dependencies=[
+        Depends(AccessTokenAuthentication.get_current_user),
+    ],
+    status_code=status.HTTP_202_ACCEPTED,
+)
+async def create(
+    chat_id: int = Path(..., description=""),
+    schema: AccessTokenSchema = Depends(AccessTokenAuthentication.get_current_user),
+    use_case: CreateExport = Depends(),
+) -> CreateExportResponse:
+    return await use_case.execute(schema.user_id, chat_id)
+
+
+@router.get(
+    "/download/{token}",
+    status_code=status.HTTP_200_OK,
+    response_class=FileResponse,
+)
+async def download(
+    token: str = Path(..., description=""),
+    use_case: DownloadExport = Depends(),
+) -> FileResponse:
+    path = await use_case.execute(token)
+    return FileResponse(path, media_type="application/gzip", filename=path.name)
+
+
+@router.get(
+    "/{job_id}",
+    dependencies=[
+        Depends(AccessTokenAuthentication.get_current_user),
+    ],
+    status_code=status.HTTP_200_OK,
+)
+async def read(
+    job_id: str = Path(..., description=""),
+    schema: AccessTokenSchema = Depends(AccessTokenAuthentication.get_current_user),
+    use_case: ReadExport = Depends(),
+) -> ReadExportResponse:
+    return await use_case.execute(schema.user_id, job_id)
@@ -4,8 +4,10 @@ from app.commons.logging import LoggingContextRoute
 
 from .auth.views import router as auth_router
 from .chats.views import router as chats_router
+from .exports.views import router as exports_router
 from .messages.views import router as messages_router
 from .sessions.views import router as sessions_router
+from .sync.views import router as sync_router
 from .users.views import router as users_router
 
 router = APIRouter()
@@ -15,3 +17,5 @@ router.include_router(sessions_router)
 router.include_router(users_router)
 router.include_router(chats_router)
 router.include_router(messages_router)
+router.include_router(sync_router)
+router.include_router(exports_router)
@@ -1,6 +1,7 @@
 from pydantic import BaseModel, Field, conint
 
 from app.models import MessageSchema
+from app.settings import settings
 
 
 class ReadAllMessageRequest(BaseModel):
@@ -8,6 +9,11 @@ class ReadAllMessageRequest(BaseModel):
     limit: conint(ge=0, le=10)  # type: ignore
 
 
+class StreamAllMessageRequest(BaseModel):
+    offset: conint(ge=0) = 0  # type: ignore
+    limit: conint(ge=0, le=1000) = 1000  # type: ignore
+
+
 class ReadMessageResponse(MessageSchema):
     pass
 
@@ -22,3 +28,13 @@ class CreateMessageRequest(BaseModel):
 
 class CreateMessageResponse(MessageSchema):
     pass
+
+
+class CreateMessageBatchRequest(BaseModel):
+    messages: list[CreateMessageRequest] = Field(
+        ..., min_length=1, max_length=settings.MESSAGE_BATCH_MAX_SIZE
+    )
+
+
+class CreateMessageBatchResponse(BaseModel):
+    messages: list[CreateMessageResponse]
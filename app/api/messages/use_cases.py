@@ -1,210 +1,292 @@
-import json
+import random
 from typing import AsyncIterator
 
-import boto3
-from fastapi import HTTPException, status
+from fastapi import BackgroundTasks, HTTPException, status
 from sqlalchemy import select
 
-from app.commons.logging import logger
-from app.commons.types import NotificationType, PlatformType
+from app.commons.chat_membership import authorize
+from app.commons.idempotency import IdempotencyKey
+from app.commons.message_cache import RecentMessageCache
+from app.commons.message_outbox import wake_message_outbox_relay
+from app.commons.message_partitions import MessagePartitionManager
+from app.commons.notifications import MessageNotifier
 from app.db import AsyncSession
-from app.models import Chat, ChatParticipants, Message, Session, User
+from app.models import Message, User
 from app.settings import settings
 
 from .schema import (
+    CreateMessageBatchRequest,
+    CreateMessageBatchResponse,
     CreateMessageRequest,
     CreateMessageResponse,
     ReadAllMessageRequest,
     ReadAllMessageResponse,
     ReadMessageResponse,
+    StreamAllMessageRequest,
 )
 
 
 class ReadAllMessage:
     def __init__(self, session: AsyncSession) -> None:
         self.async_session = session
+        self.message_cache = RecentMessageCache()
 
     async def execute(
         self, user_id: int, chat_id: int, params: ReadAllMessageRequest
     ) -> AsyncIterator[ReadAllMessageResponse]:
+        window: list[ReadMessageResponse] | None = None
+        version = ""
         async with self.async_session.begin() as session:
-            # Messageの関係者でない場合は403エラーを返却する
-            if (
-                not (
-                    await session.execute(
-                        select(Chat).where(
-                            Chat.id == chat_id, Chat.created_by == user_id
-                        )
-                    )
-                ).scalar()
-                and not (
-                    await session.execute(
-                        select(ChatParticipants).where(
-                            ChatParticipants.chat_id == chat_id,
-                            ChatParticipants.user_id == user_id,
+            # チャットの関係者でない場合は403エラーを返却する
+            await authorize(session, chat_id, user_id)
+
+            if self.message_cache.is_cacheable(params.offset, params.limit):
+                cached = await self.message_cache.read(
+                    chat_id, params.offset, params.limit
+                )
+                if cached is not None:
+                    messages = [
+                        ReadMessageResponse.model_validate(message)
+                        for message in cached
+                    ]
+                    if random.random() < settings.RECENT_MESSAGES_CACHE_VERIFY_RATE:
+                        await self.message_cache.verify(session, chat_id)
+                else:
+                    # 最新N件をまとめて取得してキャッシュに格納する
+                    version = await self.message_cache.version(chat_id)
+                    window = [
+                        ReadMessageResponse.model_validate(message)
+                        async for message in Message.read_all(
+                            session, chat_id, 0, self.message_cache.size
                         )
-                    )
-                ).scalar()
-            ):
-                raise HTTPException(
-                    status_code=status.HTTP_403_FORBIDDEN, detail=["Forbidden"]
+                    ]
+                    messages = window[params.offset : params.offset + params.limit]
+            else:
+                stmt = (
+                    select(Message)
+                    .where(Message.chat_id == chat_id)
+                    .order_by(Message.id.desc())
+                    .offset(params.offset)
+                    .limit(params.limit)
                 )
+                result = await session.execute(stmt)
+                messages = [
+                    ReadMessageResponse.model_validate(message)
+                    for message in result.scalars().all()
+                ]
 
-            stmt = (
-                select(Message)
-                .where(Message.chat_id == chat_id)
-                .order_by(Message.id.desc())
-                .offset(params.offset)
-                .limit(params.limit)
-            )
-            result = await session.execute(stmt)
-            messages = result.scalars().all()
             message_ids = []
             for message in messages:
                 if message.sender_id != user_id and user_id not in message.read_by_list:
                     message.read_by_list.append(user_id)
                     message_ids.append(message.id)
 
-            # 既読にしたメッセージを返す
-            for message in messages:
-                yield ReadMessageResponse.model_validate(message)  # type: ignore
-
             if message_ids:
                 await Message.update_read_by_list(session, message_ids, user_id)
 
+        # コミット後にキャッシュへ反映する
+        if window is not None:
+            await self.message_cache.fill(chat_id, version, window)
+        elif message_ids:
+            await self.message_cache.mark_read(chat_id, message_ids, user_id)
 
-class CreateMessage:
+        # 既読にしたメッセージを返す
+        for message in messages:
+            yield message  # type: ignore
+
+
+class StreamAllMessage:
     def __init__(self, session: AsyncSession) -> None:
         self.async_session = session
-        self.mail_client = (
-            None
-            if settings.ENV == "local"
-            else boto3.client("ses", region_name="ap-northeast-1")
-        )
-        self.push_client = (
-            None
-            if settings.ENV == "local"
-            else boto3.client("sns", region_name="ap-northeast-1")
-        )
+        self.message_cache = RecentMessageCache()
+
+    async def execute(
+        self, user_id: int, chat_id: int, params: StreamAllMessageRequest
+    ) -> AsyncIterator[ReadMessageResponse]:
+        # クライアントの受信を待つ間はトランザクションを保持しないよう、
+        # STREAM_BATCH_SIZE件ずつ短いトランザクションで読み込み、IDで続きを取得する
+        offset, remaining, before_id = params.offset, params.limit, None
+        while True:
+            limit = min(remaining, settings.STREAM_BATCH_SIZE)
+            messages: list[ReadMessageResponse] = []
+            message_ids = []
+            async with self.async_session.begin() as session:
+                if before_id is None:
+                    # チャットの関係者でない場合は403エラーを返却する
+                    await authorize(session, chat_id, user_id)
+
+                async for row in Message.read_all(
+                    session, chat_id, offset, limit, before_id
+                ):
+                    message = ReadMessageResponse.model_validate(row)
+                    if (
+                        message.sender_id != user_id
+                        and user_id not in message.read_by_list
+                    ):
+                        message.read_by_list.append(user_id)
+                        message_ids.append(message.id)
+                    messages.append(message)
+
+                if message_ids:
+                    await Message.update_read_by_list(session, message_ids, user_id)
+
+            if message_ids:
+                await self.message_cache.mark_read(chat_id, message_ids, user_id)
+            for message in messages:
+                yield message
+
+            remaining -= len(messages)
+            if len(messages) < limit or remaining == 0:
+                break
+            offset, before_id = 0, messages[-1].id
+
+
+class ReadArchivedMessage:
+    def __init__(self, session: AsyncSession) -> None:
+        self.async_session = session
+        self.partition_manager = MessagePartitionManager()
+
+    async def execute(
+        self, user_id: int, chat_id: int, params: StreamAllMessageRequest
+    ) -> AsyncIterator[ReadMessageResponse]:
+        async with self.async_session() as session:
+            # チャットの関係者でない場合は403エラーを返却する
+            await authorize(session, chat_id, user_id)
+
+            # 退避済みのパーティションはストレージから読み出す
+            async for message in self.partition_manager.read_archived(
+                session, chat_id, params.offset, params.limit
+            ):
+                yield ReadMessageResponse.model_validate(message.model_dump())
+
+
+class CreateMessage:
+    def __init__(
+        self, session: AsyncSession, background_tasks: BackgroundTasks
+    ) -> None:
+        self.async_session = session
+        self.background_tasks = background_tasks
+        self.message_cache = RecentMessageCache()
+        self.notifier = MessageNotifier()
 
     async def execute(
+        self,
+        user_id: int,
+        chat_id: int,
+        request: CreateMessageRequest,
+        idempotency_key: str | None = None,
+    ) -> CreateMessageResponse:
+        if not idempotency_key:
+            return await self._create(user_id, chat_id, request)
+
+        # 同じキーの再送には作成済みのメッセージを返し、作成も通知もしない
+        idempotency = IdempotencyKey(user_id, chat_id, idempotency_key, request.content)
+        stored = await idempotency.begin()
+        if stored is not None:
+            return CreateMessageResponse.model_validate(stored)
+        try:
+            response = await self._create(user_id, chat_id, request)
+        except BaseException:
+            await idempotency.release()
+            raise
+        await idempotency.complete(response)
+        return response
+
+    async def _create(
         self, user_id: int, chat_id: int, request: CreateMessageRequest
     ) -> CreateMessageResponse:
-        async with self.async_session() as a_session:
-            # Messageの関係者でない場合は403エラーを返却する
-            if (
-                not (
-                    await a_session.execute(
-                        select(Chat).where(
-                            Chat.id == chat_id, Chat.created_by == user_id
-                        )
-                    )
-                ).scalar()
-                and not (
-                    await a_session.execute(
-                        select(ChatParticipants).where(
-                            ChatParticipants.chat_id == chat_id,
-                            ChatParticipants.user_id == user_id,
-                        )
-                    )
-                ).scalar()
-            ):
+        async with self.async_session.begin() as a_session:
+            # 作成者か参加者の場合のみMessageを作成し、送信者のusernameも取得する
+            created = await Message.create_authorized(
+                a_session, chat_id, user_id, request.content
+            )
+            if not created:
                 raise HTTPException(
                     status_code=status.HTTP_403_FORBIDDEN, detail=["Forbidden"]
                 )
+            message, username = created
+            response = CreateMessageResponse.model_validate(message)
 
-            # Chatを取得
-            chat = await Chat.read_by_id(a_session, chat_id)
-            if not chat:
-                raise HTTPException(
-                    status_code=status.HTTP_404_NOT_FOUND, detail=["Chat not found."]
-                )
+        wake_message_outbox_relay()
+        await self.message_cache.push(chat_id, [response])
 
+        # 通知先の解決と送信はレスポンス返却後に行う
+        self.background_tasks.add_task(
+            self.notifier.notify_chat,
+            self.async_session,
+            chat_id,
+            f"{username}: {request.content}",
+            exclude_user_ids={user_id},
+            message_id=response.id,
+        )
+        return response
+
+
+class CreateMessageBatch:
+    def __init__(
+        self, session: AsyncSession, background_tasks: BackgroundTasks
+    ) -> None:
+        self.async_session = session
+        self.background_tasks = background_tasks
+        self.message_cache = RecentMessageCache()
+        self.notifier = MessageNotifier()
+
+    async def execute(
+        self, user_id: int, chat_id: int, request: CreateMessageBatchRequest
+    ) -> CreateMessageBatchResponse:
         async with self.async_session.begin() as a_session:
-            # Messageを作成
-            message = await Message.create(
-                a_session, chat_id=chat_id, sender_id=user_id, content=request.content
-            )
+            # チャットの関係者でない場合は403エラーを返却する
+            await authorize(a_session, chat_id, user_id)
 
             posted_user = await User.read_by_id(a_session, user_id)
             if not posted_user:
                 raise HTTPException(
                     status_code=status.HTTP_404_NOT_FOUND, detail=["User not found."]
                 )
+            username = posted_user.username
 
-            # Chat参加者に通知
-            async for (
-                participant
-            ) in ChatParticipants.read_all_active_notification_users(
-                a_session, chat_id
-            ):
-                user = participant.user
-                if not user:
-                    continue
-
-                message_payload = f"{posted_user.username}: {request.content}"
-                if user.notification_type == NotificationType.EMAIL:
-                    # send email
-                    body = {
-                        "Text": {
-                            "Data": message_payload,
-                            "Charset": "UTF-8",
-                        }
-                    }
-                    if self.mail_client:
-                        response = self.mail_client.send_email(
-                            Source="{} <{}>".format("SENDER", "from-address@test.com"),
-                            Destination={
-                                "ToAddresses": [user.email],
-                            },
-                            Message={
-                                "Subject": {
-                                    "Data": "[chat-service] posted message",
-                                    "Charset": "UTF-8",
-                                },
-                                "Body": body,
-                            },
-                        )
-                        logger.info(response)
-                    else:
-                        logger.info(body)
-                elif user.notification_type == NotificationType.MOBILE_PUSH:
-                    pass
-                    # read_all_mobileを呼び出し、device_tokenがnullでなく、UNKNOWNでないユーザーに絞る
-                    async for session in Session.read_all_mobile(a_session, [user.id]):
-                        if (
-                            session.user_id == user.id
-                            and session.platform_type != PlatformType.UNKNOWN
-                        ):
-                            if session.platform_type == PlatformType.ANDROID:
-                                message_body = {"GCM": json.dumps(message_payload)}
-                            elif session.platform_type == PlatformType.IOS:
-                                message_body = {
-                                    "APNS": json.dumps(
-                                        {"aps": {"alert": message_payload}}
-                                    )
-                                }
-
-                            if self.push_client:
-                                response = self.push_client.publish(
-                                    TargetArn=session.device_token,  # device_tokenをTargetArnに設定
-                                    MessageStructure="json",
-                                    Message=json.dumps(message_body),
-                                )
-                                logger.info(response)
-                            else:
-                                logger.info(message_payload)
-
-            return CreateMessageResponse.model_validate(message)
+            # Messageをまとめて作成
+            messages = await Message.create_all(
+                a_session,
+                chat_id,
+                user_id,
+                [message.content for message in request.messages],
+            )
+            responses = [
+                CreateMessageResponse.model_validate(message) for message in messages
+            ]
+
+        # 入室中のクライアントへは1件のイベントでまとめて配信される
+        wake_message_outbox_relay()
+        await self.message_cache.push(chat_id, responses)
+
+        # 参加者ごとに1件の通知にまとめる
+        payload = f"{username}: {responses[0].content}"
+        if len(responses) > 1:
+            payload += f" (+{len(responses) - 1} more messages)"
+        self.background_tasks.add_task(
+            self.notifier.notify_chat,
+            self.async_session,
+            chat_id,
+            payload,
+            exclude_user_ids={user_id},
+            message_id=responses[0].id,
+        )
+
+        return CreateMessageBatchResponse(messages=responses)
 
 
 class DeleteMessage:
     def __init__(self, session: AsyncSession) -> None:
         self.async_session = session
+        self.message_cache = RecentMessageCache()
 
     async def execute(self, user_id: int, message_id: int) -> None:
         async with self.async_session.begin() as session:
             message = await Message.read_by_id_and_user_id(session, message_id, user_id)
             if not message:
                 return
+            chat_id = message.chat_id
             await Message.delete(session, message_id, user_id)
+
+        await self.message_cache.remove(chat_id, [message_id])
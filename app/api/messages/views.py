@@ -1,15 +1,27 @@
-from fastapi import APIRouter, Body, Depends, Path, Request, status
+from fastapi import APIRouter, Body, Depends, Header, Path, Request, status
+from fastapi.responses import StreamingResponse
 
 from app.commons.authentication import AccessTokenAuthentication
+from app.commons.streaming import NDJSON_MEDIA_TYPE, ndjson_response
 from app.models.schema import AccessTokenSchema
 
 from .schema import (
+    CreateMessageBatchRequest,
+    CreateMessageBatchResponse,
     CreateMessageRequest,
     CreateMessageResponse,
     ReadAllMessageRequest,
     ReadAllMessageResponse,
+    StreamAllMessageRequest,
+)
+from .use_cases import (
+    CreateMessage,
+    CreateMessageBatch,
+    DeleteMessage,
+    ReadAllMessage,
+    ReadArchivedMessage,
+    StreamAllMessage,
 )
-from .use_cases import CreateMessage, DeleteMessage, ReadAllMessage
 
 router = APIRouter(prefix="/messages")
 
@@ -35,6 +47,46 @@ async def read_all(
     )
 
 
+@router.get(
+    "/chat/{chat_id}/stream",
+    dependencies=[
+        Depends(AccessTokenAuthentication.get_current_user),
+    ],
+    status_code=status.HTTP_200_OK,
+    response_class=StreamingResponse,
+    responses={200: {"content": {NDJSON_MEDIA_TYPE: {}}}},
+)
+async def stream_all(
+    chat_id: int = Path(..., description=""),
+    query_params: StreamAllMessageRequest = Depends(),
+    schema: AccessTokenSchema = Depends(AccessTokenAuthentication.get_current_user),
+    use_case: StreamAllMessage = Depends(),
+) -> StreamingResponse:
+    return await ndjson_response(
+        use_case.execute(schema.user_id, chat_id, query_params)
+    )
+
+
+@router.get(
+    "/chat/{chat_id}/archive",
+    dependencies=[
+        Depends(AccessTokenAuthentication.get_current_user),
+    ],
+    status_code=status.HTTP_200_OK,
+    response_class=StreamingResponse,
+    responses={200: {"content": {NDJSON_MEDIA_TYPE: {}}}},
+)
+async def read_archived(
+    chat_id: int = Path(..., description=""),
+    query_params: StreamAllMessageRequest = Depends(),
+    schema: AccessTokenSchema = Depends(AccessTokenAuthentication.get_current_user),
+    use_case: ReadArchivedMessage = Depends(),
+) -> StreamingResponse:
+    return await ndjson_response(
+        use_case.execute(schema.user_id, chat_id, query_params)
+    )
+
+
 @router.post(
     "/chat/{chat_id}",
     dependencies=[
@@ -45,9 +97,31 @@ async def read_all(
 async def create(
     request: CreateMessageRequest = Body(...),
     chat_id: int = Path(..., description=""),
+    idempotency_key: str | None = Header(
+        None,
+        alias="Idempotency-Key",
+        max_length=255,
+        description="A client generated key to safely retry the request.",
+    ),
     schema: AccessTokenSchema = Depends(AccessTokenAuthentication.get_current_user),
     use_case: CreateMessage = Depends(),
 ) -> CreateMessageResponse:
+    return await use_case.execute(schema.user_id, chat_id, request, idempotency_key)
+
+
+@router.post(
+    "/chat/{chat_id}/batch",
+    dependencies=[
+        Depends(AccessTokenAuthentication.get_current_user),
+    ],
+    status_code=status.HTTP_201_CREATED,
+)
+async def create_batch(
+    request: CreateMessageBatchRequest = Body(...),
+    chat_id: int = Path(..., description=""),
+    schema: AccessTokenSchema = Depends(AccessTokenAuthentication.get_current_user),
+    use_case: CreateMessageBatch = Depends(),
+) -> CreateMessageBatchResponse:
     return await use_case.execute(schema.user_id, chat_id, request)
 
 
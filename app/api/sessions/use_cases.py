@@ -1,7 +1,11 @@
 from fastapi import HTTPException, status
 
+from app.commons.notification_targets import (
+    DeviceEndpointCache,
+    NotificationTargetCache,
+)
 from app.db import AsyncSession
-from app.models import Session, SessionSchema
+from app.models import Chat, Session, SessionSchema
 
 
 class UpdateSession:
@@ -22,4 +26,10 @@ class UpdateSession:
                 session, device_token=device_token, platform_type=platform_type
             )
             await session.refresh(session_instance)
-            return SessionSchema.model_validate(session_instance)
+            response = SessionSchema.model_validate(session_instance)
+            chat_ids = await Chat.read_ids_by_user_id(session, user_id)
+
+        # 参加しているチャットの通知先に端末を反映する
+        await DeviceEndpointCache().invalidate([user_id])
+        await NotificationTargetCache().invalidate(chat_ids)
+        return response
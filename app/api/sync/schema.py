@@ -0,0 +1,42 @@
+from pydantic import BaseModel, Field, conint, constr
+
+from app.models import MessageSchema
+
+
+class ReadSyncRequest(BaseModel):
+    # "{xid}.{id}"。xidのないトークン (初回の0や以前のイベントID) はxid=0として扱う
+    token: constr(pattern=r"^\d+(\.\d+)?$") = "0"  # type: ignore
+    limit: conint(ge=1, le=500) = 100  # type: ignore
+
+    @property
+    def since(self) -> tuple[int, int]:
+        xid, _, event_id = self.token.rpartition(".")
+        return int(xid or 0), int(event_id)
+
+
+class ReadCursorResponse(BaseModel):
+    chat_id: int = Field(..., description="The ID of the chat.")
+    user_id: int = Field(..., description="The ID of the user who read the messages.")
+    message_ids: list[int] = Field(..., description="The IDs of the read messages.")
+    last_read_message_id: int = Field(
+        ..., description="The latest message ID read by the user."
+    )
+
+
+class MembershipResponse(BaseModel):
+    chat_id: int = Field(..., description="The ID of the chat.")
+    user_id: int = Field(..., description="The ID of the user.")
+    is_member: bool = Field(
+        ..., description="Whether the user joined (true) or left (false) the chat."
+    )
+
+
+class ReadSyncResponse(BaseModel):
+    messages: list[MessageSchema]
+    deleted_message_ids: list[int]
+    read_cursors: list[ReadCursorResponse]
+    memberships: list[MembershipResponse]
+    next_token: str = Field(..., description="The token for the next sync request.")
+    has_more: bool = Field(
+        ..., description="Whether more changes remain after next_token."
+    )
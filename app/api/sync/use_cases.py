@@ -0,0 +1,79 @@
+from app.commons.types import ChatEventType
+from app.db import AsyncSession
+from app.models import Chat, ChatEvent, Message, MessageSchema
+
+from .schema import (
+    MembershipResponse,
+    ReadCursorResponse,
+    ReadSyncRequest,
+    ReadSyncResponse,
+)
+
+
+class ReadSync:
+    def __init__(self, session: AsyncSession) -> None:
+        self.async_session = session
+
+    async def execute(self, user_id: int, params: ReadSyncRequest) -> ReadSyncResponse:
+        async with self.async_session() as session:
+            chat_ids = await Chat.read_ids_by_user_id(session, user_id)
+
+            # 次のチャンクがあるか判定するため1件多く取得する
+            events = [
+                event
+                async for event in ChatEvent.read_all_since(
+                    session, user_id, chat_ids, params.since, params.limit + 1
+                )
+            ]
+            has_more = len(events) > params.limit
+            events = events[: params.limit]
+
+            created_ids: list[int] = []
+            deleted_ids: list[int] = []
+            read_cursors: list[ReadCursorResponse] = []
+            memberships: list[MembershipResponse] = []
+            for event in events:
+                if event.event_type == ChatEventType.MESSAGE_CREATED:
+                    created_ids.extend(event.message_ids)
+                elif event.event_type == ChatEventType.MESSAGE_DELETED:
+                    deleted_ids.extend(event.message_ids)
+                elif event.event_type == ChatEventType.MESSAGES_READ:
+                    read_cursors.append(
+                        ReadCursorResponse(
+                            chat_id=event.chat_id,
+                            user_id=event.user_id,
+                            message_ids=event.message_ids,
+                            last_read_message_id=max(event.message_ids),
+                        )
+                    )
+                elif event.user_id is not None:
+                    memberships.append(
+                        MembershipResponse(
+                            chat_id=event.chat_id,
+                            user_id=event.user_id,
+                            is_member=(
+                                event.event_type == ChatEventType.PARTICIPANT_ADDED
+                            ),
+                        )
+                    )
+
+            # 既に削除されたメッセージは取得対象から外れる
+            messages = (
+                [
+                    MessageSchema.model_validate(message)
+                    async for message in Message.read_all_by_ids(session, created_ids)
+                ]
+                if created_ids
+                else []
+            )
+
+            return ReadSyncResponse(
+                messages=messages,
+                deleted_message_ids=deleted_ids,
+                read_cursors=read_cursors,
+                memberships=memberships,
+                next_token=(
+                    f"{events[-1].xid}.{events[-1].id}" if events else params.token
+                ),
+                has_more=has_more,
+            )
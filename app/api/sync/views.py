@@ -0,0 +1,24 @@
+from fastapi import APIRouter, Depends, status
+
+from app.commons.authentication import AccessTokenAuthentication
+from app.models.schema import AccessTokenSchema
+
+from .schema import ReadSyncRequest, ReadSyncResponse
+from .use_cases import ReadSync
+
+router = APIRouter(prefix="/sync")
+
+
+@router.get(
+    "",
+    dependencies=[
+        Depends(AccessTokenAuthentication.get_current_user),
+    ],
+    status_code=status.HTTP_200_OK,
+)
+async def read_sync(
+    query_params: ReadSyncRequest = Depends(),
+    schema: AccessTokenSchema = Depends(AccessTokenAuthentication.get_current_user),
+    use_case: ReadSync = Depends(),
+) -> ReadSyncResponse:
+    return await use_case.execute(schema.user_id, query_params)
@@ -3,6 +3,8 @@ from typing import Literal
 
 from pydantic import BaseModel, EmailStr, Field, field_validator
 
+from app.settings import settings
+
 
 class ReadUserResponse(BaseModel):
     id: int
@@ -15,6 +17,7 @@ class ReadUserResponse(BaseModel):
     email: str
     new_email: str | None
     notification_type: str
+    notification_digest_delay: int | None
 
 
 class UpdateUserRequest(BaseModel):
@@ -24,6 +27,9 @@ class UpdateUserRequest(BaseModel):
     last_name: str | None = Field(..., max_length=30)
     new_email: EmailStr | None
     notification_type: Literal["disabled", "mobile_push", "email"]
+    notification_digest_delay: int | None = Field(
+        None, ge=1, le=settings.NOTIFICATION_DIGEST_MAX_DELAY
+    )
 
     @field_validator("first_name", mode="before")
     def check_first_name(cls, v):
@@ -3,11 +3,13 @@ from fastapi import HTTPException, status
 
 from app.api.auth.schema import TwoFaRequest
 from app.commons.logging import logger
+from app.commons.notification_targets import NotificationTargetCache
 from app.commons.redis_cache import RedisCache
+from app.commons.response_cache import ResponseCache, chat_scope
 from app.commons.types import CacheType
 from app.commons.utils import generate_two_fa_code
 from app.db import AsyncSession
-from app.models import User, UserSchema
+from app.models import Chat, User, UserSchema
 from app.models.schema import AccessTokenSchema
 from app.settings import settings
 
@@ -76,7 +78,13 @@ class UpdateUser:
                 else:
                     logger.info(body)
 
-            return UserSchema.model_validate(user)
+            response = UserSchema.model_validate(user)
+            chat_ids = await Chat.read_ids_by_user_id(session, schema.user_id)
+
+        # 参加しているチャットの参加者一覧と通知先にプロフィールが含まれる
+        await ResponseCache.invalidate(chat_scope(i) for i in chat_ids)
+        await NotificationTargetCache().invalidate(chat_ids)
+        return response
 
 
 class PartialUpdateUser:
@@ -114,4 +122,9 @@ class PartialUpdateUser:
             await user.update(session, email=new_email, new_email=None)
             await session.refresh(user)
 
-            return UserSchema.model_validate(user)
+            response = UserSchema.model_validate(user)
+            chat_ids = await Chat.read_ids_by_user_id(session, schema.user_id)
+
+        await ResponseCache.invalidate(chat_scope(i) for i in chat_ids)
+        await NotificationTargetCache().invalidate(chat_ids)
+        return response
@@ -0,0 +1,21 @@
+"""
+保持期間を過ぎたメッセージを削除する
+
+    python -m app.commands.apply_retention
+
+中断した場合は retention_runs に記録された位置から再開する。
+"""
+
+import asyncio
+
+from app.commons.logging import logger
+from app.commons.message_retention import MessageRetention
+
+
+def main() -> None:
+    deleted = asyncio.run(MessageRetention().execute())
+    logger.info(f"Deleted {deleted} messages.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,242 @@
+"""
+旧システムのメッセージをCOPYで一括投入する
+
+    python -m app.commands.import_messages messages.ndjson.gz \
+        --user-map users.csv --chat-map chats.csv --defer-indexes
+
+入力は1行1メッセージのNDJSON (gzip可) で、chat_id, sender_id, content, created_at,
+read_by_list を持つ。エクスポート機能で書き出したアーカイブもそのまま取り込める。
+ID対応表は「旧ID,新ID」形式のCSVで、対応表にないIDの行はスキップする。
+メッセージIDは各行のcreated_atから採番する (2024-01-01より前の行はその時刻で採番する)。
+"""
+
+import argparse
+import asyncio
+import csv
+import gzip
+import json
+import time
+from dataclasses import dataclass, field
+from datetime import UTC, datetime
+from pathlib import Path
+from typing import IO, Iterator
+
+import asyncpg  # type: ignore
+from sqlalchemy import Index
+
+from app.commons.logging import logger
+from app.commons.message_cache import RecentMessageCache
+from app.commons.snowflake import (
+    EPOCH_MS,
+    WorkerIdLease,
+    run_worker_id_lease,
+    snowflake,
+)
+from app.db import async_engine
+from app.models import Message
+from app.settings import settings
+
+COLUMNS = [
+    "id",
+    "chat_id",
+    "sender_id",
+    "content",
+    "read_by_list",
+    "created_at",
+    "updated_at",
+]
+CONTENT_MAX_LENGTH = 1024
+SNOWFLAKE_EPOCH = datetime.fromtimestamp(EPOCH_MS / 1000, UTC).replace(tzinfo=None)
+
+
+@dataclass
+class ImportStats:
+    imported: int = 0
+    skipped: int = 0
+    chat_ids: set[int] = field(default_factory=set)
+    started_at: float = field(default_factory=time.monotonic)
+
+    @property
+    def throughput(self) -> float:
+        elapsed = time.monotonic() - self.started_at
+        return self.imported / elapsed if elapsed else 0.0
+
+
+def load_id_map(path: Path | None) -> dict[int, int] | None:
+    if path is None:
+        return None
+    with path.open(newline="") as file:
+        return {int(old): int(new) for old, new in csv.reader(file) if old.isdigit()}
+
+
+def open_input(path: Path) -> IO[str]:
+    if path.suffix == ".gz":
+        return gzip.open(path, "rt", encoding="utf-8")
+    return path.open(encoding="utf-8")
+
+
+def parse_datetime(value: str) -> datetime:
+    # created_atはタイムゾーンなしのUTCで保存する
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo:
+        parsed = parsed.astimezone(UTC).replace(tzinfo=None)
+    return parsed
+
+
+def message_ids(batch: list[tuple]) -> list[int]:
+    """作成時刻から採番し、取り込んだメッセージも作成順に並ぶようにする"""
+
+    return snowflake.generate_many_at(
+        max(created_at, SNOWFLAKE_EPOCH) for *_, created_at, _ in batch
+    )
+
+
+class MessageImporter:
+    def __init__(
+        self,
+        user_ids: dict[int, int] | None,
+        chat_ids: dict[int, int] | None,
+        batch_size: int,
+    ) -> None:
+        self.user_ids = user_ids
+        self.chat_ids = chat_ids
+        self.batch_size = batch_size
+        self.message_cache = RecentMessageCache()
+
+    def _remap(self, ids: dict[int, int] | None, value: int) -> int | None:
+        return value if ids is None else ids.get(value)
+
+    def convert(self, row: dict) -> tuple | None:
+        """1行をCOPY用のタプルに変換する。取り込めない行はNoneを返す"""
+        try:
+            chat_id = self._remap(self.chat_ids, int(row["chat_id"]))
+            sender_id = self._remap(self.user_ids, int(row["sender_id"]))
+            content = str(row["content"])
+            created_at = parse_datetime(row["created_at"])
+            read_by_list = [
+                user_id
+                for user_id in (
+                    self._remap(self.user_ids, int(old))
+                    for old in row.get("read_by_list") or []
+                )
+                if user_id is not None
+            ]
+        except (KeyError, TypeError, ValueError):
+            return None
+        if chat_id is None or sender_id is None:
+            return None
+        if not content or len(content) > CONTENT_MAX_LENGTH:
+            return None
+        return (chat_id, sender_id, content, read_by_list, created_at, created_at)
+
+    def _batches(self, lines: Iterator[str], stats: ImportStats) -> Iterator[list]:
+        batch = []
+        for line in lines:
+            if not line.strip():
+                continue
+            try:
+                record = self.convert(json.loads(line))
+            except json.JSONDecodeError:
+                record = None
+            if record is None:
+                stats.skipped += 1
+                continue
+            batch.append(record)
+            if len(batch) >= self.batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    @staticmethod
+    def _deferrable_indexes() -> list[Index]:
+        # 制約を伴わない二次インデックスのみ削除して投入後に再作成する
+        return [
+            index
+            for index in Message.__table__.indexes  # type: ignore
+            if not index.unique and "id" not in index.columns
+        ]
+
+    async def execute(self, path: Path, defer_indexes: bool) -> ImportStats:
+        # APIサーバーと重複しないワーカーIDでメッセージIDを採番する
+        lease_task = None
+        if settings.SNOWFLAKE_WORKER_ID is None:
+            lease = WorkerIdLease()
+            if await lease.acquire() is None:
+                raise RuntimeError("No snowflake worker id is available.")
+            lease_task = asyncio.create_task(run_worker_id_lease(lease))
+        try:
+            return await self._execute(path, defer_indexes)
+        finally:
+            if lease_task:
+                lease_task.cancel()
+
+    async def _execute(self, path: Path, defer_indexes: bool) -> ImportStats:
+        stats = ImportStats()
+        indexes = self._deferrable_indexes() if defer_indexes else []
+
+        async with async_engine.connect() as conn:
+            for index in indexes:
+                logger.info(f"Dropping index {index.name}.")
+                await conn.run_sync(index.drop)
+            await conn.commit()
+
+            try:
+                raw_connection = await conn.get_raw_connection()
+                connection: asyncpg.Connection = raw_connection.driver_connection  # type: ignore
+                with open_input(path) as file:
+                    for batch in self._batches(file, stats):
+                        # バッチごとにコミットし、失敗時は投入済みの件数から再開できる
+                        ids = message_ids(batch)
+                        records = [
+                            (message_id, *record)
+                            for message_id, record in zip(ids, batch)
+                        ]
+                        async with connection.transaction():
+                            await connection.copy_records_to_table(
+                                Message.__tablename__, records=records, columns=COLUMNS
+                            )
+                        stats.imported += len(batch)
+                        stats.chat_ids.update(record[0] for record in batch)
+                        logger.info(
+                            f"Imported {stats.imported} messages "
+                            f"(skipped {stats.skipped}, "
+                            f"{stats.throughput:.0f} rows/sec)."
+                        )
+            finally:
+                for index in indexes:
+                    logger.info(f"Creating index {index.name}.")
+                    await conn.run_sync(index.create)
+                await conn.commit()
+
+        # 取り込んだチャットの最新メッセージキャッシュを破棄する
+        for chat_id in stats.chat_ids:
+            await self.message_cache.invalidate(chat_id)
+        return stats
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Bulk import messages via COPY.")
+    parser.add_argument("path", type=Path)
+    parser.add_argument("--user-map", type=Path, default=None)
+    parser.add_argument("--chat-map", type=Path, default=None)
+    parser.add_argument("--batch-size", type=int, default=10000)
+    parser.add_argument(
+        "--defer-indexes",
+        action="store_true",
+        help="Drop secondary indexes during the import and rebuild them afterwards.",
+    )
+    args = parser.parse_args()
+
+    importer = MessageImporter(
+        load_id_map(args.user_map), load_id_map(args.chat_map), args.batch_size
+    )
+    stats = asyncio.run(importer.execute(args.path, args.defer_indexes))
+    logger.info(
+        f"Done: imported {stats.imported}, skipped {stats.skipped}, "
+        f"{stats.throughput:.0f} rows/sec."
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+"""
+messagesの月次パーティションを管理する
+
+    python -m app.commands.manage_partitions list
+    python -m app.commands.manage_partitions create --months-ahead 3
+    python -m app.commands.manage_partitions archive --older-than-months 12
+"""
+
+import argparse
+import asyncio
+from datetime import date
+
+from app.commons.logging import logger
+from app.commons.message_partitions import (
+    MessagePartitionManager,
+    add_months,
+    month_start,
+)
+from app.db import AsyncSessionLocal
+from app.settings import settings
+
+
+async def execute(args: argparse.Namespace) -> None:
+    manager = MessagePartitionManager()
+    if args.command == "archive":
+        # 切り離し、書き出し、削除はそれぞれ別のトランザクションで行う
+        before = add_months(month_start(date.today()), -args.older_than_months)
+        archives = await manager.archive_before(before)
+        for archive in archives:
+            logger.info(
+                f"Archived {archive.partition_name}: "
+                f"{archive.row_count} messages -> {archive.storage_key}"
+            )
+        return
+
+    async with AsyncSessionLocal.begin() as session:
+        if args.command == "list":
+            for name in await manager.read_partitions(session):
+                logger.info(name)
+        elif args.command == "create":
+            created = await manager.ensure_partitions(session, args.months_ahead)
+            logger.info(f"Created {len(created)} partitions: {created}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Manage messages partitions.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("list")
+    create = subparsers.add_parser("create")
+    create.add_argument(
+        "--months-ahead", type=int, default=settings.MESSAGE_PARTITION_MONTHS_AHEAD
+    )
+    archive = subparsers.add_parser("archive")
+    archive.add_argument("--older-than-months", type=int, required=True)
+    args = parser.parse_args()
+
+    asyncio.run(execute(args))
+
+
+if __name__ == "__main__":
+    main()
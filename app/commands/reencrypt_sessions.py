@@ -0,0 +1,59 @@
+"""
+sessionsのdevice_tokenとrefresh_tokenを暗号化し直す
+
+    python -m app.commands.reencrypt_sessions
+    python -m app.commands.reencrypt_sessions --mode aes_gcm --sleep 0.1
+
+SESSION_ENCRYPTION_MODEやENCRYPTION_KEY_VERSIONを切り替えた後に実行し、以前の方式や
+鍵で暗号化された行をバッチごとにコミットしながら現在の方式と鍵で暗号化し直す。
+稼働中に実行でき、中断した場合も最初から実行し直せば残りの行のみを処理する。
+"""
+
+import argparse
+import asyncio
+
+from app.commons.logging import logger
+from app.commons.session_encryption import reencrypt_sessions_batch
+from app.db import async_engine
+from app.settings import settings
+
+
+async def execute(args: argparse.Namespace) -> int:
+    after_id = 0
+    total = 0
+    while True:
+        async with async_engine.begin() as connection:
+            ids = await connection.run_sync(
+                reencrypt_sessions_batch, args.mode, after_id, args.batch_size
+            )
+        if not ids:
+            break
+        after_id = ids[-1]
+        total += len(ids)
+        logger.info(f"Re-encrypted {total} sessions (last id: {after_id}).")
+        # レプリケーションや稼働中のリクエストへの負荷を抑える
+        if args.sleep:
+            await asyncio.sleep(args.sleep)
+    await async_engine.dispose()
+    return total
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Re-encrypt sessions.")
+    parser.add_argument(
+        "--mode",
+        choices=["pgp", "aes_gcm"],
+        default=settings.SESSION_ENCRYPTION_MODE,
+    )
+    parser.add_argument(
+        "--batch-size", type=int, default=settings.SESSION_REENCRYPT_BATCH_SIZE
+    )
+    parser.add_argument("--sleep", type=float, default=0.0)
+    args = parser.parse_args()
+
+    total = asyncio.run(execute(args))
+    logger.info(f"Re-encrypted {total} sessions.")
+
+
+if __name__ == "__main__":
+    main()
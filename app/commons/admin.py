@@ -1,6 +1,6 @@
 from sqladmin import ModelView
 
-from app.models import Chat, Message, User
+from app.models import Chat, Message, RetentionPolicy, User
 
 
 class UserAdmin(ModelView, model=User):
@@ -42,4 +42,16 @@ class MessageAdmin(ModelView, model=Message):
         return await super().scaffold_form()
 
 
-admins = [UserAdmin, ChatAdmin, MessageAdmin]
+class RetentionPolicyAdmin(ModelView, model=RetentionPolicy):
+    column_list = [column.key for column in RetentionPolicy.__table__.columns]
+    column_filters = [column.key for column in RetentionPolicy.__table__.columns]
+    form_columns = [column.key for column in RetentionPolicy.__table__.columns]
+
+    async def scaffold_list(self):
+        return await super().scaffold_list()
+
+    async def scaffold_form(self):
+        return await super().scaffold_form()
+
+
+admins = [UserAdmin, ChatAdmin, MessageAdmin, RetentionPolicyAdmin]
@@ -0,0 +1,181 @@
+import json
+import logging
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Collection
+
+import redis
+from fastapi import HTTPException, status
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.db import PubSubSessionLocal
+from app.models import Chat
+from app.settings import settings
+
+from .redis_cache import redis_connection
+from .types import CacheType, ChatEventType
+
+logger = logging.getLogger(__name__)
+
+# チャットのチャネルにメッセージと区別して配信する参加者の変更
+MEMBERSHIP_EVENT = "participants"
+
+# KEYS: members, version
+# ARGV: expected_version, expiry, members
+_FILL_SCRIPT = """
+if (redis.call('GET', KEYS[2]) or '0') ~= ARGV[1] then
+    return 0
+end
+redis.call('SET', KEYS[1], ARGV[3], 'EX', ARGV[2])
+return 1
+"""
+
+
+@dataclass(frozen=True)
+class ChatMembers:
+    created_by: int
+    participant_ids: frozenset[int]
+
+    def __contains__(self, user_id: object) -> bool:
+        return user_id == self.created_by or user_id in self.participant_ids
+
+
+class ChatMembershipCache:
+    """
+    チャットごとの作成者と参加者の集合をプロセス内とRedisの2段でキャッシュする
+
+    プロセス内のキャッシュは短い期間で失効させ、他のプロセスでの変更も
+    CHAT_MEMBERSHIP_LOCAL_EXPIRY秒以内に反映する。Redisへの格納は読み込み前の
+    バージョンと一致する場合のみ行い、無効化と競合した古い内容を残さない。
+    """
+
+    _local: OrderedDict[int, tuple[float, ChatMembers]] = OrderedDict()
+
+    def __init__(self) -> None:
+        self.cache_type = CacheType.MEMBERSHIP
+        self.expiry = settings.CHAT_MEMBERSHIP_CACHE_EXPIRY
+        self.local_expiry = settings.CHAT_MEMBERSHIP_LOCAL_EXPIRY
+        self.local_size = settings.CHAT_MEMBERSHIP_LOCAL_SIZE
+
+    @staticmethod
+    def _keys(chat_id: int) -> list[str]:
+        return [f"{chat_id}:members", f"{chat_id}:version"]
+
+    @classmethod
+    def clear_local(cls) -> None:
+        cls._local.clear()
+
+    def _read_local(self, chat_id: int) -> ChatMembers | None:
+        entry = self._local.get(chat_id)
+        if entry is None:
+            return None
+        expires_at, members = entry
+        if expires_at < time.monotonic():
+            self._local.pop(chat_id, None)
+            return None
+        self._local.move_to_end(chat_id)
+        return members
+
+    def _write_local(self, chat_id: int, members: ChatMembers) -> None:
+        if not self.local_size:
+            return
+        self._local[chat_id] = (time.monotonic() + self.local_expiry, members)
+        self._local.move_to_end(chat_id)
+        while len(self._local) > self.local_size:
+            self._local.popitem(last=False)
+
+    async def read(self, session: AsyncSession, chat_id: int) -> ChatMembers | None:
+        """チャットの作成者と参加者。チャットが存在しなければNone"""
+        members = self._read_local(chat_id)
+        if members is not None:
+            return members
+
+        keys = self._keys(chat_id)
+        version = ""
+        async with redis_connection(self.cache_type) as cache:
+            try:
+                cached, version = await cache.mget(*keys)
+                version = version or "0"
+            except redis.exceptions.RedisError:
+                logger.warning("ChatMembershipCache failed to read.", exc_info=True)
+                cached = None
+        if cached:
+            data = json.loads(cached)
+            members = ChatMembers(data["created_by"], frozenset(data["participants"]))
+            self._write_local(chat_id, members)
+            return members
+
+        row = await Chat.read_members(session, chat_id)
+        if row is None:
+            return None
+        created_by, participant_ids = row
+        members = ChatMembers(created_by, frozenset(participant_ids))
+        self._write_local(chat_id, members)
+
+        if version:
+            value = json.dumps(
+                {"created_by": created_by, "participants": sorted(participant_ids)}
+            )
+            async with redis_connection(self.cache_type) as cache:
+                try:
+                    await cache.eval(
+                        _FILL_SCRIPT, 2, *keys, version, self.expiry, value
+                    )
+                except redis.exceptions.RedisError:
+                    logger.warning("ChatMembershipCache failed to fill.", exc_info=True)
+        return members
+
+    async def invalidate(self, chat_id: int) -> None:
+        self._local.pop(chat_id, None)
+        keys = self._keys(chat_id)
+        async with redis_connection(self.cache_type) as cache:
+            try:
+                async with cache.pipeline(transaction=True) as pipe:
+                    pipe.incr(keys[1])
+                    pipe.expire(keys[1], self.expiry)
+                    pipe.delete(keys[0])
+                    await pipe.execute()
+            except redis.exceptions.RedisError:
+                logger.warning(
+                    "ChatMembershipCache failed to invalidate.", exc_info=True
+                )
+
+
+async def authorize(session: AsyncSession, chat_id: int, user_id: int) -> ChatMembers:
+    """チャットの作成者か参加者でない場合は403エラーを返却する"""
+    members = await ChatMembershipCache().read(session, chat_id)
+    if members is None or user_id not in members:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail=["Forbidden"])
+    return members
+
+
+async def publish_membership_event(
+    chat_id: int, event_type: ChatEventType, user_ids: Collection[int]
+) -> None:
+    """参加者の変更を接続中のWebSocketへ配信し、参加者の一覧を読み直させる"""
+    if not user_ids:
+        return
+    payload = {
+        "type": MEMBERSHIP_EVENT,
+        "event": event_type.name.lower(),
+        "chat_id": chat_id,
+        "user_ids": sorted(user_ids),
+    }
+    try:
+        await PubSubSessionLocal.publish(
+            f"chat_messages_{chat_id}", json.dumps(payload)
+        )
+    except redis.exceptions.RedisError:
+        logger.warning("Failed to publish the membership event.", exc_info=True)
+
+
+def parse_membership_event(data: str | bytes) -> dict | None:
+    """チャネルのデータが参加者の変更であれば返却する"""
+    try:
+        payload = json.loads(data)
+    except ValueError:
+        return None
+    if isinstance(payload, dict) and payload.get("type") == MEMBERSHIP_EVENT:
+        return payload
+    return None
@@ -0,0 +1,108 @@
+import asyncio
+import time
+
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from app.db import AsyncSessionLocal
+from app.models import Chat, ChatParticipants, Message, MessageArchive, MessageOutbox
+from app.settings import settings
+
+from .logging import logger
+from .message_cache import RecentMessageCache
+from .storage import LocalStorage, S3Storage, get_storage
+
+# チャットを削除した場合は定期実行を待たずに削除を始める
+_wakeup = asyncio.Event()
+
+
+def wake_chat_purge() -> None:
+    _wakeup.set()
+
+
+class ChatPurge:
+    """
+    論理削除したチャットのメッセージと参加者を削除し、最後にチャットを削除する
+
+    削除待ちのチャットを1件ロックし、batch_size件ずつ小さなトランザクションで削除する。
+    複数のプロセスで実行しても、ロック中のチャットは飛ばすため同じチャットを重複して
+    処理しない。削除件数が1秒あたりの上限を超えないよう間隔を空ける。
+    退避済みのメッセージも、チャットごとのアーカイブをストレージから削除する。
+    """
+
+    def __init__(
+        self,
+        session: async_sessionmaker | None = None,
+        storage: S3Storage | LocalStorage | None = None,
+    ) -> None:
+        self.async_session = session or AsyncSessionLocal
+        self.storage = storage or get_storage()
+        self.message_cache = RecentMessageCache()
+        self.batch_size = settings.CHAT_PURGE_BATCH_SIZE
+        self.rows_per_second = settings.CHAT_PURGE_ROWS_PER_SECOND
+
+    async def step(self) -> tuple[bool, int]:
+        """1バッチ分を削除し、(続きがあるか, 削除件数)を返す"""
+        purged_chat_id = None
+        async with self.async_session.begin() as session:
+            chat_id = await Chat.read_deleted_id_for_update(session)
+            if chat_id is None:
+                return False, 0
+
+            deleted = await Message.delete_batch_by_chat_id(
+                session, chat_id, self.batch_size
+            )
+            if deleted < self.batch_size:
+                deleted += await ChatParticipants.delete_batch_by_chat_id(
+                    session, chat_id, self.batch_size - deleted
+                )
+            if deleted < self.batch_size:
+                # 子の行を削除し終えたらチャットを削除する
+                await self._purge_archives(session, chat_id)
+                await MessageOutbox.delete_by_chat_id(session, chat_id)
+                await Chat.purge(session, chat_id)
+                purged_chat_id = chat_id
+
+        if purged_chat_id is not None:
+            await self.message_cache.invalidate(purged_chat_id)
+            logger.info(f"Chat {purged_chat_id} was purged.")
+        return True, deleted
+
+    async def _purge_archives(self, session: AsyncSession, chat_id: int) -> None:
+        # 削除は冪等なため、コミットに失敗した場合も次回にやり直せる。
+        # 月ごとにまとめた以前のアーカイブは他のチャットを含むため、対象から外すのみ
+        async for archive in MessageArchive.read_all_by_chat_id(session, chat_id):
+            if archive.per_chat:
+                await self.storage.delete_file(archive.chat_storage_key(chat_id))
+        await MessageArchive.remove_chat_id(session, chat_id)
+
+    async def execute(self) -> int:
+        """削除待ちのチャットがなくなるまで繰り返す"""
+        total = 0
+        has_more = True
+        while has_more:
+            started_at = time.monotonic()
+            has_more, deleted = await self.step()
+            total += deleted
+
+            # 削除件数に応じて待機し、1秒あたりの削除件数を上限以下に保つ
+            if self.rows_per_second > 0:
+                elapsed = time.monotonic() - started_at
+                await asyncio.sleep(max(0.0, deleted / self.rows_per_second - elapsed))
+        return total
+
+
+async def run_chat_purge() -> None:
+    """起動中は論理削除したチャットを削除し続ける"""
+    purge = ChatPurge()
+    while True:
+        _wakeup.clear()
+        try:
+            deleted = await purge.execute()
+            if deleted:
+                logger.info(f"Chat purge deleted {deleted} rows.")
+        except Exception:
+            logger.exception("Failed to purge deleted chats.")
+        try:
+            await asyncio.wait_for(_wakeup.wait(), timeout=settings.CHAT_PURGE_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
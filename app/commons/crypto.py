@@ -0,0 +1,113 @@
+import base64
+import hashlib
+import hmac
+import os
+from functools import lru_cache
+
+from cryptography.exceptions import InvalidTag
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+
+from app.settings import settings
+
+NONCE_SIZE = 12
+
+
+class DecryptionError(Exception):
+    pass
+
+
+@lru_cache
+def derive_key(secret: str, purpose: str) -> bytes:
+    """SECRETから用途ごとの256ビットの鍵を導出する。導出した鍵はプロセス内で使い回す"""
+    return HKDF(
+        algorithm=hashes.SHA256(),
+        length=32,
+        salt=None,
+        info=f"chat-service:{purpose}".encode(),
+    ).derive(secret.encode())
+
+
+class AesGcmCipher:
+    """
+    アプリケーション側でAES-GCMを使って文字列を暗号化・復号する
+
+    暗号文は12バイトのnonceを先頭に付けてURL-safeなBase64で表す。purposeを鍵の
+    導出とAADの両方に使うため、用途の異なる暗号文を取り違えて復号することはない。
+    """
+
+    def __init__(self, purpose: str, secret: str | None = None) -> None:
+        self.purpose = purpose
+        self.aad = purpose.encode()
+        self.aesgcm = AESGCM(derive_key(secret or settings.SECRET, purpose))
+
+    def encrypt(self, plaintext: str) -> str:
+        nonce = os.urandom(NONCE_SIZE)
+        ciphertext = self.aesgcm.encrypt(nonce, plaintext.encode(), self.aad)
+        return base64.urlsafe_b64encode(nonce + ciphertext).decode()
+
+    def decrypt(self, token: str) -> str:
+        try:
+            data = base64.urlsafe_b64decode(token)
+            plaintext = self.aesgcm.decrypt(
+                data[:NONCE_SIZE], data[NONCE_SIZE:], self.aad
+            )
+        except (InvalidTag, ValueError) as e:
+            raise DecryptionError(f"Failed to decrypt the {self.purpose}.") from e
+        return plaintext.decode()
+
+
+class VersionedCipher:
+    """
+    鍵のバージョンを "v{version}:" として暗号文の先頭に付けるAES-GCM
+
+    ENCRYPTION_KEYSにバージョンごとの秘密を設定し (未設定の場合はSECRETをバージョン1
+    とする)、ENCRYPTION_KEY_VERSIONの鍵で暗号化する。復号には暗号文のバージョンの鍵を
+    使うため、鍵を切り替えた後も暗号化し直すまで以前の暗号文を読める。
+    """
+
+    def __init__(
+        self,
+        purpose: str,
+        keys: dict[int, str] | None = None,
+        version: int | None = None,
+    ) -> None:
+        self.purpose = purpose
+        self.keys = keys or settings.ENCRYPTION_KEYS or {1: settings.SECRET}
+        self.version = version or settings.ENCRYPTION_KEY_VERSION
+        if self.version not in self.keys:
+            raise ValueError(f"Encryption key version {self.version} is not set.")
+        self._ciphers: dict[int, AesGcmCipher] = {}
+
+    @property
+    def prefix(self) -> str:
+        return f"v{self.version}:"
+
+    def _cipher(self, version: int) -> AesGcmCipher:
+        cipher = self._ciphers.get(version)
+        if cipher is None:
+            if version not in self.keys:
+                raise DecryptionError(f"Encryption key version {version} is not set.")
+            cipher = AesGcmCipher(self.purpose, self.keys[version])
+            self._ciphers[version] = cipher
+        return cipher
+
+    def encrypt(self, plaintext: str) -> str:
+        return self.prefix + self._cipher(self.version).encrypt(plaintext)
+
+    def decrypt(self, token: str) -> str:
+        version, _, data = token.partition(":")
+        if not version.startswith("v") or not version[1:].isdigit():
+            raise DecryptionError(f"Failed to decrypt the {self.purpose}.")
+        return self._cipher(int(version[1:])).decrypt(data)
+
+
+def blind_index(value: str, purpose: str) -> str:
+    """
+    暗号化した列を検索するためのHMAC-SHA256
+
+    暗号文はnonceで毎回変わるため、等価検索にはSECRETから導出した鍵のHMACを使う。
+    """
+    key = derive_key(settings.SECRET, f"{purpose}:index")
+    return hmac.new(key, value.encode(), hashlib.sha256).hexdigest()
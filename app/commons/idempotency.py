@@ -0,0 +1,83 @@
+import hashlib
+import json
+import logging
+
+import redis
+from fastapi import HTTPException, status
+from pydantic import BaseModel
+
+from app.settings import settings
+
+from .redis_cache import redis_connection
+from .types import CacheType
+
+logger = logging.getLogger(__name__)
+
+PENDING = "pending"
+
+
+class IdempotencyKey:
+    """
+    クライアントが指定した冪等キーごとに最初の処理結果を記録する
+
+    最初のリクエストがキーを処理中として確保し、完了後にレスポンスを保存する。
+    同じキーの再送には保存済みのレスポンスを返し、処理中であれば409エラーとする。
+    Redisに接続できない場合は冪等性を保証せずに処理を続ける。
+    """
+
+    def __init__(self, user_id: int, chat_id: int, key: str, payload: str) -> None:
+        self.cache_type = CacheType.IDEMPOTENCY
+        self.key = f"{user_id}:{chat_id}:{key}"
+        # 同じキーで異なる内容が送られた場合を検出する
+        self.fingerprint = hashlib.sha256(payload.encode()).hexdigest()
+        self.expiry = settings.IDEMPOTENCY_KEY_EXPIRY
+        self.pending_expiry = settings.IDEMPOTENCY_PENDING_EXPIRY
+
+    async def begin(self) -> dict | None:
+        """初回はキーを確保してNone、処理済みなら保存済みのレスポンスを返す"""
+        async with redis_connection(self.cache_type) as cache:
+            try:
+                if await cache.set(self.key, PENDING, nx=True, ex=self.pending_expiry):
+                    return None
+                stored = await cache.get(self.key)
+            except redis.exceptions.RedisError:
+                logger.warning("IdempotencyKey failed to begin.", exc_info=True)
+                return None
+
+        if stored is None:
+            # 確認の間に期限切れになった場合は改めて確保する
+            return await self.begin()
+        if stored == PENDING:
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail=["A request with the same idempotency key is in progress."],
+            )
+        record = json.loads(stored)
+        if record["fingerprint"] != self.fingerprint:
+            raise HTTPException(
+                status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                detail=["The idempotency key was used for a different request."],
+            )
+        return record["response"]
+
+    async def complete(self, response: BaseModel) -> None:
+        record = {
+            "fingerprint": self.fingerprint,
+            "response": response.model_dump(mode="json"),
+        }
+        async with redis_connection(self.cache_type) as cache:
+            try:
+                await cache.set(
+                    self.key, json.dumps(record, ensure_ascii=False), ex=self.expiry
+                )
+            except redis.exceptions.RedisError:
+                logger.warning("IdempotencyKey failed to complete.", exc_info=True)
+
+    async def release(self) -> None:
+        """処理に失敗した場合に確保したキーを解放し、再送で処理し直せるようにする"""
+        async with redis_connection(self.cache_type) as cache:
+            try:
+                if await cache.get(self.key) == PENDING:
+                    await cache.delete(self.key)
+            except redis.exceptions.RedisError:
+                logger.warning("IdempotencyKey failed to release.", exc_info=True)
@@ -40,7 +40,9 @@ class LoggingContextRoute(APIRoute):
             record["request_time"] = str(duration)  # type: ignore
             record["status"] = response.status_code  # type: ignore
             # TODO: need masking
-            record["response_body"] = response.body.decode("utf-8")
+            # StreamingResponseはbodyを持たないため記録しない
+            if hasattr(response, "body"):
+                record["response_body"] = response.body.decode("utf-8")
             record["response_headers"] = {
                 k.decode("utf-8"): v.decode("utf-8") for (k, v) in response.headers.raw
             }  # type: ignore
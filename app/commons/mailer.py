@@ -0,0 +1,88 @@
+import asyncio
+import json
+from dataclasses import dataclass, field
+from typing import Sequence
+
+from app.settings import settings
+
+from .aws_client import AWSClient
+from .logging import logger
+from .types import AWSServiceType
+
+# SendBulkTemplatedEmailの1回の宛先数の上限
+SES_BULK_MAX_DESTINATIONS = 50
+
+
+@dataclass(frozen=True)
+class EmailMessage:
+    to: str
+    subject: str
+    body: str
+    # SESのテンプレートに渡す値。設定されていればテンプレートでまとめて送る
+    template_data: dict = field(default_factory=dict)
+
+
+class SesMailer:
+    """SESでメールを送る。テンプレートが設定されていれば宛先をまとめて送る"""
+
+    def __init__(self, source: str | None = None, template: str | None = None) -> None:
+        self.source = source or settings.NOTIFICATION_EMAIL_SOURCE
+        self.template = template or settings.NOTIFICATION_EMAIL_TEMPLATE
+
+    async def send(self, messages: Sequence[EmailMessage]) -> None:
+        client = await AWSClient.get_client(
+            AWSServiceType.SES, region_name=settings.REGION
+        )
+        templated = [m for m in messages if self.template and m.template_data]
+        for i in range(0, len(templated), SES_BULK_MAX_DESTINATIONS):
+            chunk = templated[i : i + SES_BULK_MAX_DESTINATIONS]
+            response = await asyncio.to_thread(
+                client.send_bulk_templated_email,
+                Source=self.source,
+                Template=self.template,
+                DefaultTemplateData=json.dumps(
+                    {key: "" for key in chunk[0].template_data}
+                ),
+                Destinations=[
+                    {
+                        "Destination": {"ToAddresses": [message.to]},
+                        "ReplacementTemplateData": json.dumps(
+                            message.template_data, ensure_ascii=False
+                        ),
+                    }
+                    for message in chunk
+                ],
+            )
+            for message, status in zip(chunk, response.get("Status", [])):
+                if status.get("Status") != "Success":
+                    logger.warning(f"Failed to send an email to {message.to}: {status}")
+
+        for message in messages:
+            if self.template and message.template_data:
+                continue
+            response = await asyncio.to_thread(
+                client.send_email,
+                Source=self.source,
+                Destination={"ToAddresses": [message.to]},
+                Message={
+                    "Subject": {"Data": message.subject, "Charset": "UTF-8"},
+                    "Body": {"Text": {"Data": message.body, "Charset": "UTF-8"}},
+                },
+            )
+            logger.info(response)
+
+
+class LocalMailer:
+    """ローカル開発とテスト用。送信せずに送ったメールを記録してログに出力する"""
+
+    def __init__(self) -> None:
+        self.sent: list[EmailMessage] = []
+
+    async def send(self, messages: Sequence[EmailMessage]) -> None:
+        for message in messages:
+            self.sent.append(message)
+            logger.info({"To": message.to, "Text": message.body})
+
+
+def get_mailer() -> SesMailer | LocalMailer:
+    return LocalMailer() if settings.ENV == "local" else SesMailer()
@@ -0,0 +1,353 @@
+import json
+import logging
+from typing import Sequence
+
+import redis
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models import Message, MessageSchema
+from app.settings import settings
+
+from .redis_cache import redis_connection
+from .types import CacheType
+
+logger = logging.getLogger(__name__)
+
+# KEYS: messages, bodies, reads, complete, hits, misses
+# ARGV: offset, limit
+_READ_SCRIPT = """
+local stop = tonumber(ARGV[1]) + tonumber(ARGV[2])
+if redis.call('EXISTS', KEYS[4]) == 0 and redis.call('ZCARD', KEYS[1]) < stop then
+    redis.call('INCR', KEYS[6])
+    return false
+end
+redis.call('INCR', KEYS[5])
+local ids = redis.call('ZREVRANGE', KEYS[1], ARGV[1], stop - 1)
+local result = {}
+if #ids == 0 then
+    return result
+end
+local bodies = redis.call('HMGET', KEYS[2], unpack(ids))
+local reads = redis.call('HMGET', KEYS[3], unpack(ids))
+for i = 1, #ids do
+    result[#result + 1] = bodies[i] or ''
+    result[#result + 1] = reads[i] or ''
+end
+return result
+"""
+
+# 以下の書き込み系スクリプトのKEYS: messages, bodies, reads, version, complete
+# ARGV: expected_version, expiry, complete, (id, body, reads)...
+_FILL_SCRIPT = """
+if (redis.call('GET', KEYS[4]) or '0') ~= ARGV[1] then
+    return 0
+end
+redis.call('DEL', KEYS[1], KEYS[2], KEYS[3], KEYS[5])
+for i = 4, #ARGV, 3 do
+    redis.call('ZADD', KEYS[1], ARGV[i], ARGV[i])
+    redis.call('HSET', KEYS[2], ARGV[i], ARGV[i + 1])
+    redis.call('HSET', KEYS[3], ARGV[i], ARGV[i + 2])
+end
+if ARGV[3] == '1' then
+    redis.call('SET', KEYS[5], '1')
+end
+for i = 1, 5 do
+    redis.call('EXPIRE', KEYS[i], ARGV[2])
+end
+return 1
+"""
+
+# ARGV: expiry, size, (id, body, reads)...
+_PUSH_SCRIPT = """
+redis.call('INCR', KEYS[4])
+redis.call('EXPIRE', KEYS[4], ARGV[1])
+if redis.call('EXISTS', KEYS[1]) == 0 and redis.call('EXISTS', KEYS[5]) == 0 then
+    return 0
+end
+for i = 3, #ARGV, 3 do
+    redis.call('ZADD', KEYS[1], ARGV[i], ARGV[i])
+    redis.call('HSET', KEYS[2], ARGV[i], ARGV[i + 1])
+    redis.call('HSET', KEYS[3], ARGV[i], ARGV[i + 2])
+end
+local size = tonumber(ARGV[2])
+if redis.call('ZCARD', KEYS[1]) > size then
+    local evicted = redis.call('ZRANGE', KEYS[1], 0, -(size + 1))
+    redis.call('ZREMRANGEBYRANK', KEYS[1], 0, -(size + 1))
+    redis.call('HDEL', KEYS[2], unpack(evicted))
+    redis.call('HDEL', KEYS[3], unpack(evicted))
+    redis.call('DEL', KEYS[5])
+end
+for i = 1, 5 do
+    redis.call('EXPIRE', KEYS[i], ARGV[1])
+end
+return 1
+"""
+
+# ARGV: expiry, user_id, id...
+_MARK_READ_SCRIPT = """
+redis.call('INCR', KEYS[4])
+redis.call('EXPIRE', KEYS[4], ARGV[1])
+for i = 3, #ARGV do
+    local current = redis.call('HGET', KEYS[3], ARGV[i])
+    if current == '' then
+        redis.call('HSET', KEYS[3], ARGV[i], ARGV[2])
+    elseif current and not string.find(
+        ',' .. current .. ',', ',' .. ARGV[2] .. ',', 1, true
+    ) then
+        redis.call('HSET', KEYS[3], ARGV[i], current .. ',' .. ARGV[2])
+    end
+end
+return 1
+"""
+
+# ARGV: expiry, id...
+_REMOVE_SCRIPT = """
+redis.call('INCR', KEYS[4])
+redis.call('EXPIRE', KEYS[4], ARGV[1])
+for i = 2, #ARGV do
+    redis.call('ZREM', KEYS[1], ARGV[i])
+    redis.call('HDEL', KEYS[2], ARGV[i])
+    redis.call('HDEL', KEYS[3], ARGV[i])
+end
+return 1
+"""
+
+STATS_HITS_KEY = "stats:hits"
+STATS_MISSES_KEY = "stats:misses"
+STATS_INCONSISTENCIES_KEY = "stats:inconsistencies"
+
+
+class RecentMessageCache:
+    """
+    チャットごとに最新N件のメッセージを保持するキャッシュ
+
+    メッセージIDのソート済みセット、シリアライズ済みの本文、既読者リストを
+    別々に保持し、書き込みはすべてLuaスクリプトでアトミックに反映する。
+    書き込みのたびにバージョンを進め、DBから読み込んだ内容は読み込み前の
+    バージョンと一致する場合のみキャッシュに格納する。
+    """
+
+    def __init__(self) -> None:
+        self.cache_type = CacheType.RECENT_MESSAGES
+        self.size = settings.RECENT_MESSAGES_CACHE_SIZE
+        self.expiry = settings.RECENT_MESSAGES_CACHE_EXPIRY
+
+    @staticmethod
+    def _keys(chat_id: int) -> list[str]:
+        return [
+            f"{chat_id}:messages",
+            f"{chat_id}:bodies",
+            f"{chat_id}:reads",
+            f"{chat_id}:version",
+            f"{chat_id}:complete",
+        ]
+
+    @staticmethod
+    def _entry(message: MessageSchema) -> list[str | int]:
+        return [
+            message.id,
+            message.model_dump_json(exclude={"read_by_list"}),
+            ",".join(str(user_id) for user_id in message.read_by_list),
+        ]
+
+    @staticmethod
+    def _decode(body: str, reads: str) -> dict:
+        message = json.loads(body)
+        message["read_by_list"] = [
+            int(user_id) for user_id in reads.split(",") if user_id
+        ]
+        return message
+
+    def is_cacheable(self, offset: int, limit: int) -> bool:
+        return 0 < limit and offset + limit <= self.size
+
+    async def read(self, chat_id: int, offset: int, limit: int) -> list[dict] | None:
+        if not self.is_cacheable(offset, limit):
+            return None
+
+        keys = self._keys(chat_id)
+        async with redis_connection(self.cache_type) as cache:
+            try:
+                result = await cache.eval(
+                    _READ_SCRIPT,
+                    6,
+                    *keys[:3],
+                    keys[4],
+                    STATS_HITS_KEY,
+                    STATS_MISSES_KEY,
+                    offset,
+                    limit,
+                )
+            except redis.exceptions.RedisError:
+                logger.warning("RecentMessageCache failed to read.", exc_info=True)
+                return None
+
+        if result is None:
+            return None
+
+        pairs = list(zip(result[::2], result[1::2]))
+        if any(not body for body, _ in pairs):
+            # 本文が欠けている場合は破損とみなして破棄する
+            await self.invalidate(chat_id)
+            return None
+        return [self._decode(body, reads) for body, reads in pairs]
+
+    async def version(self, chat_id: int) -> str:
+        async with redis_connection(self.cache_type) as cache:
+            try:
+                return await cache.get(f"{chat_id}:version") or "0"
+            except redis.exceptions.RedisError:
+                return ""
+
+    async def fill(
+        self, chat_id: int, version: str, messages: Sequence[MessageSchema]
+    ) -> bool:
+        """新しい順に並んだ最新メッセージでキャッシュを構築する"""
+        if not self.size or not version:
+            return False
+
+        messages = messages[: self.size]
+        complete = len(messages) < self.size
+        args: list[str | int] = [version, self.expiry, "1" if complete else "0"]
+        for message in messages:
+            args.extend(self._entry(message))
+
+        async with redis_connection(self.cache_type) as cache:
+            try:
+                return bool(
+                    await cache.eval(_FILL_SCRIPT, 5, *self._keys(chat_id), *args)
+                )
+            except redis.exceptions.RedisError:
+                logger.warning("RecentMessageCache failed to fill.", exc_info=True)
+                return False
+
+    async def push(self, chat_id: int, messages: Sequence[MessageSchema]) -> None:
+        if not self.size or not messages:
+            return
+
+        args: list[str | int] = [self.expiry, self.size]
+        for message in messages:
+            args.extend(self._entry(message))
+
+        async with redis_connection(self.cache_type) as cache:
+            try:
+                await cache.eval(_PUSH_SCRIPT, 5, *self._keys(chat_id), *args)
+            except redis.exceptions.RedisError:
+                logger.warning("RecentMessageCache failed to push.", exc_info=True)
+                await self.invalidate(chat_id)
+
+    async def mark_read(
+        self, chat_id: int, message_ids: list[int], user_id: int
+    ) -> None:
+        if not self.size or not message_ids:
+            return
+
+        async with redis_connection(self.cache_type) as cache:
+            try:
+                await cache.eval(
+                    _MARK_READ_SCRIPT,
+                    5,
+                    *self._keys(chat_id),
+                    self.expiry,
+                    user_id,
+                    *message_ids,
+                )
+            except redis.exceptions.RedisError:
+                logger.warning("RecentMessageCache failed to mark.", exc_info=True)
+                await self.invalidate(chat_id)
+
+    async def remove(self, chat_id: int, message_ids: list[int]) -> None:
+        if not self.size or not message_ids:
+            return
+
+        async with redis_connection(self.cache_type) as cache:
+            try:
+                await cache.eval(
+                    _REMOVE_SCRIPT, 5, *self._keys(chat_id), self.expiry, *message_ids
+                )
+            except redis.exceptions.RedisError:
+                logger.warning("RecentMessageCache failed to remove.", exc_info=True)
+                await self.invalidate(chat_id)
+
+    async def invalidate(self, chat_id: int) -> None:
+        async with redis_connection(self.cache_type) as cache:
+            try:
+                keys = self._keys(chat_id)
+                async with cache.pipeline(transaction=True) as pipe:
+                    pipe.incr(keys[3])
+                    pipe.expire(keys[3], self.expiry)
+                    pipe.delete(*keys[:3], keys[4])
+                    await pipe.execute()
+            except redis.exceptions.RedisError:
+                logger.warning(
+                    "RecentMessageCache failed to invalidate.", exc_info=True
+                )
+
+    async def verify(self, session: AsyncSession, chat_id: int) -> bool:
+        """キャッシュ内容をDBの最新メッセージと突き合わせ、不一致なら破棄する"""
+        keys = self._keys(chat_id)
+        async with redis_connection(self.cache_type) as cache:
+            try:
+                async with cache.pipeline(transaction=True) as pipe:
+                    pipe.zrevrange(keys[0], 0, -1)
+                    pipe.hgetall(keys[1])
+                    pipe.hgetall(keys[2])
+                    pipe.exists(keys[4])
+                    ids, bodies, reads, complete = await pipe.execute()
+            except redis.exceptions.RedisError:
+                return False
+
+        if not ids and not complete:
+            return True
+
+        stmt = (
+            select(Message)
+            .where(Message.chat_id == chat_id)
+            .order_by(Message.id.desc())
+            .limit(len(ids) + 1)
+        )
+        rows = (await session.execute(stmt)).scalars().all()
+
+        def normalize(message: dict) -> dict:
+            return {**message, "read_by_list": sorted(message["read_by_list"])}
+
+        cached = [
+            normalize(self._decode(bodies.get(i, ""), reads.get(i, "")))
+            for i in ids
+            if bodies.get(i)
+        ]
+        expected = [
+            normalize(MessageSchema.model_validate(row).model_dump(mode="json"))
+            for row in rows[: len(ids)]
+        ]
+        consistent = len(cached) == len(ids) and cached == expected
+        if complete and len(rows) > len(ids):
+            consistent = False
+
+        if not consistent:
+            logger.warning(f"RecentMessageCache is inconsistent for chat {chat_id}.")
+            await self.invalidate(chat_id)
+            async with redis_connection(self.cache_type) as cache:
+                try:
+                    await cache.incr(STATS_INCONSISTENCIES_KEY)
+                except redis.exceptions.RedisError:
+                    pass
+        return consistent
+
+    async def stats(self) -> dict[str, int | float]:
+        async with redis_connection(self.cache_type) as cache:
+            try:
+                hits, misses, inconsistencies = await cache.mget(
+                    STATS_HITS_KEY, STATS_MISSES_KEY, STATS_INCONSISTENCIES_KEY
+                )
+            except redis.exceptions.RedisError:
+                hits, misses, inconsistencies = None, None, None
+
+        hits, misses = int(hits or 0), int(misses or 0)
+        return {
+            "hits": hits,
+            "misses": misses,
+            "inconsistencies": int(inconsistencies or 0),
+            "hit_ratio": hits / (hits + misses) if hits + misses else 0.0,
+        }
@@ -0,0 +1,87 @@
+import asyncio
+import json
+
+from redis.asyncio import Redis
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from app.db import AsyncSessionLocal, PubSubSessionLocal
+from app.models import Message, MessageOutbox, MessageSchema
+from app.settings import settings
+
+from .logging import logger
+
+# 同じプロセスで書き込んだ場合はポーリングを待たずにリレーを起こす
+_wakeup = asyncio.Event()
+
+
+def wake_message_outbox_relay() -> None:
+    _wakeup.set()
+
+
+class MessageOutboxRelay:
+    """
+    message_outboxの行をRedisのチャットのチャネルへ配信する
+
+    行のロック、配信、削除を1つのトランザクションで行うため、配信後にコミットできなかった
+    場合は次回に再配信される (at-least-once)。
+    """
+
+    def __init__(
+        self,
+        session: async_sessionmaker | None = None,
+        pubsub_session: Redis | None = None,
+    ) -> None:
+        self.async_session = session or AsyncSessionLocal
+        self.pubsub_session = pubsub_session or PubSubSessionLocal
+        self.batch_size = settings.MESSAGE_OUTBOX_BATCH_SIZE
+
+    async def relay(self) -> int:
+        """1バッチ分を配信し、処理した行数を返す"""
+        async with self.async_session.begin() as session:
+            rows = await MessageOutbox.read_all_for_update(session, self.batch_size)
+            if not rows:
+                return 0
+
+            message_ids = sorted({i for row in rows for i in row.message_ids})
+            messages = {
+                message.id: MessageSchema.model_validate(message).model_dump(
+                    mode="json"
+                )
+                async for message in Message.read_all_by_ids(session, message_ids)
+            }
+
+            async with self.pubsub_session.pipeline(transaction=False) as pipe:
+                for row in rows:
+                    # 配信前に削除されたメッセージは除く
+                    payload = [messages[i] for i in row.message_ids if i in messages]
+                    if not payload:
+                        continue
+                    pipe.publish(
+                        f"chat_messages_{row.chat_id}",
+                        json.dumps(
+                            payload[0] if len(payload) == 1 else payload,
+                            ensure_ascii=False,
+                        ),
+                    )
+                await pipe.execute()
+
+            await MessageOutbox.delete_by_ids(session, [row.id for row in rows])
+        return len(rows)
+
+
+async def run_message_outbox_relay() -> None:
+    """起動中は配信待ちの行を配信し続ける"""
+    relay = MessageOutboxRelay()
+    while True:
+        _wakeup.clear()
+        try:
+            while await relay.relay() >= relay.batch_size:
+                pass
+        except Exception:
+            logger.exception("Failed to relay the message outbox.")
+        try:
+            await asyncio.wait_for(
+                _wakeup.wait(), timeout=settings.MESSAGE_OUTBOX_POLL_INTERVAL
+            )
+        except asyncio.TimeoutError:
+            pass
@@ -0,0 +1,318 @@
+import asyncio
+import gzip
+import re
+import tempfile
+from datetime import date, datetime, time
+from pathlib import Path
+from typing import AsyncIterator
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from app.db import AsyncSessionLocal
+from app.models import ArchivedMessageSchema, MessageArchive
+from app.settings import settings
+
+from .logging import logger
+from .storage import LocalStorage, S3Storage, get_storage
+
+PARTITION_PATTERN = re.compile(r"^messages_p(\d{4})(\d{2})$")
+DEFAULT_PARTITION = "messages_default"
+ARCHIVE_CONTENT_TYPE = "application/x-ndjson"
+# 複数プロセスから同時にパーティションを操作しないためのアドバイザリロックのキー
+PARTITION_LOCK_KEY = 7_301_031
+
+
+def month_start(value: date) -> date:
+    return date(value.year, value.month, 1)
+
+
+def add_months(value: date, months: int) -> date:
+    index = value.year * 12 + value.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(month: date) -> str:
+    return f"messages_p{month:%Y%m}"
+
+
+def partition_month(name: str) -> date | None:
+    matched = PARTITION_PATTERN.match(name)
+    if not matched:
+        return None
+    return date(int(matched.group(1)), int(matched.group(2)), 1)
+
+
+class MessagePartitionManager:
+    """
+    messagesの月次パーティションを管理する
+
+    先の月のパーティションを事前に作成し、古いパーティションは切り離して
+    チャットごとにgzip圧縮したNDJSONとしてストレージに退避する。退避したメッセージは
+    read_archivedから対象チャットのアーカイブだけを読み出せる。
+    """
+
+    def __init__(
+        self,
+        storage: S3Storage | LocalStorage | None = None,
+        session: async_sessionmaker | None = None,
+    ) -> None:
+        self.storage = storage or get_storage()
+        self.async_session = session or AsyncSessionLocal
+
+    @staticmethod
+    async def _lock(session: AsyncSession) -> None:
+        await session.execute(
+            text("SELECT pg_advisory_xact_lock(:key)"), {"key": PARTITION_LOCK_KEY}
+        )
+
+    async def read_partitions(self, session: AsyncSession) -> list[str]:
+        result = await session.execute(
+            text(
+                "SELECT child.relname FROM pg_inherits "
+                "JOIN pg_class parent ON pg_inherits.inhparent = parent.oid "
+                "JOIN pg_class child ON pg_inherits.inhrelid = child.oid "
+                "WHERE parent.relname = 'messages' ORDER BY child.relname"
+            )
+        )
+        return [name for name in result.scalars() if partition_month(name)]
+
+    async def create_partition(self, session: AsyncSession, month: date) -> bool:
+        month = month_start(month)
+        name = partition_name(month)
+        await self._lock(session)
+        if name in await self.read_partitions(session):
+            return False
+
+        # デフォルトパーティションに入った同じ月の行を移してからアタッチする
+        start, end = month, add_months(month, 1)
+        await session.execute(
+            text(
+                f"CREATE TABLE {name} "
+                "(LIKE messages INCLUDING DEFAULTS INCLUDING CONSTRAINTS)"
+            )
+        )
+        await session.execute(
+            text(
+                f"WITH moved AS (DELETE FROM {DEFAULT_PARTITION} "
+                "WHERE created_at >= :start AND created_at < :end RETURNING *) "
+                f"INSERT INTO {name} SELECT * FROM moved"
+            ),
+            {
+                "start": datetime.combine(start, time()),
+                "end": datetime.combine(end, time()),
+            },
+        )
+        await session.execute(
+            text(
+                f"ALTER TABLE messages ATTACH PARTITION {name} "
+                f"FOR VALUES FROM ('{start}') TO ('{end}')"
+            )
+        )
+        logger.info(f"Created partition {name}.")
+        return True
+
+    async def ensure_partitions(
+        self, session: AsyncSession, months_ahead: int
+    ) -> list[str]:
+        """今月から指定した月数先までのパーティションを作成する"""
+        current = month_start(date.today())
+        created = []
+        for i in range(months_ahead + 1):
+            month = add_months(current, i)
+            if await self.create_partition(session, month):
+                created.append(partition_name(month))
+        return created
+
+    async def archive_partition(self, name: str) -> MessageArchive | None:
+        """
+        パーティションを切り離してチャットごとにストレージへ退避し、削除する
+
+        messagesのロックは切り離しのトランザクションの間だけ保持し、書き出し、
+        アップロード、削除はそれぞれ別に行う。途中で中断した場合はarchive_beforeで
+        続きから再開する。
+        """
+        if not await self._detach(name):
+            return None
+        return await self._complete(name)
+
+    async def _detach(self, name: str) -> bool:
+        month = partition_month(name)
+        async with self.async_session.begin() as session:
+            await self._lock(session)
+            if not month or name not in await self.read_partitions(session):
+                return False
+
+            # デフォルトパーティションがあるためDETACH CONCURRENTLYは使えない。
+            # ACCESS EXCLUSIVEロックを待つ間に後続のクエリを止め続けないよう、
+            # lock_timeoutを設定して切り離しだけを短いトランザクションで行う
+            lock_timeout = int(settings.MESSAGE_PARTITION_LOCK_TIMEOUT * 1000)
+            await session.execute(text(f"SET LOCAL lock_timeout = {lock_timeout}"))
+            await session.execute(text(f"ALTER TABLE messages DETACH PARTITION {name}"))
+            await self._drop_foreign_keys(session, name)
+            await MessageArchive.create(
+                session,
+                partition_name=name,
+                range_start=datetime.combine(month, time()),
+                range_end=datetime.combine(add_months(month, 1), time()),
+                storage_key=f"archives/messages/{name}/",
+                row_count=0,
+            )
+        return True
+
+    @staticmethod
+    async def _drop_foreign_keys(session: AsyncSession, name: str) -> None:
+        """
+        切り離したテーブルに複製された外部キーを削除する
+
+        残したままではアーカイブが終わるまでチャットやユーザーを削除できない。
+        """
+        constraints = await session.scalars(
+            text(
+                "SELECT conname FROM pg_constraint "
+                "WHERE conrelid = CAST(:name AS regclass) AND contype = 'f'"
+            ),
+            {"name": name},
+        )
+        drops = ", ".join(f'DROP CONSTRAINT "{c}"' for c in constraints)
+        if drops:
+            await session.execute(text(f"ALTER TABLE {name} {drops}"))
+
+    async def _complete(self, name: str) -> MessageArchive | None:
+        async with self.async_session.begin() as session:
+            archive = await MessageArchive.read_by_partition_name(session, name)
+            if archive is None or archive.archived_at is not None:
+                return archive
+            # 外部キーを残したまま切り離したテーブルも外部キーを削除する
+            if await session.scalar(text("SELECT to_regclass(:name)"), {"name": name}):
+                await self._drop_foreign_keys(session, name)
+
+        with tempfile.TemporaryDirectory() as directory:
+            row_count, chat_ids = await self._export(name, Path(directory))
+            for chat_id in chat_ids:
+                await self.storage.upload_file(
+                    Path(directory) / f"{chat_id}.ndjson.gz",
+                    archive.chat_storage_key(chat_id),
+                    ARCHIVE_CONTENT_TYPE,
+                )
+
+        # 切り離したテーブルのみをロックするため、messagesへのクエリは待たせない
+        async with self.async_session.begin() as session:
+            await self._lock(session)
+            if await MessageArchive.complete(session, name, row_count, chat_ids):
+                await session.execute(text(f"DROP TABLE IF EXISTS {name}"))
+        logger.info(f"Archived partition {name} ({row_count} messages).")
+
+        async with self.async_session() as session:
+            return await MessageArchive.read_by_partition_name(session, name)
+
+    async def _export(self, name: str, directory: Path) -> tuple[int, list[int]]:
+        """切り離したパーティションをチャットごとのgzip圧縮したNDJSONに書き出す"""
+        row_count = 0
+        chat_ids: list[int] = []
+        lines: dict[int, list[bytes]] = {}
+        async with self.async_session() as session:
+            result = await session.stream(
+                # 切り離した後に削除したチャットのメッセージは退避しない
+                text(
+                    f"SELECT * FROM {name} m "
+                    "WHERE EXISTS (SELECT 1 FROM chats c WHERE c.id = m.chat_id) "
+                    "ORDER BY chat_id, id"
+                ).execution_options(yield_per=settings.EXPORT_BATCH_SIZE)
+            )
+            async for row in result.mappings():
+                message = ArchivedMessageSchema.model_validate(dict(row))
+                if not chat_ids or chat_ids[-1] != message.chat_id:
+                    chat_ids.append(message.chat_id)
+                data = message.model_dump_json().encode("utf-8")
+                lines.setdefault(message.chat_id, []).append(data + b"\n")
+                row_count += 1
+                # 圧縮はイベントループを止めないようスレッドで行う
+                if row_count % settings.EXPORT_BATCH_SIZE == 0:
+                    await asyncio.to_thread(self._append, directory, lines)
+                    lines = {}
+        if lines:
+            await asyncio.to_thread(self._append, directory, lines)
+        return row_count, chat_ids
+
+    @staticmethod
+    def _append(directory: Path, lines: dict[int, list[bytes]]) -> None:
+        # 追記したメンバーは連結したgzipとして1つのファイルのまま読める
+        for chat_id, chat_lines in lines.items():
+            with gzip.open(directory / f"{chat_id}.ndjson.gz", "ab") as archive:
+                archive.writelines(chat_lines)
+
+    async def archive_before(self, before: date) -> list[MessageArchive]:
+        """指定した月より前のパーティションをすべて退避する"""
+        async with self.async_session() as session:
+            pending = await MessageArchive.read_pending_names(session)
+            names = [
+                name
+                for name in await self.read_partitions(session)
+                if add_months(partition_month(name), 1) <= month_start(before)  # type: ignore
+            ]
+
+        # 切り離した後に中断した退避を先に完了させる
+        archives = []
+        for name in pending:
+            archive = await self._complete(name)
+            if archive:
+                archives.append(archive)
+        for name in names:
+            archive = await self.archive_partition(name)
+            if archive:
+                archives.append(archive)
+        return archives
+
+    async def read_archived(
+        self, session: AsyncSession, chat_id: int, offset: int, limit: int
+    ) -> AsyncIterator[ArchivedMessageSchema]:
+        """退避済みのメッセージを新しい順に返す。ストレージから読むため低速"""
+        archives = [
+            archive
+            async for archive in MessageArchive.read_all_by_chat_id(session, chat_id)
+        ]
+        skipped = 0
+        returned = 0
+        for archive in archives:
+            if returned >= limit:
+                return
+            # 対象チャットのアーカイブだけをダウンロードする
+            with tempfile.NamedTemporaryFile(suffix=".ndjson.gz") as file:
+                await self.storage.download_file(
+                    archive.chat_storage_key(chat_id), Path(file.name)
+                )
+                messages = await asyncio.to_thread(self._load, Path(file.name), chat_id)
+            for message in reversed(messages):
+                if skipped < offset:
+                    skipped += 1
+                    continue
+                if returned >= limit:
+                    return
+                returned += 1
+                yield message
+
+    @staticmethod
+    def _load(path: Path, chat_id: int) -> list[ArchivedMessageSchema]:
+        # 月ごとにまとめた以前のアーカイブも読めるよう対象チャットの行だけを保持する
+        messages = []
+        with gzip.open(path, "rt", encoding="utf-8") as archive:
+            for line in archive:
+                message = ArchivedMessageSchema.model_validate_json(line)
+                if message.chat_id == chat_id:
+                    messages.append(message)
+        return messages
+
+
+async def run_partition_maintenance() -> None:
+    """起動中は定期的に先の月のパーティションを作成する"""
+    manager = MessagePartitionManager()
+    while True:
+        try:
+            async with AsyncSessionLocal.begin() as session:
+                await manager.ensure_partitions(
+                    session, settings.MESSAGE_PARTITION_MONTHS_AHEAD
+                )
+        except Exception:
+            logger.exception("Failed to create message partitions.")
+        await asyncio.sleep(settings.MESSAGE_PARTITION_CHECK_INTERVAL)
@@ -0,0 +1,146 @@
+import asyncio
+import time
+from datetime import datetime
+
+from sqlalchemy import func, select, text
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from app.commons.types import ChatEventType
+from app.db import AsyncSessionLocal
+from app.models import ChatEvent, Message, RetentionPolicy, RetentionRun
+from app.settings import settings
+
+from .logging import logger
+from .message_cache import RecentMessageCache
+
+# 複数プロセスから同時に実行を開始しないためのアドバイザリロックのキー
+RETENTION_LOCK_KEY = 7_301_032
+
+
+class MessageRetention:
+    """
+    保持期間を過ぎたメッセージを削除する
+
+    batch_size件ずつのIDの範囲ごとに小さなトランザクションで削除し、範囲を進めるたびに
+    retention_runsへ進捗を記録する。レプリケーション遅延が閾値を超えている間は待機し、
+    削除件数が1秒あたりの上限を超えないよう間隔を空ける。
+    """
+
+    def __init__(self, session: async_sessionmaker | None = None) -> None:
+        self.async_session = session or AsyncSessionLocal
+        self.message_cache = RecentMessageCache()
+        self.batch_size = settings.MESSAGE_RETENTION_BATCH_SIZE
+        self.rows_per_second = settings.MESSAGE_RETENTION_ROWS_PER_SECOND
+        self.max_replication_lag = settings.MESSAGE_RETENTION_MAX_REPLICATION_LAG
+
+    async def _replication_lag(self, session: AsyncSession) -> float:
+        lag = await session.scalar(
+            text(
+                "SELECT COALESCE(MAX(EXTRACT(EPOCH FROM replay_lag)), 0) "
+                "FROM pg_stat_replication"
+            )
+        )
+        return float(lag or 0)
+
+    async def _wait_for_replicas(self) -> None:
+        while True:
+            async with self.async_session() as session:
+                lag = await self._replication_lag(session)
+            if lag <= self.max_replication_lag:
+                return
+            logger.info(f"Retention paused: replication lag is {lag:.1f}s.")
+            await asyncio.sleep(min(lag, 10.0))
+
+    async def _start(
+        self, session: AsyncSession, retention_days: int
+    ) -> RetentionRun | None:
+        lower, upper = await Message.read_retention_range(session, retention_days)
+        if lower is None or upper is None:
+            return None
+        return await RetentionRun.create(
+            session, cursor=lower, upper_bound=upper, deleted_count=0
+        )
+
+    async def step(self) -> tuple[bool, int]:
+        """1バッチ分を削除し、(続きがあるか, 削除件数)を返す"""
+        async with self.async_session.begin() as session:
+            retention_days = await RetentionPolicy.read_min_retention_days(session)
+            if retention_days is None:
+                return False, 0
+
+            # 実行中の確認から開始までを直列化し、同時に2つの実行を作らない
+            await session.execute(
+                text("SELECT pg_advisory_xact_lock(:key)"), {"key": RETENTION_LOCK_KEY}
+            )
+            run = await RetentionRun.read_active_for_update(session)
+            if run is None:
+                if await RetentionRun.has_active(session):
+                    # 他のプロセスが処理中
+                    return False, 0
+                run = await self._start(session, retention_days)
+                if run is None:
+                    return False, 0
+
+            end_id = await Message.read_batch_end_id(
+                session, run.cursor, run.upper_bound, self.batch_size
+            )
+            deleted = await Message.delete_expired(
+                session, run.cursor, end_id, retention_days
+            )
+
+            deleted_ids: dict[int, list[int]] = {}
+            for message_id, chat_id in deleted:
+                deleted_ids.setdefault(chat_id, []).append(message_id)
+            for chat_id, ids in deleted_ids.items():
+                await ChatEvent.create(
+                    session,
+                    chat_id,
+                    ChatEventType.MESSAGE_DELETED,
+                    message_ids=sorted(ids),
+                )
+
+            run.cursor = end_id
+            run.deleted_count += len(deleted)
+            if run.cursor > run.upper_bound:
+                run.finished_at = await session.scalar(select(func.now()))
+                logger.info(
+                    f"Retention run {run.id} finished: "
+                    f"deleted {run.deleted_count} messages."
+                )
+            has_more = run.finished_at is None
+
+        # コミット後に最新メッセージのキャッシュから取り除く
+        for chat_id, ids in deleted_ids.items():
+            await self.message_cache.remove(chat_id, ids)
+        return has_more, len(deleted)
+
+    async def execute(self) -> int:
+        """保持期間を過ぎたメッセージを削除しきるまで繰り返す"""
+        total = 0
+        has_more = True
+        while has_more:
+            await self._wait_for_replicas()
+            started_at = time.monotonic()
+            has_more, deleted = await self.step()
+            total += deleted
+
+            # 削除件数に応じて待機し、1秒あたりの削除件数を上限以下に保つ
+            if self.rows_per_second > 0:
+                elapsed = time.monotonic() - started_at
+                await asyncio.sleep(max(0.0, deleted / self.rows_per_second - elapsed))
+        return total
+
+
+async def run_message_retention() -> None:
+    """起動中は定期的に保持期間を過ぎたメッセージを削除する"""
+    retention = MessageRetention()
+    while True:
+        try:
+            deleted = await retention.execute()
+            if deleted:
+                logger.info(
+                    f"Retention deleted {deleted} messages at {datetime.now()}."
+                )
+        except Exception:
+            logger.exception("Failed to apply message retention.")
+        await asyncio.sleep(settings.MESSAGE_RETENTION_INTERVAL)
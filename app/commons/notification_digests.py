@@ -0,0 +1,309 @@
+import logging
+import time
+import uuid
+from dataclasses import dataclass
+from typing import Collection
+
+import redis
+
+from app.settings import settings
+
+from .notification_targets import NotificationRecipient, NotificationTargets
+from .redis_cache import redis_connection
+from .types import CacheType, NotificationType
+
+logger = logging.getLogger(__name__)
+
+DUE_KEY = "digests:due"
+PROCESSING_KEY = "digests:processing"
+
+# 同じメッセージの通知は1件として数え、本文はmax_entries件まで保持する
+# KEYS: due, digest
+# ARGV: member, now, due_at, entry_id, payload, expiry, max_entries
+_ENQUEUE_SCRIPT = """
+redis.call('HSETNX', KEYS[2], 'since', ARGV[2])
+local field = 'm:' .. ARGV[4]
+if redis.call('HEXISTS', KEYS[2], field) == 0 then
+    local count = redis.call('HINCRBY', KEYS[2], 'count', 1)
+    if count <= tonumber(ARGV[7]) then
+        redis.call('HSET', KEYS[2], field, ARGV[5])
+    else
+        redis.call('HSET', KEYS[2], field, '')
+    end
+end
+redis.call('EXPIRE', KEYS[2], ARGV[6])
+redis.call('ZADD', KEYS[1], 'NX', ARGV[3], ARGV[1])
+return 1
+"""
+
+# 送信中の通知をキューに戻す。送信中に積まれた通知があればまとめ直す
+_REQUEUE = """
+local function requeue(member, now)
+    local claimed = 'digests:processing:' .. member
+    local fields = redis.call('HGETALL', claimed)
+    redis.call('ZREM', KEYS[2], member)
+    if #fields == 0 then
+        return
+    end
+    local key = 'digests:' .. member
+    for i = 1, #fields, 2 do
+        local field, value = fields[i], fields[i + 1]
+        if field == 'since' then
+            local since = redis.call('HGET', key, 'since')
+            if not since or tonumber(value) < tonumber(since) then
+                redis.call('HSET', key, 'since', value)
+            end
+        elseif string.sub(field, 1, 2) == 'm:' then
+            if redis.call('HSETNX', key, field, value) == 1 then
+                redis.call('HINCRBY', key, 'count', 1)
+            end
+        end
+    end
+    local ttl = redis.call('TTL', claimed)
+    if ttl > redis.call('TTL', key) then
+        redis.call('EXPIRE', key, ttl)
+    end
+    redis.call('DEL', claimed)
+    local score = redis.call('ZSCORE', KEYS[1], member)
+    if not score or tonumber(score) > tonumber(now) then
+        redis.call('ZADD', KEYS[1], now, member)
+    end
+end
+"""
+
+# 期限が来た通知を送信中として取り出し、送信を確定するまでlease秒は他のプロセスに
+# 渡さない。確定しないまま期限が過ぎた通知はキューに戻して再送する
+# (まとめた通知のキーはメンバーから組み立てるため、Redis Clusterには対応しない)
+# KEYS: due, processing
+# ARGV: now, limit, lease, claim
+_CLAIM_SCRIPT = (
+    _REQUEUE
+    + """
+local expired = redis.call(
+    'ZRANGEBYSCORE', KEYS[2], '-inf', ARGV[1], 'LIMIT', 0, ARGV[2]
+)
+for _, member in ipairs(expired) do
+    requeue(member, ARGV[1])
+end
+local members = redis.call(
+    'ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, ARGV[2]
+)
+local result = {}
+for _, member in ipairs(members) do
+    -- 同じ宛先の送信中の通知が確定するまでは取り出さない
+    if not redis.call('ZSCORE', KEYS[2], member) then
+        redis.call('ZREM', KEYS[1], member)
+        local key = 'digests:' .. member
+        local fields = redis.call('HGETALL', key)
+        if #fields > 0 then
+            local claimed = 'digests:processing:' .. member
+            redis.call('RENAME', key, claimed)
+            redis.call('HSET', claimed, 'claim', ARGV[4])
+            redis.call('ZADD', KEYS[2], tonumber(ARGV[1]) + tonumber(ARGV[3]), member)
+            table.insert(result, {member, fields})
+        end
+    end
+end
+return result
+"""
+)
+
+# 自分が取り出した通知のみを、送信できた場合は削除し、失敗した場合はキューに戻す
+# KEYS: due, processing
+# ARGV: now, claim, requeue, members...
+_FINISH_SCRIPT = (
+    _REQUEUE
+    + """
+for i = 4, #ARGV do
+    local member = ARGV[i]
+    local claimed = 'digests:processing:' .. member
+    if redis.call('HGET', claimed, 'claim') == ARGV[2] then
+        if ARGV[3] == '1' then
+            requeue(member, ARGV[1])
+        else
+            redis.call('DEL', claimed)
+            redis.call('ZREM', KEYS[2], member)
+        end
+    end
+end
+return 1
+"""
+)
+
+
+@dataclass(frozen=True)
+class NotificationDigest:
+    user_id: int
+    chat_id: int
+    since: float
+    count: int
+    # メッセージIDの順に並べた通知の本文
+    entries: tuple[str, ...]
+    # 取り出したpop_dueの呼び出しごとの識別子
+    claim: str = ""
+
+    @property
+    def message(self) -> str:
+        """最初の通知と、それ以降の件数を1件の通知にまとめる"""
+        if self.count > 1:
+            return f"{self.entries[0]} (+{self.count - 1} more messages)"
+        return self.entries[0]
+
+    @property
+    def more(self) -> int:
+        """本文を保持しきれなかった通知の件数"""
+        return self.count - len(self.entries)
+
+    @classmethod
+    def from_fields(
+        cls, member: str, fields: list[str], claim: str = ""
+    ) -> "NotificationDigest":
+        values = dict(zip(fields[::2], fields[1::2]))
+        entries = sorted(
+            (int(key[2:]), value)
+            for key, value in values.items()
+            if key.startswith("m:") and value
+        )
+        user_id, chat_id = member.split(":")
+        return cls(
+            user_id=int(user_id),
+            chat_id=int(chat_id),
+            since=float(values["since"]),
+            count=int(values.get("count", 0)),
+            entries=tuple(value for _, value in entries),
+            claim=claim,
+        )
+
+
+class NotificationDigestQueue:
+    """
+    まとめて送る通知を、ユーザーとチャットごとに遅延キューへ積む
+
+    通知をまとめる設定の参加者はnotification_digest_delay秒、メールで通知する参加者は
+    NOTIFICATION_EMAIL_WINDOW秒を最初の通知からの期限とし、それまでの通知を1件に
+    まとめる。期限が来たものはrun_notification_digestsが取り出し、その間に入室
+    しなかった場合のみ送信する。
+    """
+
+    def __init__(self) -> None:
+        self.cache_type = CacheType.NOTIFICATION_DIGESTS
+        self.max_delay = settings.NOTIFICATION_DIGEST_MAX_DELAY
+        self.max_entries = settings.NOTIFICATION_DIGEST_MAX_MESSAGES
+        self.email_window = settings.NOTIFICATION_EMAIL_WINDOW
+        self.lease = settings.NOTIFICATION_DIGEST_LEASE
+
+    def _delay(self, recipient: NotificationRecipient) -> int | None:
+        if recipient.digest_delay:
+            return recipient.digest_delay
+        # メールは通知をまとめる設定がなくても期間内の通知を1通にまとめる
+        if recipient.notification_type == NotificationType.EMAIL and self.email_window:
+            return self.email_window
+        return None
+
+    async def defer(
+        self,
+        chat_id: int,
+        targets: NotificationTargets,
+        payload: str,
+        exclude_user_ids: Collection[int] = (),
+        message_id: int | None = None,
+    ) -> set[int]:
+        """まとめて送る参加者の通知を積み、即時の通知から除くユーザーIDを返す"""
+        delays = {
+            recipient.user_id: delay
+            for recipient in targets.recipients
+            if recipient.user_id not in exclude_user_ids
+            and (delay := self._delay(recipient))
+        }
+        if not delays:
+            return set()
+
+        now = time.time()
+        # メッセージIDで同じ通知の再送を除き、まとめた通知をメッセージの順に並べる
+        entry_id = message_id if message_id is not None else time.time_ns()
+        async with redis_connection(self.cache_type) as cache:
+            try:
+                async with cache.pipeline(transaction=False) as pipe:
+                    for user_id, delay in delays.items():
+                        member = f"{user_id}:{chat_id}"
+                        pipe.eval(
+                            _ENQUEUE_SCRIPT,
+                            2,
+                            DUE_KEY,
+                            f"digests:{member}",
+                            member,
+                            now,
+                            now + delay,
+                            entry_id,
+                            payload,
+                            delay + self.max_delay,
+                            self.max_entries,
+                        )
+                    await pipe.execute()
+            except redis.exceptions.RedisError:
+                # 積めなかった場合は即時に通知する
+                logger.warning(
+                    "NotificationDigestQueue failed to defer.", exc_info=True
+                )
+                return set()
+        return set(delays)
+
+    async def pop_due(
+        self, limit: int, now: float | None = None
+    ) -> list[NotificationDigest]:
+        """
+        期限が来た通知を送信中として取り出す
+
+        送信後はcompleteで削除し、失敗した場合はreleaseでキューに戻す。どちらも
+        呼ばれないままNOTIFICATION_DIGEST_LEASE秒が過ぎた通知は再び取り出される。
+        """
+        now = now if now is not None else time.time()
+        claim = uuid.uuid4().hex
+        async with redis_connection(self.cache_type) as cache:
+            rows = await cache.eval(
+                _CLAIM_SCRIPT,
+                2,
+                DUE_KEY,
+                PROCESSING_KEY,
+                now,
+                limit,
+                self.lease,
+                claim,
+            )
+        return [
+            NotificationDigest.from_fields(member, fields, claim)
+            for member, fields in rows
+        ]
+
+    async def _finish(
+        self, digests: Collection[NotificationDigest], requeue: bool, now: float
+    ) -> None:
+        claims: dict[str, list[str]] = {}
+        for digest in digests:
+            claims.setdefault(digest.claim, []).append(
+                f"{digest.user_id}:{digest.chat_id}"
+            )
+        async with redis_connection(self.cache_type) as cache:
+            for claim, members in claims.items():
+                await cache.eval(
+                    _FINISH_SCRIPT,
+                    2,
+                    DUE_KEY,
+                    PROCESSING_KEY,
+                    now,
+                    claim,
+                    int(requeue),
+                    *members,
+                )
+
+    async def complete(self, digests: Collection[NotificationDigest]) -> None:
+        """送信できた通知を削除する"""
+        if digests:
+            await self._finish(digests, False, time.time())
+
+    async def release(
+        self, digests: Collection[NotificationDigest], now: float | None = None
+    ) -> None:
+        """送信できなかった通知をキューに戻し、次の取り出しで再送する"""
+        if digests:
+            await self._finish(digests, True, now if now is not None else time.time())
@@ -0,0 +1,351 @@
+import json
+import logging
+import time
+from collections import OrderedDict
+from dataclasses import asdict, dataclass
+from typing import Iterable
+
+import redis
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models import ChatParticipants, Session
+from app.settings import settings
+
+from .crypto import AesGcmCipher, DecryptionError
+from .redis_cache import redis_connection
+from .types import CacheType, NotificationType, PlatformType
+
+logger = logging.getLogger(__name__)
+
+# KEYS: targets, version
+# ARGV: expected_version, expiry, targets
+_FILL_SCRIPT = """
+if (redis.call('GET', KEYS[2]) or '0') ~= ARGV[1] then
+    return 0
+end
+redis.call('SET', KEYS[1], ARGV[3], 'EX', ARGV[2])
+return 1
+"""
+
+
+@dataclass(frozen=True)
+class NotificationRecipient:
+    user_id: int
+    email: str
+    notification_type: NotificationType
+    # 設定した場合は即時に送らず、入室しないまま経過した秒数でまとめて送る
+    digest_delay: int | None = None
+
+
+@dataclass(frozen=True)
+class NotificationDevice:
+    user_id: int
+    platform_type: PlatformType
+    device_token: str
+    # 送信先として無効になった場合にdevice_tokenを削除するSessionのID
+    session_id: int | None = None
+
+    @classmethod
+    def from_dict(cls, value: dict) -> "NotificationDevice":
+        return cls(
+            user_id=value["user_id"],
+            platform_type=PlatformType(value["platform_type"]),
+            device_token=value["device_token"],
+            session_id=value.get("session_id"),
+        )
+
+
+def dumps_devices(devices: Iterable[NotificationDevice], cipher: AesGcmCipher) -> str:
+    """端末の一覧をAES-GCMで暗号化し、Redisにdevice_tokenを平文で置かない"""
+    return cipher.encrypt(json.dumps([asdict(i) for i in devices]))
+
+
+def loads_devices(data: str, cipher: AesGcmCipher) -> list[NotificationDevice]:
+    return [NotificationDevice.from_dict(i) for i in json.loads(cipher.decrypt(data))]
+
+
+@dataclass(frozen=True)
+class NotificationTargets:
+    """チャットの通知を有効にしている参加者と、プッシュ通知先の端末"""
+
+    recipients: tuple[NotificationRecipient, ...]
+    devices: tuple[NotificationDevice, ...]
+
+    def emails(self, exclude_user_ids: Iterable[int] = ()) -> list[str]:
+        excluded = set(exclude_user_ids)
+        return [
+            recipient.email
+            for recipient in self.recipients
+            if recipient.notification_type == NotificationType.EMAIL
+            and recipient.user_id not in excluded
+        ]
+
+    def push_devices(
+        self, exclude_user_ids: Iterable[int] = ()
+    ) -> list[NotificationDevice]:
+        excluded = set(exclude_user_ids)
+        return [device for device in self.devices if device.user_id not in excluded]
+
+    def for_user(self, user_id: int) -> "NotificationTargets":
+        return NotificationTargets(
+            recipients=tuple(i for i in self.recipients if i.user_id == user_id),
+            devices=tuple(i for i in self.devices if i.user_id == user_id),
+        )
+
+    def dumps(self) -> str:
+        # 端末はユーザーごとに暗号化したDeviceEndpointCacheから読むため含めない
+        return json.dumps(
+            {"recipients": [asdict(i) for i in self.recipients]}, ensure_ascii=False
+        )
+
+    @staticmethod
+    def loads_recipients(data: str) -> list[NotificationRecipient]:
+        return [
+            NotificationRecipient(
+                user_id=i["user_id"],
+                email=i["email"],
+                notification_type=NotificationType(i["notification_type"]),
+                digest_delay=i.get("digest_delay"),
+            )
+            for i in json.loads(data)["recipients"]
+        ]
+
+
+class DeviceEndpointCache:
+    """
+    ユーザーごとのプッシュ通知先の端末をRedisにキャッシュする
+
+    device_tokenはPGPStringのため、DBから読むたびにPostgresが行ごとに
+    pgp_sym_decryptを実行する。通知先の組み立てではキャッシュにないユーザーの分だけを
+    DBから読み、Redisにはアプリケーション側でAES-GCMで暗号化して保持する。
+    端末の登録・ログアウト・退会と無効になった端末の削除のコミット後に無効化する。
+    """
+
+    def __init__(self) -> None:
+        self.cache_type = CacheType.DEVICE_ENDPOINTS
+        self.expiry = settings.DEVICE_ENDPOINT_CACHE_EXPIRY
+        self.cipher = AesGcmCipher("device_endpoints")
+
+    @staticmethod
+    def _keys(user_id: int) -> list[str]:
+        return [f"{user_id}:devices", f"{user_id}:version"]
+
+    async def _load(
+        self, session: AsyncSession, user_ids: list[int]
+    ) -> dict[int, list[NotificationDevice]]:
+        devices: dict[int, list[NotificationDevice]] = {i: [] for i in user_ids}
+        async for mobile_session in Session.read_all_mobile(session, user_ids):
+            devices[mobile_session.user_id].append(
+                NotificationDevice(
+                    user_id=mobile_session.user_id,
+                    platform_type=PlatformType(mobile_session.platform_type),
+                    device_token=str(mobile_session.device_token),
+                    session_id=mobile_session.id,
+                )
+            )
+        return devices
+
+    async def read(
+        self, session: AsyncSession, user_ids: Iterable[int]
+    ) -> list[NotificationDevice]:
+        user_ids = list(dict.fromkeys(user_ids))
+        if not user_ids:
+            return []
+
+        keys = [key for user_id in user_ids for key in self._keys(user_id)]
+        values: list[str | None] = []
+        async with redis_connection(self.cache_type) as cache:
+            try:
+                values = await cache.mget(*keys)
+            except redis.exceptions.RedisError:
+                logger.warning("DeviceEndpointCache failed to read.", exc_info=True)
+
+        devices: dict[int, list[NotificationDevice]] = {}
+        versions: dict[int, str] = {}
+        for user_id, cached, version in zip(user_ids, values[::2], values[1::2]):
+            versions[user_id] = version or "0"
+            if not cached:
+                continue
+            try:
+                devices[user_id] = loads_devices(cached, self.cipher)
+            except DecryptionError:
+                # SECRETを変更した場合などはDBから読み直す
+                logger.warning("DeviceEndpointCache failed to decrypt.")
+
+        missing = [user_id for user_id in user_ids if user_id not in devices]
+        if missing:
+            loaded = await self._load(session, missing)
+            devices.update(loaded)
+            fills = [user_id for user_id in missing if user_id in versions]
+            if fills:
+                async with redis_connection(self.cache_type) as cache:
+                    try:
+                        async with cache.pipeline(transaction=False) as pipe:
+                            for user_id in fills:
+                                pipe.eval(
+                                    _FILL_SCRIPT,
+                                    2,
+                                    *self._keys(user_id),
+                                    versions[user_id],
+                                    self.expiry,
+                                    dumps_devices(loaded[user_id], self.cipher),
+                                )
+                            await pipe.execute()
+                    except redis.exceptions.RedisError:
+                        logger.warning(
+                            "DeviceEndpointCache failed to fill.", exc_info=True
+                        )
+        return [device for user_id in user_ids for device in devices[user_id]]
+
+    async def invalidate(self, user_ids: Iterable[int]) -> None:
+        user_ids = list(user_ids)
+        if not user_ids:
+            return
+        async with redis_connection(self.cache_type) as cache:
+            try:
+                async with cache.pipeline(transaction=True) as pipe:
+                    for user_id in user_ids:
+                        keys = self._keys(user_id)
+                        pipe.incr(keys[1])
+                        pipe.expire(keys[1], self.expiry)
+                        pipe.delete(keys[0])
+                    await pipe.execute()
+            except redis.exceptions.RedisError:
+                logger.warning(
+                    "DeviceEndpointCache failed to invalidate.", exc_info=True
+                )
+
+
+class NotificationTargetCache:
+    """
+    チャットごとの通知先をプロセス内とRedisの2段でキャッシュする
+
+    同じチャットのWebSocketの接続とREST APIの投稿は同じ内容を読み、接続ごとに
+    通知先を保持しない。参加者・通知設定・端末の変更はコミット後にバージョンを
+    更新し、プロセス内の内容もNOTIFICATION_TARGET_LOCAL_EXPIRY秒以内に反映する。
+    Redisには参加者だけを保持し、端末はDeviceEndpointCacheから読む。
+    """
+
+    _local: OrderedDict[int, tuple[float, NotificationTargets]] = OrderedDict()
+
+    def __init__(self) -> None:
+        self.cache_type = CacheType.NOTIFICATION_TARGETS
+        self.expiry = settings.NOTIFICATION_TARGET_CACHE_EXPIRY
+        self.local_expiry = settings.NOTIFICATION_TARGET_LOCAL_EXPIRY
+        self.local_size = settings.NOTIFICATION_TARGET_LOCAL_SIZE
+
+    @staticmethod
+    def _keys(chat_id: int) -> list[str]:
+        return [f"{chat_id}:targets", f"{chat_id}:version"]
+
+    @classmethod
+    def clear_local(cls) -> None:
+        cls._local.clear()
+
+    def _read_local(self, chat_id: int) -> NotificationTargets | None:
+        entry = self._local.get(chat_id)
+        if entry is None:
+            return None
+        expires_at, targets = entry
+        if expires_at < time.monotonic():
+            self._local.pop(chat_id, None)
+            return None
+        self._local.move_to_end(chat_id)
+        return targets
+
+    def _write_local(self, chat_id: int, targets: NotificationTargets) -> None:
+        if not self.local_size:
+            return
+        self._local[chat_id] = (time.monotonic() + self.local_expiry, targets)
+        self._local.move_to_end(chat_id)
+        while len(self._local) > self.local_size:
+            self._local.popitem(last=False)
+
+    async def _load(
+        self, session: AsyncSession, chat_id: int
+    ) -> list[NotificationRecipient]:
+        return [
+            NotificationRecipient(
+                user_id=participant.user.id,
+                email=participant.user.email,
+                notification_type=NotificationType(participant.user.notification_type),
+                digest_delay=participant.user.notification_digest_delay,
+            )
+            async for participant in (
+                ChatParticipants.read_all_active_notification_users(session, chat_id)
+            )
+            if participant.user
+        ]
+
+    async def _with_devices(
+        self, session: AsyncSession, recipients: list[NotificationRecipient]
+    ) -> NotificationTargets:
+        push_user_ids = [
+            recipient.user_id
+            for recipient in recipients
+            if recipient.notification_type == NotificationType.MOBILE_PUSH
+        ]
+        # 端末はユーザーごとのキャッシュから読み、DBでの復号を避ける
+        devices = await DeviceEndpointCache().read(session, push_user_ids)
+        return NotificationTargets(tuple(recipients), tuple(devices))
+
+    async def read(self, session: AsyncSession, chat_id: int) -> NotificationTargets:
+        targets = self._read_local(chat_id)
+        if targets is not None:
+            return targets
+
+        keys = self._keys(chat_id)
+        version = ""
+        async with redis_connection(self.cache_type) as cache:
+            try:
+                cached, version = await cache.mget(*keys)
+                version = version or "0"
+            except redis.exceptions.RedisError:
+                logger.warning("NotificationTargetCache failed to read.", exc_info=True)
+                cached = None
+        if cached:
+            targets = await self._with_devices(
+                session, NotificationTargets.loads_recipients(cached)
+            )
+            self._write_local(chat_id, targets)
+            return targets
+
+        targets = await self._with_devices(session, await self._load(session, chat_id))
+        self._write_local(chat_id, targets)
+
+        if version:
+            async with redis_connection(self.cache_type) as cache:
+                try:
+                    await cache.eval(
+                        _FILL_SCRIPT,
+                        2,
+                        *keys,
+                        version,
+                        self.expiry,
+                        targets.dumps(),
+                    )
+                except redis.exceptions.RedisError:
+                    logger.warning(
+                        "NotificationTargetCache failed to fill.", exc_info=True
+                    )
+        return targets
+
+    async def invalidate(self, chat_ids: Iterable[int]) -> None:
+        chat_ids = list(chat_ids)
+        if not chat_ids:
+            return
+        for chat_id in chat_ids:
+            self._local.pop(chat_id, None)
+        async with redis_connection(self.cache_type) as cache:
+            try:
+                async with cache.pipeline(transaction=True) as pipe:
+                    for chat_id in chat_ids:
+                        keys = self._keys(chat_id)
+                        pipe.incr(keys[1])
+                        pipe.expire(keys[1], self.expiry)
+                        pipe.delete(keys[0])
+                    await pipe.execute()
+            except redis.exceptions.RedisError:
+                logger.warning(
+                    "NotificationTargetCache failed to invalidate.", exc_info=True
+                )
@@ -0,0 +1,212 @@
+import asyncio
+from typing import Collection, Sequence
+
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from app.db import AsyncSessionLocal
+from app.models import Chat, Session
+from app.settings import settings
+
+from .logging import logger
+from .mailer import EmailMessage, LocalMailer, SesMailer, get_mailer
+from .notification_digests import NotificationDigest, NotificationDigestQueue
+from .notification_targets import (
+    DeviceEndpointCache,
+    NotificationDevice,
+    NotificationTargetCache,
+    NotificationTargets,
+)
+from .presence import ChatPresence
+from .push import PushDispatcher
+
+
+class MessageNotifier:
+    """チャット参加者へ新着メッセージをメール・プッシュ通知で知らせる"""
+
+    def __init__(
+        self,
+        mailer: SesMailer | LocalMailer | None = None,
+        push: PushDispatcher | None = None,
+    ) -> None:
+        self.presence = ChatPresence()
+        self.digest_queue = NotificationDigestQueue()
+        self.mailer = mailer or get_mailer()
+        self.push = push or PushDispatcher()
+
+    async def send_email(self, email: str, payload: str) -> None:
+        await self.mailer.send(
+            [
+                EmailMessage(
+                    to=email, subject="[chat-service] posted message", body=payload
+                )
+            ]
+        )
+
+    async def disable_devices(
+        self, session: AsyncSession, devices: Sequence[NotificationDevice]
+    ) -> None:
+        """EndpointDisabledになった端末のdevice_tokenを削除し、通知先を更新する"""
+        session_ids = [i.session_id for i in devices if i.session_id is not None]
+        if not session_ids:
+            return
+        await Session.clear_device_tokens(session, session_ids)
+        chat_ids: set[int] = set()
+        for user_id in {i.user_id for i in devices}:
+            chat_ids.update(await Chat.read_ids_by_user_id(session, user_id))
+        await session.commit()
+        await DeviceEndpointCache().invalidate({i.user_id for i in devices})
+        await NotificationTargetCache().invalidate(chat_ids)
+
+    async def exclude_recipients(
+        self,
+        chat_id: int,
+        targets: NotificationTargets,
+        payload: str,
+        exclude_user_ids: Collection[int] = (),
+        message_id: int | None = None,
+    ) -> set[int]:
+        """即時の通知から除く参加者を返す
+
+        入室中の参加者はWebSocketで受信しているため通知しない。通知をまとめる設定の
+        参加者とメールで通知する参加者は遅延キューに積み、期限が来てから
+        run_notification_digestsが送る。
+        """
+        excluded = set(exclude_user_ids)
+        excluded |= await self.presence.online_user_ids(chat_id)
+        excluded |= await self.digest_queue.defer(
+            chat_id, targets, payload, excluded, message_id
+        )
+        return excluded
+
+    async def send(
+        self,
+        targets: NotificationTargets,
+        payload: str,
+        exclude_user_ids: Collection[int] = (),
+    ) -> list[NotificationDevice]:
+        """通知を送り、送信先として無効になっていた端末を返す"""
+        for email in targets.emails(exclude_user_ids):
+            await self.send_email(email, payload)
+
+        # device_tokenがnullでなく、UNKNOWNでない端末に並行して送信する
+        result = await self.push.dispatch(
+            targets.push_devices(exclude_user_ids), payload
+        )
+        return result.disabled
+
+    async def notify(
+        self,
+        session: AsyncSession,
+        chat_id: int,
+        payload: str,
+        exclude_user_ids: Collection[int] = (),
+        message_id: int | None = None,
+    ) -> None:
+        """入室していない参加者ごとに1件ずつ通知する"""
+        targets = await NotificationTargetCache().read(session, chat_id)
+        excluded = await self.exclude_recipients(
+            chat_id, targets, payload, exclude_user_ids, message_id
+        )
+        disabled = await self.send(targets, payload, excluded)
+        await self.disable_devices(session, disabled)
+
+    def _digest_email(self, email: str, digest: NotificationDigest) -> EmailMessage:
+        lines = list(digest.entries)
+        if digest.more:
+            lines.append(f"(+{digest.more} more messages)")
+        body = "\n".join(lines)
+        return EmailMessage(
+            to=email,
+            subject=f"[chat-service] {digest.count} new messages",
+            body=body,
+            template_data={
+                "chat_id": str(digest.chat_id),
+                "count": str(digest.count),
+                "messages": body,
+            },
+        )
+
+    async def send_digest(
+        self, session: AsyncSession, digest: NotificationDigest
+    ) -> list[EmailMessage]:
+        """最初の通知以降に入室していなければプッシュ通知を送り、送るメールを返す"""
+        last_seen = await self.presence.last_seen(digest.chat_id, digest.user_id)
+        if last_seen is not None and last_seen >= digest.since:
+            return []
+        # 参加者から外れた場合や通知を無効にした場合は送らない
+        targets = await NotificationTargetCache().read(session, digest.chat_id)
+        targets = targets.for_user(digest.user_id)
+        result = await self.push.dispatch(targets.push_devices(), digest.message)
+        await self.disable_devices(session, result.disabled)
+        return [self._digest_email(email, digest) for email in targets.emails()]
+
+    async def deliver_digests(
+        self, async_session: async_sessionmaker, now: float | None = None
+    ) -> int:
+        """期限が来たまとめた通知を1バッチ分送り、取り出した件数を返す"""
+        digests = await self.digest_queue.pop_due(
+            settings.NOTIFICATION_DIGEST_BATCH_SIZE, now
+        )
+        if not digests:
+            return 0
+        sent, failed = [], []
+        emails: list[tuple[NotificationDigest, list[EmailMessage]]] = []
+        async with async_session() as session:
+            for digest in digests:
+                try:
+                    messages = await self.send_digest(session, digest)
+                except Exception:
+                    logger.exception(
+                        f"Failed to send the digest for chat {digest.chat_id}."
+                    )
+                    failed.append(digest)
+                    continue
+                if messages:
+                    emails.append((digest, messages))
+                else:
+                    sent.append(digest)
+        # メールはバッチ分をまとめて送る
+        if emails:
+            try:
+                await self.mailer.send([m for _, messages in emails for m in messages])
+            except Exception:
+                logger.exception("Failed to send the digest emails.")
+                failed += [digest for digest, _ in emails]
+            else:
+                sent += [digest for digest, _ in emails]
+        # 送信できた通知のみ削除し、失敗した通知は次の取り出しで再送する
+        await self.digest_queue.complete(sent)
+        await self.digest_queue.release(failed, now)
+        return len(digests)
+
+    async def notify_chat(
+        self,
+        async_session: async_sessionmaker,
+        chat_id: int,
+        payload: str,
+        exclude_user_ids: Collection[int] = (),
+        message_id: int | None = None,
+    ) -> None:
+        """リクエストの処理後にBackgroundTasksから呼び出す"""
+        try:
+            async with async_session() as session:
+                await self.notify(
+                    session, chat_id, payload, exclude_user_ids, message_id
+                )
+        except Exception:
+            logger.exception(f"Failed to send notifications for chat {chat_id}.")
+
+
+async def run_notification_digests() -> None:
+    """起動中は期限が来たまとめた通知を送り続ける"""
+    notifier = MessageNotifier()
+    while True:
+        try:
+            while (
+                await notifier.deliver_digests(AsyncSessionLocal)
+                >= settings.NOTIFICATION_DIGEST_BATCH_SIZE
+            ):
+                pass
+        except Exception:
+            logger.exception("Failed to deliver the notification digests.")
+        await asyncio.sleep(settings.NOTIFICATION_DIGEST_POLL_INTERVAL)
@@ -0,0 +1,88 @@
+import logging
+import time
+import uuid
+
+import redis
+
+from app.settings import settings
+
+from .redis_cache import redis_connection
+from .types import CacheType
+
+logger = logging.getLogger(__name__)
+
+
+class ChatPresence:
+    """
+    WebSocketでチャットに入室中のユーザーを管理する
+
+    接続ごとに "{user_id}:{connection_id}" を最後のハートビートの時刻をスコアとして
+    sorted setに記録する。PRESENCE_EXPIRY秒以上更新されていない接続は退室済みとして
+    扱うため、プロセスが異常終了して退室を記録できなかった場合も残り続けない。
+    ユーザーごとに最後に入室していた時刻も記録し、まとめて送る通知の判定に使う。
+    """
+
+    def __init__(self) -> None:
+        self.cache_type = CacheType.PUBSUB
+        self.expiry = settings.PRESENCE_EXPIRY
+        # 最後に入室していた時刻は通知をまとめる期間の上限まで保持する
+        self.seen_expiry = settings.NOTIFICATION_DIGEST_MAX_DELAY + self.expiry
+
+    @staticmethod
+    def _keys(chat_id: int) -> list[str]:
+        return [f"presence_{chat_id}", f"presence_seen_{chat_id}"]
+
+    async def _record(
+        self, chat_id: int, user_id: int, connection_id: str, online: bool
+    ) -> None:
+        now = time.time()
+        member = f"{user_id}:{connection_id}"
+        keys = self._keys(chat_id)
+        async with redis_connection(self.cache_type) as cache:
+            try:
+                async with cache.pipeline(transaction=False) as pipe:
+                    if online:
+                        pipe.zadd(keys[0], {member: now})
+                    else:
+                        pipe.zrem(keys[0], member)
+                    pipe.zremrangebyscore(keys[0], "-inf", now - self.expiry)
+                    pipe.expire(keys[0], self.expiry)
+                    pipe.hset(keys[1], str(user_id), now)
+                    pipe.expire(keys[1], self.seen_expiry)
+                    await pipe.execute()
+            except redis.exceptions.RedisError:
+                logger.warning("ChatPresence failed to record.", exc_info=True)
+
+    async def enter(self, chat_id: int, user_id: int) -> str:
+        """入室を記録し、ハートビートと退室に使う接続IDを返す"""
+        connection_id = uuid.uuid4().hex
+        await self._record(chat_id, user_id, connection_id, True)
+        return connection_id
+
+    async def touch(self, chat_id: int, user_id: int, connection_id: str) -> None:
+        await self._record(chat_id, user_id, connection_id, True)
+
+    async def leave(self, chat_id: int, user_id: int, connection_id: str) -> None:
+        await self._record(chat_id, user_id, connection_id, False)
+
+    async def online_user_ids(self, chat_id: int) -> set[int]:
+        """入室中のユーザー。Redisに接続できない場合は空として全員に通知する"""
+        async with redis_connection(self.cache_type) as cache:
+            try:
+                members = await cache.zrangebyscore(
+                    self._keys(chat_id)[0], time.time() - self.expiry, "+inf"
+                )
+            except redis.exceptions.RedisError:
+                logger.warning("ChatPresence failed to read.", exc_info=True)
+                return set()
+        return {int(member.split(":", 1)[0]) for member in members}
+
+    async def last_seen(self, chat_id: int, user_id: int) -> float | None:
+        """ユーザーが最後に入室していた時刻 (UNIX時間)。記録がなければNone"""
+        async with redis_connection(self.cache_type) as cache:
+            try:
+                seen = await cache.hget(self._keys(chat_id)[1], str(user_id))
+            except redis.exceptions.RedisError:
+                logger.warning("ChatPresence failed to read.", exc_info=True)
+                return None
+        return float(seen) if seen is not None else None
@@ -0,0 +1,189 @@
+import asyncio
+import json
+import random
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from functools import partial
+from typing import Any, Collection, Sequence
+
+from botocore.exceptions import ClientError, ConnectionError, HTTPClientError
+
+from app.settings import settings
+
+from .aws_client import AWSClient
+from .logging import logger
+from .notification_targets import NotificationDevice
+from .types import AWSServiceType, PlatformType
+
+# 送信先の端末がアンインストールなどで無効になっている
+ENDPOINT_DISABLED = "EndpointDisabled"
+
+# 時間を空けて再送すれば成功する見込みのあるSNSのエラー
+_RETRYABLE_ERRORS = {
+    "Throttling",
+    "ThrottlingException",
+    "InternalError",
+    "InternalFailure",
+    "ServiceUnavailable",
+    "KMSThrottling",
+}
+
+
+def build_messages(payload: str) -> dict[PlatformType, str]:
+    """プラットフォームごとのSNSのメッセージを通知ごとに1回だけ組み立てる"""
+    return {
+        PlatformType.ANDROID: json.dumps({"GCM": json.dumps(payload)}),
+        PlatformType.IOS: json.dumps({"APNS": json.dumps({"aps": {"alert": payload}})}),
+    }
+
+
+@dataclass
+class PushResult:
+    sent: int = 0
+    failed: int = 0
+    retried: int = 0
+    disabled: list[NotificationDevice] = field(default_factory=list)
+
+
+class LocalSnsClient:
+    """
+    ローカル開発とベンチマーク用のSNSのスタブ
+
+    送信せずにpublishの引数を記録する。latencyでSNSの応答時間を模し、
+    disabled_arnsとthrottle_rateでEndpointDisabledとスロットリングを返す。
+    """
+
+    def __init__(
+        self,
+        latency: float = 0.0,
+        disabled_arns: Collection[str] = (),
+        throttle_rate: float = 0.0,
+    ) -> None:
+        self.latency = latency
+        self.disabled_arns = set(disabled_arns)
+        self.throttle_rate = throttle_rate
+        self.published: list[dict[str, Any]] = []
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _error(code: str) -> ClientError:
+        return ClientError({"Error": {"Code": code, "Message": code}}, "Publish")
+
+    def publish(self, **kwargs: Any) -> dict[str, str]:
+        if self.latency:
+            time.sleep(self.latency)
+        if kwargs["TargetArn"] in self.disabled_arns:
+            raise self._error(ENDPOINT_DISABLED)
+        if self.throttle_rate and random.random() < self.throttle_rate:
+            raise self._error("Throttling")
+        with self._lock:
+            self.published.append(kwargs)
+        logger.info(kwargs["Message"])
+        return {"MessageId": str(uuid.uuid4())}
+
+
+class PushDispatcher:
+    """
+    端末ごとのプッシュ通知をSNSへ並行して送る
+
+    同時に送る件数はconcurrencyで制限し、boto3の同期的な呼び出しは専用のスレッド
+    プールで実行する。スロットリングなど一時的なエラーは指数的に伸ばした上限までの
+    ランダムな時間を空けて再送し、EndpointDisabledの端末は結果として返す。
+    """
+
+    _executors: dict[int, ThreadPoolExecutor] = {}
+
+    def __init__(self, client: Any = None, concurrency: int | None = None) -> None:
+        self.client = client
+        self.concurrency = concurrency or settings.PUSH_CONCURRENCY
+        self.max_retries = settings.PUSH_MAX_RETRIES
+        self.retry_base_delay = settings.PUSH_RETRY_BASE_DELAY
+
+    def _executor(self) -> ThreadPoolExecutor:
+        executor = self._executors.get(self.concurrency)
+        if executor is None:
+            executor = ThreadPoolExecutor(
+                max_workers=self.concurrency, thread_name_prefix="push"
+            )
+            self._executors[self.concurrency] = executor
+        return executor
+
+    async def _get_client(self) -> Any:
+        if self.client is None:
+            # localではSNSに送信せずログに出力する
+            if settings.ENV == "local":
+                self.client = LocalSnsClient()
+            else:
+                self.client = await AWSClient.get_client(
+                    AWSServiceType.SNS, region_name=settings.REGION
+                )
+        return self.client
+
+    async def _publish(
+        self,
+        client: Any,
+        device: NotificationDevice,
+        message: str,
+        semaphore: asyncio.Semaphore,
+        result: PushResult,
+    ) -> None:
+        loop = asyncio.get_running_loop()
+        publish = partial(
+            client.publish,
+            TargetArn=device.device_token,  # device_tokenをTargetArnに設定
+            MessageStructure="json",
+            Message=message,
+        )
+        for attempt in range(self.max_retries + 1):
+            try:
+                async with semaphore:
+                    await loop.run_in_executor(self._executor(), publish)
+                result.sent += 1
+                return
+            except ClientError as e:
+                code = e.response.get("Error", {}).get("Code")
+                if code == ENDPOINT_DISABLED:
+                    result.disabled.append(device)
+                    return
+                if code not in _RETRYABLE_ERRORS:
+                    logger.warning(f"Failed to publish a push notification: {code}")
+                    result.failed += 1
+                    return
+            except (ConnectionError, HTTPClientError):
+                # 接続の失敗やタイムアウトも再送する
+                pass
+
+            if attempt < self.max_retries:
+                result.retried += 1
+                # 同時に失敗した送信が同じ間隔で再送しないようにばらつかせる
+                await asyncio.sleep(
+                    random.uniform(0, self.retry_base_delay * 2**attempt)
+                )
+        logger.warning("Gave up publishing a push notification after retries.")
+        result.failed += 1
+
+    async def dispatch(
+        self, devices: Sequence[NotificationDevice], payload: str
+    ) -> PushResult:
+        result = PushResult()
+        messages = build_messages(payload)
+        targets = [
+            (device, messages[device.platform_type])
+            for device in devices
+            if device.platform_type in messages
+        ]
+        if not targets:
+            return result
+
+        client = await self._get_client()
+        semaphore = asyncio.Semaphore(self.concurrency)
+        await asyncio.gather(
+            *(
+                self._publish(client, device, message, semaphore, result)
+                for device, message in targets
+            )
+        )
+        return result
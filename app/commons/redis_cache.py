@@ -14,6 +14,17 @@ from .types import CacheType
 logger = logging.getLogger(__name__)
 
 
+@asynccontextmanager
+async def redis_connection(cache_type: CacheType):
+    cache = aredis.from_url(
+        f"{settings.REDIS_URI}/{cache_type}", encoding="utf-8", decode_responses=True
+    )
+    try:
+        yield cache
+    finally:
+        await cache.aclose()
+
+
 class RedisCache:
     cache_type: CacheType
     _instances: dict[CacheType, "RedisCache"] = {}
@@ -36,15 +47,8 @@ class RedisCache:
             self.cache_type = cache_type
             self.expiry = expiry
 
-    @asynccontextmanager
-    async def _get_redis_connection(self):
-        cache = aredis.from_url(
-            f"{self.uri}/{self.cache_type}", encoding="utf-8", decode_responses=True
-        )
-        try:
-            yield cache
-        finally:
-            await cache.aclose()
+    def _get_redis_connection(self):
+        return redis_connection(self.cache_type)
 
     async def get(self, key: str) -> dict | None:
         async with self._get_redis_connection() as cache:
@@ -0,0 +1,165 @@
+import asyncio
+import json
+import logging
+import uuid
+from typing import Any, Awaitable, Callable, Iterable
+
+import redis
+
+from app.settings import settings
+
+from .redis_cache import redis_connection
+from .types import CacheType
+
+logger = logging.getLogger(__name__)
+
+# KEYS: lock
+# ARGV: token
+_RELEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+def user_scope(user_id: int) -> str:
+    return f"user:{user_id}"
+
+
+def chat_scope(chat_id: int) -> str:
+    return f"chat:{chat_id}"
+
+
+class ResponseCache:
+    """
+    一覧のレスポンスをユーザーやチャットごとのバージョンを含むキーでキャッシュする
+
+    関係するデータを変更した処理がコミット後にバージョンを更新するため、古いキーは
+    読まれなくなり期限切れで消える。同じキーの再計算はプロセス内では1つの処理に
+    まとめ、プロセス間ではRedisのロックを取得した1つの処理の結果を他が待つ。
+    """
+
+    # プロセス内で再計算中のキーと、その結果を待つためのFuture
+    _flights: dict[str, asyncio.Future] = {}
+
+    def __init__(self, name: str) -> None:
+        self.cache_type = CacheType.CACHE
+        self.name = name
+        self.expiry = settings.RESPONSE_CACHE_EXPIRY
+        self.lock_expiry = settings.RESPONSE_CACHE_LOCK_EXPIRY
+        self.poll_interval = settings.RESPONSE_CACHE_POLL_INTERVAL
+
+    @staticmethod
+    def _version_key(scope: str) -> str:
+        return f"{scope}:version"
+
+    async def read(
+        self,
+        scope: str,
+        params: str,
+        compute: Callable[[], Awaitable[Any]],
+    ) -> Any:
+        """キャッシュがあれば返し、なければcomputeの結果をJSONとして保存して返す"""
+        async with redis_connection(self.cache_type) as cache:
+            try:
+                version = await cache.get(self._version_key(scope)) or "0"
+                key = f"{self.name}:{scope}:{version}:{params}"
+                cached = await cache.get(key)
+            except redis.exceptions.RedisError:
+                logger.warning("ResponseCache failed to read.", exc_info=True)
+                return await compute()
+        if cached is not None:
+            return json.loads(cached)
+
+        flight = self._flights.get(key)
+        if flight is not None:
+            try:
+                return await asyncio.shield(flight)
+            except asyncio.CancelledError:
+                # 再計算していた処理が中断された場合は自分で計算する
+                if not flight.cancelled():
+                    raise
+                return await compute()
+
+        flight = asyncio.get_running_loop().create_future()
+        self._flights[key] = flight
+        try:
+            value = await self._compute_once(key, compute)
+        except Exception as e:
+            flight.set_exception(e)
+            # 待っている処理がなくても例外を未取得として警告しない
+            flight.exception()
+            raise
+        except BaseException:
+            flight.cancel()
+            raise
+        else:
+            flight.set_result(value)
+            return value
+        finally:
+            self._flights.pop(key, None)
+
+    async def _compute_once(
+        self, key: str, compute: Callable[[], Awaitable[Any]]
+    ) -> Any:
+        lock_key = f"{key}:lock"
+        token = uuid.uuid4().hex
+        acquired = False
+        async with redis_connection(self.cache_type) as cache:
+            try:
+                acquired = bool(
+                    await cache.set(
+                        lock_key, token, nx=True, px=int(self.lock_expiry * 1000)
+                    )
+                )
+                if not acquired:
+                    # 他のプロセスが再計算中であれば、保存されるかロックが外れるまで待つ
+                    loop = asyncio.get_running_loop()
+                    deadline = loop.time() + self.lock_expiry
+                    while loop.time() < deadline:
+                        await asyncio.sleep(self.poll_interval)
+                        async with cache.pipeline(transaction=False) as pipe:
+                            pipe.get(key)
+                            pipe.exists(lock_key)
+                            cached, locked = await pipe.execute()
+                        if cached is not None:
+                            return json.loads(cached)
+                        if not locked:
+                            break
+            except redis.exceptions.RedisError:
+                logger.warning("ResponseCache failed to lock.", exc_info=True)
+
+        value = await compute()
+
+        async with redis_connection(self.cache_type) as cache:
+            try:
+                await cache.set(
+                    key, json.dumps(value, ensure_ascii=False), ex=self.expiry
+                )
+                if acquired:
+                    await cache.eval(_RELEASE_SCRIPT, 1, lock_key, token)
+            except redis.exceptions.RedisError:
+                logger.warning("ResponseCache failed to set.", exc_info=True)
+        return value
+
+    @classmethod
+    async def invalidate(cls, scopes: Iterable[str]) -> None:
+        """スコープのバージョンを更新し、それまでのキャッシュを読まれなくする"""
+        scopes = list(scopes)
+        if not scopes:
+            return
+        # バージョンの再利用で古いキャッシュを読まないよう、連番ではなく一意な値にする
+        version = uuid.uuid4().hex
+        async with redis_connection(CacheType.CACHE) as cache:
+            try:
+                async with cache.pipeline(transaction=False) as pipe:
+                    for scope in scopes:
+                        pipe.set(
+                            cls._version_key(scope),
+                            version,
+                            ex=settings.RESPONSE_CACHE_EXPIRY * 2,
+                        )
+                    await pipe.execute()
+            except redis.exceptions.RedisError:
+                logger.warning("ResponseCache failed to invalidate.", exc_info=True)
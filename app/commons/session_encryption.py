@@ -0,0 +1,101 @@
+from typing import cast
+
+from sqlalchemy import (
+    Column,
+    Connection,
+    Integer,
+    LargeBinary,
+    MetaData,
+    String,
+    Table,
+    bindparam,
+    or_,
+    select,
+    type_coerce,
+    update,
+)
+
+from app.models.sessions import REFRESH_TOKEN_INDEX
+
+from .crypto import blind_index
+from .type_decorators import EncryptedString
+
+
+def sessions_table(mode: str) -> Table:
+    """暗号化する方式を指定したsessionsのテーブル (マイグレーションからも使う)"""
+    return Table(
+        "sessions",
+        MetaData(),
+        Column("id", Integer, primary_key=True),
+        Column("device_token", EncryptedString("sessions.device_token", mode)),
+        Column("refresh_token", EncryptedString("sessions.refresh_token", mode)),
+        Column("refresh_token_hash", String(64)),
+    )
+
+
+def reencrypt_sessions_batch(
+    connection: Connection, mode: str, after_id: int, batch_size: int
+) -> list[int]:
+    """
+    after_idより後のsessionsを最大batch_size件、modeの方式と現在の鍵で暗号化し直す
+
+    refresh_token_hashが未設定の行、またはdevice_tokenかrefresh_tokenが別の方式や
+    以前の鍵で暗号化されている行が対象で、処理した行のIDを返す。読み出してから更新する
+    までにアプリケーションが書き換えた行は、暗号文が一致しないため上書きしない。
+    """
+    table = sessions_table(mode)
+    device_token_type = cast(EncryptedString, table.c.device_token.type)
+    refresh_token_type = cast(EncryptedString, table.c.refresh_token.type)
+    raw_device_token = type_coerce(table.c.device_token, LargeBinary)
+    raw_refresh_token = type_coerce(table.c.refresh_token, LargeBinary)
+    rows = connection.execute(
+        select(
+            table.c.id,
+            table.c.device_token,
+            table.c.refresh_token,
+            raw_device_token.label("raw_device_token"),
+            raw_refresh_token.label("raw_refresh_token"),
+        )
+        .where(
+            table.c.id > after_id,
+            or_(
+                table.c.refresh_token_hash.is_(None),
+                device_token_type.outdated(table.c.device_token),
+                refresh_token_type.outdated(table.c.refresh_token),
+            ),
+        )
+        .order_by(table.c.id)
+        .limit(batch_size)
+    ).all()
+    if not rows:
+        return []
+
+    connection.execute(
+        update(table)
+        .where(
+            table.c.id == bindparam("b_id"),
+            raw_device_token.is_not_distinct_from(
+                bindparam("b_raw_device_token", type_=LargeBinary)
+            ),
+            raw_refresh_token == bindparam("b_raw_refresh_token", type_=LargeBinary),
+        )
+        .values(
+            device_token=bindparam("b_device_token", type_=device_token_type),
+            refresh_token=bindparam("b_refresh_token", type_=refresh_token_type),
+            refresh_token_hash=bindparam("b_refresh_token_hash"),
+        ),
+        [
+            {
+                "b_id": row.id,
+                "b_raw_device_token": row.raw_device_token,
+                "b_raw_refresh_token": row.raw_refresh_token,
+                "b_device_token": row.device_token,
+                "b_refresh_token": row.refresh_token,
+                "b_refresh_token_hash": blind_index(
+                    row.refresh_token, REFRESH_TOKEN_INDEX
+                ),
+            }
+            for row in rows
+        ],
+    )
+    return [row.id for row in rows]
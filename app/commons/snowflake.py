@@ -0,0 +1,202 @@
+import asyncio
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import Iterable
+
+import redis
+
+from app.settings import settings
+
+from .logging import logger
+from .redis_cache import redis_connection
+from .types import CacheType
+
+# JavaScriptのNumberで正確に扱えるよう53ビットに収める
+# | 41ビット: EPOCHからのミリ秒 | 5ビット: ワーカーID | 7ビット: シーケンス |
+EPOCH_MS = 1704067200000  # 2024-01-01T00:00:00Z
+TIMESTAMP_BITS = 41
+WORKER_ID_BITS = 5
+SEQUENCE_BITS = 7
+MAX_WORKER_ID = (1 << WORKER_ID_BITS) - 1
+MAX_SEQUENCE = (1 << SEQUENCE_BITS) - 1
+MAX_ID = (1 << (TIMESTAMP_BITS + WORKER_ID_BITS + SEQUENCE_BITS)) - 1
+
+WORKER_ID_KEY = "worker:{}"
+
+
+class SnowflakeGenerator:
+    """
+    時刻順に並ぶ53ビットのIDを生成する
+
+    同一ミリ秒内はシーケンスを進め、使い切った場合や時計が戻った場合は
+    直前のミリ秒の次へ論理時刻を進めるため、待機せずに単調増加を保つ。
+    リースしたワーカーIDを失った間はsuspendで停止し、IDを生成しない。
+    generate_atは取り込むメッセージの作成時刻からIDを生成し、ミリ秒ごとの
+    シーケンスをプロセス内で保持する。
+    """
+
+    def __init__(self, worker_id: int | None = 0, epoch_ms: int = EPOCH_MS) -> None:
+        self.epoch_ms = epoch_ms
+        self.worker_id = worker_id or 0
+        self._last_ms = -1
+        self._sequence = 0
+        # ワーカーIDを指定しない場合はリースを取得するまで生成しない
+        self._suspended = worker_id is None
+        self._sequences_at: dict[int, int] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def worker_id(self) -> int:
+        return self._worker_id
+
+    @worker_id.setter
+    def worker_id(self, worker_id: int) -> None:
+        if not 0 <= worker_id <= MAX_WORKER_ID:
+            raise ValueError(f"worker_id must be between 0 and {MAX_WORKER_ID}.")
+        self._worker_id = worker_id
+        self._suspended = False
+
+    def suspend(self) -> None:
+        with self._lock:
+            self._suspended = True
+
+    def _now_ms(self) -> int:
+        return time.time_ns() // 1_000_000 - self.epoch_ms
+
+    def _check(self) -> None:
+        if self._suspended:
+            # 別のプロセスが同じワーカーIDで生成している可能性がある
+            raise RuntimeError("No snowflake worker id is held.")
+
+    def _compose(self, timestamp_ms: int, sequence: int) -> int:
+        if timestamp_ms >= 1 << TIMESTAMP_BITS:
+            raise OverflowError("Snowflake timestamp exceeded 41 bits.")
+        return (
+            timestamp_ms << (WORKER_ID_BITS + SEQUENCE_BITS)
+            | self._worker_id << SEQUENCE_BITS
+            | sequence
+        )
+
+    def _next(self) -> int:
+        self._check()
+        now_ms = self._now_ms()
+        if now_ms > self._last_ms:
+            self._last_ms, self._sequence = now_ms, 0
+        elif self._sequence < MAX_SEQUENCE:
+            self._sequence += 1
+        else:
+            self._last_ms, self._sequence = self._last_ms + 1, 0
+        return self._compose(self._last_ms, self._sequence)
+
+    def _next_at(self, timestamp: datetime) -> int:
+        self._check()
+        if timestamp.tzinfo is None:
+            timestamp = timestamp.replace(tzinfo=timezone.utc)
+        timestamp_ms = int(timestamp.timestamp() * 1000) - self.epoch_ms
+        if timestamp_ms < 0:
+            raise ValueError(f"{timestamp} is before the snowflake epoch.")
+        # 同じミリ秒のシーケンスを使い切った場合は次のミリ秒へ進める
+        while self._sequences_at.get(timestamp_ms, 0) > MAX_SEQUENCE:
+            timestamp_ms += 1
+        sequence = self._sequences_at.get(timestamp_ms, 0)
+        self._sequences_at[timestamp_ms] = sequence + 1
+        return self._compose(timestamp_ms, sequence)
+
+    def generate(self) -> int:
+        with self._lock:
+            return self._next()
+
+    def generate_many(self, count: int) -> list[int]:
+        with self._lock:
+            return [self._next() for _ in range(count)]
+
+    def generate_at(self, timestamp: datetime) -> int:
+        """作成時刻からIDを生成する。タイムゾーンのない時刻はUTCとして扱う"""
+        with self._lock:
+            return self._next_at(timestamp)
+
+    def generate_many_at(self, timestamps: Iterable[datetime]) -> list[int]:
+        with self._lock:
+            return [self._next_at(timestamp) for timestamp in timestamps]
+
+    def parse(self, snowflake_id: int) -> tuple[datetime, int, int]:
+        """IDを(生成時刻, ワーカーID, シーケンス)に分解する"""
+        timestamp_ms = (
+            snowflake_id >> (WORKER_ID_BITS + SEQUENCE_BITS)
+        ) + self.epoch_ms
+        return (
+            datetime.fromtimestamp(timestamp_ms / 1000, tz=timezone.utc),
+            snowflake_id >> SEQUENCE_BITS & MAX_WORKER_ID,
+            snowflake_id & MAX_SEQUENCE,
+        )
+
+
+snowflake = SnowflakeGenerator(settings.SNOWFLAKE_WORKER_ID)
+
+
+def generate_id() -> int:
+    return snowflake.generate()
+
+
+class WorkerIdLease:
+    """
+    プロセスごとに重複しないワーカーIDをRedisで払い出す
+
+    リースは明示的に解放せず期限切れを待つ。停止直後に時計の遅れた別ホストが
+    同じIDを取得し、同じミリ秒のIDを生成するのを防ぐため。
+    """
+
+    def __init__(self) -> None:
+        self.cache_type = CacheType.SNOWFLAKE
+        self.expiry = settings.SNOWFLAKE_LEASE_EXPIRY
+        self.token = uuid.uuid4().hex
+        self.worker_id: int | None = None
+        self.renewed_at = 0.0
+
+    async def acquire(self) -> int | None:
+        """空いているワーカーIDを取得し、生成器に設定する"""
+        async with redis_connection(self.cache_type) as cache:
+            for worker_id in range(MAX_WORKER_ID + 1):
+                key = WORKER_ID_KEY.format(worker_id)
+                if await cache.set(key, self.token, nx=True, ex=self.expiry):
+                    self.renewed_at = time.monotonic()
+                    self.worker_id = snowflake.worker_id = worker_id
+                    logger.info(f"Acquired snowflake worker id {worker_id}.")
+                    return worker_id
+        logger.error("No snowflake worker id is available.")
+        return None
+
+    async def renew(self) -> bool:
+        if self.worker_id is None:
+            return False
+        key = WORKER_ID_KEY.format(self.worker_id)
+        async with redis_connection(self.cache_type) as cache:
+            if await cache.get(key) != self.token:
+                self.release()
+                return False
+            await cache.expire(key, self.expiry)
+        self.renewed_at = time.monotonic()
+        return True
+
+    def release(self) -> None:
+        """リースを失ったため、取り直すまでIDの生成を止める"""
+        if self.worker_id is not None:
+            logger.error(f"Lost snowflake worker id {self.worker_id}.")
+        self.worker_id = None
+        snowflake.suspend()
+
+
+async def run_worker_id_lease(lease: WorkerIdLease) -> None:
+    """起動中はワーカーIDのリースを更新し、失った場合は取り直す"""
+    while True:
+        await asyncio.sleep(lease.expiry / 3)
+        try:
+            if not await lease.renew():
+                await lease.acquire()
+        except redis.exceptions.RedisError:
+            logger.exception("Failed to renew snowflake worker id lease.")
+            # 更新できないまま期限が過ぎたリースは他のプロセスが取得し得る
+            if time.monotonic() - lease.renewed_at >= lease.expiry:
+                lease.release()
@@ -0,0 +1,93 @@
+import asyncio
+import shutil
+from pathlib import Path
+
+from itsdangerous import BadSignature, URLSafeTimedSerializer
+
+from app.settings import settings
+
+from .aws_client import AWSClient
+from .types import AWSServiceType
+
+
+class S3Storage:
+    def __init__(self, bucket: str | None = None) -> None:
+        self.bucket = bucket or settings.STORAGE_BUCKET
+
+    async def upload_file(self, path: Path, key: str, content_type: str) -> None:
+        client = await AWSClient.get_client(
+            AWSServiceType.S3, region_name=settings.REGION
+        )
+        # upload_fileはファイルから分割して送信するためメモリに全体を載せない
+        await asyncio.to_thread(
+            client.upload_file,
+            str(path),
+            self.bucket,
+            key,
+            ExtraArgs={"ContentType": content_type},
+        )
+
+    async def download_file(self, key: str, path: Path) -> None:
+        client = await AWSClient.get_client(
+            AWSServiceType.S3, region_name=settings.REGION
+        )
+        await asyncio.to_thread(client.download_file, self.bucket, key, str(path))
+
+    async def delete_file(self, key: str) -> None:
+        client = await AWSClient.get_client(
+            AWSServiceType.S3, region_name=settings.REGION
+        )
+        await asyncio.to_thread(client.delete_object, Bucket=self.bucket, Key=key)
+
+    async def generate_url(self, key: str, expiry: int) -> str:
+        client = await AWSClient.get_client(
+            AWSServiceType.S3, region_name=settings.REGION
+        )
+        return client.generate_presigned_url(
+            "get_object",
+            Params={"Bucket": self.bucket, "Key": key},
+            ExpiresIn=expiry,
+        )
+
+
+class LocalStorage:
+    """ローカル開発用のファイルシステムストレージ。署名付きURLはitsdangerousで代替する"""
+
+    def __init__(self, root: str | None = None) -> None:
+        self.root = Path(root or settings.STORAGE_LOCAL_DIR).resolve()
+        self.serializer = URLSafeTimedSerializer(settings.SECRET, salt="storage")
+
+    def _path(self, key: str) -> Path:
+        path = (self.root / key).resolve()
+        if not path.is_relative_to(self.root):
+            raise ValueError(f"Invalid storage key: {key}")
+        return path
+
+    async def upload_file(self, path: Path, key: str, content_type: str) -> None:
+        destination = self._path(key)
+        destination.parent.mkdir(parents=True, exist_ok=True)
+        await asyncio.to_thread(shutil.copyfile, path, destination)
+
+    async def download_file(self, key: str, path: Path) -> None:
+        await asyncio.to_thread(shutil.copyfile, self._path(key), path)
+
+    async def delete_file(self, key: str) -> None:
+        self._path(key).unlink(missing_ok=True)
+
+    async def generate_url(self, key: str, expiry: int) -> str:
+        token = self.serializer.dumps({"key": key, "expiry": expiry})
+        return f"/api/exports/download/{token}"
+
+    def resolve(self, token: str) -> Path | None:
+        """署名付きトークンを検証し、有効期限内であればファイルのパスを返す"""
+        try:
+            payload = self.serializer.loads(token)
+            payload = self.serializer.loads(token, max_age=payload["expiry"])
+            path = self._path(payload["key"])
+        except (BadSignature, KeyError, TypeError, ValueError):
+            return None
+        return path if path.is_file() else None
+
+
+def get_storage() -> S3Storage | LocalStorage:
+    return LocalStorage() if settings.ENV == "local" else S3Storage()
@@ -0,0 +1,30 @@
+from typing import AsyncIterator
+
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+
+async def _ndjson_lines(
+    first: BaseModel | None, rows: AsyncIterator[BaseModel]
+) -> AsyncIterator[bytes]:
+    if first is None:
+        return
+    yield first.model_dump_json().encode("utf-8") + b"\n"
+    async for row in rows:
+        yield row.model_dump_json().encode("utf-8") + b"\n"
+
+
+async def ndjson_response(rows: AsyncIterator[BaseModel]) -> StreamingResponse:
+    """
+    1行ずつシリアライズしてNDJSONとして返却する
+
+    ストリーム開始後はステータスコードを変更できないため、最初の1件を先に取得し
+    認可エラーなどのHTTPExceptionは通常のエラーレスポンスとして返す。
+    """
+    try:
+        first = await anext(rows)
+    except StopAsyncIteration:
+        first = None
+    return StreamingResponse(_ndjson_lines(first, rows), media_type=NDJSON_MEDIA_TYPE)
@@ -1,8 +1,23 @@
 import os
 
-from sqlalchemy import String, TypeDecorator, func, type_coerce
+from sqlalchemy import (
+    LargeBinary,
+    String,
+    TypeDecorator,
+    case,
+    func,
+    literal,
+    type_coerce,
+)
 from sqlalchemy.dialects.postgresql import BYTEA
 
+from .crypto import VersionedCipher
+
+# アプリケーションで暗号化した値の先頭に付ける。pgp_sym_encryptの出力は0xc3から始まる
+AES_GCM_MARKER = "aes:"
+# 復号した結果がどちらの方式の行かを区別するために、pgp_sym_decryptの結果の先頭に付ける
+PGP_MARKER = "pgp:"
+
 
 class PGPString(TypeDecorator):
     impl = BYTEA
@@ -23,3 +38,80 @@ class PGPString(TypeDecorator):
 
     def column_expression(self, col):
         return func.pgp_sym_decrypt(col, self.passphrase)
+
+
+class EncryptedString(TypeDecorator):
+    """
+    pgcryptoかアプリケーションのAES-GCMのどちらかで暗号化して保存する文字列
+
+    - pgp: PGPStringと同じくPostgresでpgp_sym_encrypt・pgp_sym_decryptする
+    - aes_gcm: アプリケーションで暗号化し、"aes:v{鍵のバージョン}:"を付けて保存する。
+      DBのCPUを使わず、鍵はプロセス内で導出済みのものを使い回す
+    読み出しは行ごとにどちらの方式かを判定して復号するため、方式や鍵を切り替えた後も
+    暗号化し直すまで以前の行を読める。purposeは鍵の導出とAADに使う。
+    """
+
+    impl = BYTEA
+
+    cache_ok = True
+
+    def __init__(self, purpose: str, mode: str = "pgp"):
+        super().__init__()
+        self.purpose = purpose
+        self.mode = mode
+        self.passphrase = os.environ["SECRET"]
+        self._cipher: VersionedCipher | None = None
+
+    @property
+    def cipher(self) -> VersionedCipher:
+        if self._cipher is None:
+            self._cipher = VersionedCipher(self.purpose)
+        return self._cipher
+
+    @property
+    def prefix(self) -> str:
+        """現在の方式と鍵のバージョンで暗号化した値の先頭"""
+        if self.mode == "aes_gcm":
+            return AES_GCM_MARKER + self.cipher.prefix
+        return ""
+
+    def bind_expression(self, bindvalue):
+        if self.mode == "aes_gcm":
+            # process_bind_paramで暗号化した値をそのまま保存する
+            return bindvalue
+        bindvalue = type_coerce(bindvalue, String)
+        return func.pgp_sym_encrypt(bindvalue.cast(String), self.passphrase)
+
+    def process_bind_param(self, value, dialect):
+        if value is None or self.mode != "aes_gcm":
+            return value
+        return (AES_GCM_MARKER + self.cipher.encrypt(value)).encode()
+
+    def column_expression(self, col):
+        raw = type_coerce(col, LargeBinary)
+        return case(
+            (
+                func.substring(raw, 1, len(AES_GCM_MARKER))
+                == literal(AES_GCM_MARKER.encode(), LargeBinary),
+                func.convert_from(raw, "UTF8"),
+            ),
+            else_=literal(PGP_MARKER) + func.pgp_sym_decrypt(raw, self.passphrase),
+        )
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        if isinstance(value, (bytes, memoryview)):
+            value = bytes(value).decode()
+        if value.startswith(AES_GCM_MARKER):
+            return self.cipher.decrypt(value[len(AES_GCM_MARKER) :])
+        return value[len(PGP_MARKER) :]
+
+    def outdated(self, col):
+        """現在の方式と鍵のバージョンで暗号化されていない行 (NULLの行は含まない)"""
+        raw = type_coerce(col, LargeBinary)
+        if self.mode == "aes_gcm":
+            prefix = self.prefix.encode()
+            return func.substring(raw, 1, len(prefix)) != literal(prefix, LargeBinary)
+        marker = AES_GCM_MARKER.encode()
+        return func.substring(raw, 1, len(marker)) == literal(marker, LargeBinary)
@@ -7,6 +7,14 @@ class CacheType(IntEnum):
     ACCESS_TOKEN = 2
     PUBSUB = 3
     CACHE = 4
+    RECENT_MESSAGES = 5
+    EXPORT_JOBS = 6
+    SNOWFLAKE = 7
+    IDEMPOTENCY = 8
+    MEMBERSHIP = 9
+    NOTIFICATION_TARGETS = 10
+    NOTIFICATION_DIGESTS = 11
+    DEVICE_ENDPOINTS = 12
 
 
 class TokenType(Enum):
@@ -25,6 +33,21 @@ class ChatType(IntEnum):
     GROUP = 1
 
 
+class ChatEventType(IntEnum):
+    MESSAGE_CREATED = 0
+    MESSAGE_DELETED = 1
+    MESSAGES_READ = 2
+    PARTICIPANT_ADDED = 3
+    PARTICIPANT_REMOVED = 4
+
+
+class ExportStatus(Enum):
+    PENDING = "pending"
+    RUNNING = "running"
+    COMPLETED = "completed"
+    FAILED = "failed"
+
+
 class PlatformType(IntEnum):
     UNKNOWN = 0
     IOS = 1
@@ -1,3 +1,4 @@
+import asyncio
 from contextlib import asynccontextmanager
 from typing import Union
 
@@ -6,8 +7,6 @@ from authlib.integrations.starlette_client import OAuth
 from fastapi import Depends, FastAPI, WebSocket
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
-from fastapi_cache import FastAPICache
-from fastapi_cache.backends.redis import RedisBackend
 from fastapi_limiter import FastAPILimiter
 from sqladmin import Admin
 from sqladmin.authentication import AuthenticationBackend
@@ -18,9 +17,15 @@ from starlette.responses import RedirectResponse, Response
 from app.api.main import router as api_router
 from app.commons.admin import admins
 from app.commons.authentication import websocket_headers
+from app.commons.chat_purge import run_chat_purge
 from app.commons.exceptions import register_exception_handlers
 from app.commons.logging import LoggingContextRoute
+from app.commons.message_outbox import run_message_outbox_relay
+from app.commons.message_partitions import run_partition_maintenance
+from app.commons.message_retention import run_message_retention
 from app.commons.middlewares import TimeoutMiddleware
+from app.commons.notifications import run_notification_digests
+from app.commons.snowflake import WorkerIdLease, run_worker_id_lease
 from app.commons.types import CacheType
 from app.db import async_engine
 from app.models.schema import AccessTokenSchema
@@ -70,16 +75,36 @@ async def lifespan(app: FastAPI):
     )
     await FastAPILimiter.init(redis_throttling_connection)
 
-    # FastAPICache用の別のRedis接続
-    redis_cache_connection = redis.from_url(
-        f"{settings.REDIS_URI}/{CacheType.CACHE}",
-    )
-    FastAPICache.init(RedisBackend(redis_cache_connection), prefix="fastapi-cache")
+    # メッセージIDの採番に使うワーカーIDをリクエストの受付前に取得する
+    lease_task = None
+    if settings.SNOWFLAKE_WORKER_ID is None:
+        lease = WorkerIdLease()
+        if await lease.acquire() is None:
+            raise RuntimeError("No snowflake worker id is available.")
+        lease_task = asyncio.create_task(run_worker_id_lease(lease))
+
+    # messagesの先の月のパーティションを定期的に作成する
+    partition_task = asyncio.create_task(run_partition_maintenance())
+    # 保持期間を過ぎたメッセージを定期的に削除する
+    retention_task = asyncio.create_task(run_message_retention())
+    # 作成されたメッセージをWebSocketの各ルームへ配信する
+    outbox_task = asyncio.create_task(run_message_outbox_relay())
+    # 論理削除したチャットのメッセージと参加者を分割して削除する
+    purge_task = asyncio.create_task(run_chat_purge())
+    # 入室しないまま期限が来たまとめた通知を送る
+    digest_task = asyncio.create_task(run_notification_digests())
+
+    tasks = [partition_task, retention_task, outbox_task, purge_task, digest_task]
+    if lease_task:
+        tasks.append(lease_task)
 
     try:
         yield
     finally:
-        pass
+        for task in tasks:
+            task.cancel()
+        # 処理中のトランザクションなどを後始末してから終了する
+        await asyncio.gather(*tasks, return_exceptions=True)
 
 
 app = FastAPI(
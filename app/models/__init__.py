@@ -1,11 +1,17 @@
 __all__ = [
     "Base",
+    "ChatEvent",
     "ChatParticipants",
     "Chat",
     "Message",
+    "MessageArchive",
+    "MessageOutbox",
+    "RetentionPolicy",
+    "RetentionRun",
     "ChatSchema",
     "MaskedUserSchema",
     "MessageSchema",
+    "ArchivedMessageSchema",
     "SessionSchema",
     "UserSchema",
     "Session",
@@ -13,10 +19,16 @@ __all__ = [
 ]
 
 from .base import Base
+from .chat_events import ChatEvent
 from .chat_participants import ChatParticipants
 from .chats import Chat
+from .message_archives import MessageArchive
+from .message_outbox import MessageOutbox
 from .messages import Message
+from .retention_policies import RetentionPolicy
+from .retention_runs import RetentionRun
 from .schema import (
+    ArchivedMessageSchema,
     ChatSchema,
     MaskedUserSchema,
     MessageSchema,
@@ -0,0 +1,157 @@
+from __future__ import annotations
+
+from typing import AsyncIterator
+
+from sqlalchemy import (
+    BigInteger,
+    Column,
+    ColumnElement,
+    Index,
+    Integer,
+    Text,
+    and_,
+    cast,
+    func,
+    insert,
+    or_,
+    select,
+    text,
+    tuple_,
+)
+from sqlalchemy.dialects.postgresql import ARRAY
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Mapped
+
+from app.commons.types import ChatEventType
+
+from .base import TimestampedEntity
+from .chat_participants import ChatParticipants
+
+MEMBERSHIP_EVENT_TYPES = (
+    ChatEventType.PARTICIPANT_ADDED,
+    ChatEventType.PARTICIPANT_REMOVED,
+)
+
+
+def _to_bigint(xid: ColumnElement) -> ColumnElement[int]:
+    # xid8はbigintに直接キャストできないためtextを経由する
+    return cast(cast(xid, Text), BigInteger)
+
+
+class ChatEvent(TimestampedEntity):
+    """
+    差分同期用の変更ログ。(xid, id)が同期トークンになる
+
+    idはINSERT時に採番されるため、コミットの順序とは一致しない。書き込んだトランザクション
+    のIDをxidに記録し、実行中のトランザクションより前 (pg_snapshot_xmin未満) のイベント
+    だけを(xid, id)の順に返すことで、後からコミットされたイベントを読み飛ばさない。
+    """
+
+    __tablename__ = "chat_events"
+
+    id: Mapped[int] = Column(BigInteger, primary_key=True, autoincrement=True)  # type: ignore
+    # チャット削除後もイベントを残すため外部キーは張らない
+    chat_id: Mapped[int] = Column(Integer, nullable=False)  # type: ignore
+    event_type: Mapped[ChatEventType] = Column(Integer, nullable=False)  # type: ignore
+    user_id: Mapped[int | None] = Column(Integer, nullable=True)  # type: ignore
+    message_ids: Mapped[list[int]] = Column(ARRAY(BigInteger), server_default="{}")  # type: ignore
+    xid: Mapped[int] = Column(  # type: ignore
+        BigInteger,
+        server_default=text("(pg_current_xact_id()::text)::bigint"),
+        nullable=False,
+    )
+
+    __table_args__ = (
+        Index("ix_chat_events_chat_id_xid_id", "chat_id", "xid", "id"),
+        Index("ix_chat_events_user_id_xid_id", "user_id", "xid", "id"),
+    )
+
+    @classmethod
+    async def read_all_since(
+        cls,
+        session: AsyncSession,
+        user_id: int,
+        chat_ids: list[int],
+        since: tuple[int, int],
+        limit: int,
+    ) -> AsyncIterator[ChatEvent]:
+        # 参加中のチャットのイベントと、自分自身の参加状態の変更イベントを返す
+        # 実行中の他のトランザクションのうち最も古いものより前のイベントに限る
+        # (pg_snapshot_xminは自身のトランザクションも含むためxipから求める)
+        snapshot = func.pg_current_snapshot()
+        xip = func.pg_snapshot_xip(snapshot).column_valued("xip")
+        horizon = func.coalesce(
+            select(func.min(_to_bigint(xip))).scalar_subquery(),
+            _to_bigint(func.pg_snapshot_xmax(snapshot)),
+        )
+        stmt = (
+            select(cls)
+            .where(
+                tuple_(cls.xid, cls.id) > since,
+                cls.xid < horizon,
+                or_(
+                    cls.chat_id.in_(chat_ids),
+                    and_(
+                        cls.user_id == user_id,
+                        cls.event_type.in_(MEMBERSHIP_EVENT_TYPES),
+                    ),
+                ),
+            )
+            .order_by(cls.xid, cls.id)
+            .limit(limit)
+        )
+        stream = await session.stream_scalars(stmt)
+        async for row in stream:
+            yield row
+
+    @classmethod
+    async def create(
+        cls,
+        session: AsyncSession,
+        chat_id: int,
+        event_type: ChatEventType,
+        user_id: int | None = None,
+        message_ids: list[int] | None = None,
+    ) -> None:
+        await session.execute(
+            insert(cls).values(
+                chat_id=chat_id,
+                event_type=event_type,
+                user_id=user_id,
+                message_ids=message_ids or [],
+            )
+        )
+
+    @classmethod
+    async def create_membership_events(
+        cls,
+        session: AsyncSession,
+        chat_id: int,
+        event_type: ChatEventType,
+        user_ids: list[int],
+    ) -> None:
+        if not user_ids:
+            return
+        await session.execute(
+            insert(cls),
+            [
+                {"chat_id": chat_id, "event_type": event_type, "user_id": user_id}
+                for user_id in user_ids
+            ],
+        )
+
+    @classmethod
+    async def create_chat_deleted_events(
+        cls, session: AsyncSession, chat_id: int, created_by: int
+    ) -> None:
+        # 削除前に参加者全員分の退出イベントを記録する
+        stmt = select(ChatParticipants.user_id).where(
+            ChatParticipants.chat_id == chat_id
+        )
+        user_ids = list((await session.execute(stmt)).scalars())
+        await cls.create_membership_events(
+            session,
+            chat_id,
+            ChatEventType.PARTICIPANT_REMOVED,
+            [created_by, *user_ids],
+        )
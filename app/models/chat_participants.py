@@ -2,7 +2,20 @@ from __future__ import annotations
 
 from typing import AsyncIterator
 
-from sqlalchemy import Column, ForeignKey, join, select
+from sqlalchemy import (
+    ARRAY,
+    Column,
+    ForeignKey,
+    Index,
+    String,
+    any_,
+    cast,
+    delete,
+    join,
+    literal,
+    select,
+)
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Mapped, joinedload, relationship
 
@@ -23,6 +36,11 @@ class ChatParticipants(TimestampedEntity):
     chat = relationship("Chat", back_populates="participants")
     user = relationship("User", back_populates="chats")
 
+    __table_args__ = (
+        # 主キーは chat_id が先頭のため、ユーザーからチャットを引く用
+        Index("ix_chat_participants_user_id_chat_id", "user_id", "chat_id"),
+    )
+
     @classmethod
     async def read_all(
         cls, session: AsyncSession, chat_id: int, offset: int, limit: int, desc: bool
@@ -39,6 +57,67 @@ class ChatParticipants(TimestampedEntity):
         async for row in stream:
             yield row
 
+    @classmethod
+    async def create_all_by_names(
+        cls, session: AsyncSession, chat_id: int, usernames: list[str]
+    ) -> tuple[list[int], list[str]]:
+        """
+        ユーザー名に一致するユーザーを1つのSQL文でまとめて参加者にする
+
+        追加したユーザーのIDと、どのユーザーにも一致しなかったユーザー名を返却する。
+        既に参加しているユーザーは追加しない。
+        """
+        matched = (
+            select(User.id, User.username)
+            .where(User.username == any_(cast(usernames, ARRAY(String))))
+            .cte("matched")
+        )
+        inserted = (
+            insert(cls)
+            .from_select(["chat_id", "user_id"], select(literal(chat_id), matched.c.id))
+            .on_conflict_do_nothing()
+            .returning(cls.user_id)
+            .cte("inserted")
+        )
+        stmt = (
+            select(matched.c.username, inserted.c.user_id)
+            .outerjoin(inserted, inserted.c.user_id == matched.c.id)
+            .add_cte(inserted)
+        )
+        rows = (await session.execute(stmt)).all()
+        added = sorted(user_id for _, user_id in rows if user_id is not None)
+        unresolved = sorted(set(usernames) - {username for username, _ in rows})
+        return added, unresolved
+
+    @classmethod
+    async def delete_all(
+        cls, session: AsyncSession, chat_id: int, user_ids: list[int]
+    ) -> list[int]:
+        """参加者から外し、外したユーザーのIDを返却する"""
+        stmt = (
+            delete(cls)
+            .where(cls.chat_id == chat_id, cls.user_id.in_(user_ids))
+            .returning(cls.user_id)
+        )
+        result = await session.execute(stmt)
+        return list(result.scalars())
+
+    @classmethod
+    async def delete_batch_by_chat_id(
+        cls, session: AsyncSession, chat_id: int, batch_size: int
+    ) -> int:
+        """チャットの参加者を最大batch_size件削除し、削除した件数を返却する"""
+        user_ids = (
+            select(cls.user_id)
+            .where(cls.chat_id == chat_id)
+            .limit(batch_size)
+            .scalar_subquery()
+        )
+        result = await session.execute(
+            delete(cls).where(cls.chat_id == chat_id, cls.user_id.in_(user_ids))
+        )
+        return result.rowcount  # type: ignore
+
     @classmethod
     async def read_all_active_notification_users(
         cls, session: AsyncSession, chat_id: int
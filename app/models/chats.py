@@ -1,10 +1,28 @@
 from __future__ import annotations
 
+from datetime import datetime
 from typing import AsyncIterator
 
-from sqlalchemy import Column, ForeignKey, Index, Integer, String, or_, select
+from sqlalchemy import (
+    Column,
+    ColumnElement,
+    DateTime,
+    ForeignKey,
+    Index,
+    Integer,
+    RowMapping,
+    String,
+    case,
+    delete,
+    func,
+    select,
+    text,
+    true,
+    union,
+    update,
+)
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy.orm import Mapped, relationship
+from sqlalchemy.orm import InstrumentedAttribute, Mapped, relationship
 
 from app.commons.types import ChatType
 
@@ -20,59 +38,192 @@ class Chat(TimestampedEntity):
     created_by: Mapped[int] = Column(ForeignKey("users.id"), nullable=False)  # type: ignore
     chat_type: Mapped[ChatType] = Column(Integer, nullable=False)  # type: ignore
     name: Mapped[str] = Column(String(length=255), nullable=False)  # type: ignore
+    # 論理削除した日時。メッセージと参加者はバックグラウンドで削除する
+    deleted_at: Mapped[datetime | None] = Column(DateTime(timezone=True), nullable=True)  # type: ignore
 
-    messages = relationship("Message", back_populates="chat", cascade="all, delete")
+    # 子の行をORMで読み込んで1件ずつ削除しない
+    messages = relationship(
+        "Message", back_populates="chat", cascade="all, delete", passive_deletes=True
+    )
     participants = relationship(
-        "ChatParticipants", back_populates="chat", cascade="all, delete"
+        "ChatParticipants",
+        back_populates="chat",
+        cascade="all, delete",
+        passive_deletes=True,
     )
     creator = relationship("User", back_populates="created_chats")
 
     __table_args__ = (
         Index("ix_chats_created_at", "created_at"),
-        Index("ix_chats_created_by", "created_by"),
+        Index("ix_chats_created_by_id", "created_by", "id"),
         Index("ix_chats_name", "name"),
         Index("ix_chats_updated_at", "updated_at"),
+        Index(
+            "ix_chats_deleted_at",
+            "deleted_at",
+            postgresql_where=text("deleted_at IS NOT NULL"),
+        ),
     )
 
     @classmethod
     async def read_all(
-        cls, session: AsyncSession, user_id: int, offset: int, limit: int, desc: bool
+        cls,
+        session: AsyncSession,
+        user_id: int,
+        offset: int,
+        limit: int,
+        desc: bool,
+        after_id: int | None = None,
     ) -> AsyncIterator[Chat]:
-        # CTE (Common Table Expression) を定義
-        user_chats_cte = (
-            select(ChatParticipants.chat_id)
-            .where(ChatParticipants.user_id == user_id)
-            .cte("user_chats")
-        )
+        # 参加者と作成者をORでつなぐと chats の全件走査になるため、それぞれを
+        # インデックスで取得してUNIONする。各枝はページの末尾までに絞り込む
+        window = offset + limit
 
-        # メインクエリでCTEを使用
-        stmt = (
-            select(cls)
+        # after_idを指定した場合は、並び順でそれより後のチャットに限る
+        def follows(column: InstrumentedAttribute[int]) -> ColumnElement[bool]:
+            if after_id is None:
+                return true()
+            return column < after_id if desc else column > after_id
+
+        participant_ids = (
+            select(ChatParticipants.chat_id.label("id"))
+            .join(cls, cls.id == ChatParticipants.chat_id)
             .where(
-                or_(
-                    cls.id.in_(select(user_chats_cte.c.chat_id)),
-                    cls.created_by == user_id,
-                )
+                ChatParticipants.user_id == user_id,
+                cls.deleted_at.is_(None),
+                follows(ChatParticipants.chat_id),
+            )
+            .order_by(
+                ChatParticipants.chat_id.desc() if desc else ChatParticipants.chat_id
+            )
+            .limit(window)
+        )
+        created_ids = (
+            select(cls.id)
+            .where(
+                cls.created_by == user_id,
+                cls.deleted_at.is_(None),
+                follows(cls.id),
             )
             .order_by(cls.id.desc() if desc else cls.id)
+            .limit(window)
+        )
+        user_chats = union(participant_ids, created_ids).subquery("user_chats")
+
+        # ページ分のIDに絞ってから主キーでチャットを取得する
+        page = (
+            select(user_chats.c.id)
+            .order_by(user_chats.c.id.desc() if desc else user_chats.c.id)
             .offset(offset)
             .limit(limit)
+            .subquery("page")
+        )
+        stmt = (
+            select(cls)
+            .join(page, cls.id == page.c.id)
+            .order_by(cls.id.desc() if desc else cls.id)
         )
         stream = await session.stream_scalars(stmt)
 
         async for row in stream:
             yield row
 
+    @classmethod
+    async def read_ids_by_user_id(
+        cls, session: AsyncSession, user_id: int
+    ) -> list[int]:
+        # 作成者または参加者として関係するチャットのID一覧
+        stmt = (
+            select(ChatParticipants.chat_id)
+            .join(cls, cls.id == ChatParticipants.chat_id)
+            .where(ChatParticipants.user_id == user_id, cls.deleted_at.is_(None))
+            .union(
+                select(cls.id).where(
+                    cls.created_by == user_id, cls.deleted_at.is_(None)
+                )
+            )
+        )
+        result = await session.execute(stmt)
+        return list(result.scalars())
+
+    @classmethod
+    async def read_members(
+        cls, session: AsyncSession, chat_id: int
+    ) -> tuple[int, list[int]] | None:
+        """チャットの作成者と参加者のID一覧。チャットがなければNone"""
+        stmt = (
+            select(
+                cls.created_by,
+                func.array_remove(func.array_agg(ChatParticipants.user_id), None),
+            )
+            .outerjoin(ChatParticipants, ChatParticipants.chat_id == cls.id)
+            .where(cls.id == chat_id, cls.deleted_at.is_(None))
+            .group_by(cls.id)
+        )
+        row = (await session.execute(stmt)).first()
+        if row is None:
+            return None
+        created_by, participant_ids = row
+        return created_by, list(participant_ids)
+
+    @classmethod
+    async def read_participants(
+        cls, session: AsyncSession, chat_id: int, after_user_id: int, limit: int
+    ) -> AsyncIterator[RowMapping]:
+        """
+        作成者を含む参加者をユーザーIDの昇順で after_user_id より後から limit 件取得する
+
+        名前を公開していないユーザーの氏名はSQLで ANONYMOUS に置き換える。
+        """
+        participant_ids = (
+            select(ChatParticipants.user_id)
+            .where(
+                ChatParticipants.chat_id == chat_id,
+                ChatParticipants.user_id > after_user_id,
+            )
+            .order_by(ChatParticipants.user_id)
+            .limit(limit)
+        )
+        creator_id = select(cls.created_by).where(
+            cls.id == chat_id, cls.created_by > after_user_id
+        )
+        member_ids = union(participant_ids, creator_id).subquery("member_ids")
+
+        stmt = (
+            select(
+                User.id,
+                User.created_at,
+                User.updated_at,
+                case((User.is_name_visible, User.first_name), else_="ANONYMOUS").label(
+                    "first_name"
+                ),
+                case((User.is_name_visible, User.last_name), else_="ANONYMOUS").label(
+                    "last_name"
+                ),
+                User.username,
+                User.is_name_visible,
+            )
+            .join(member_ids, member_ids.c.user_id == User.id)
+            .order_by(User.id)
+            .limit(limit)
+        )
+        stream = await session.stream(stmt)
+
+        async for row in stream.mappings():
+            yield row
+
     @classmethod
     async def read_by_id(cls, session: AsyncSession, chat_id: int) -> Chat | None:
-        stmt = select(cls).where(cls.id == chat_id)
+        stmt = select(cls).where(cls.id == chat_id, cls.deleted_at.is_(None))
         return await session.scalar(stmt.order_by(cls.id))
 
     @classmethod
     async def read_by_id_and_user_id(
         cls, session: AsyncSession, chat_id: int, user_id: int
     ) -> Chat | None:
-        stmt = select(cls).where(cls.id == chat_id, cls.created_by == user_id)
+        stmt = select(cls).where(
+            cls.id == chat_id, cls.created_by == user_id, cls.deleted_at.is_(None)
+        )
         return await session.scalar(stmt.order_by(cls.id))
 
     @classmethod
@@ -95,9 +246,42 @@ class Chat(TimestampedEntity):
             setattr(self, key, value)
         await session.flush()
 
+    @classmethod
+    async def promote_to_group(cls, session: AsyncSession, chat_id: int) -> bool:
+        """参加者を追加したダイレクトチャットをグループチャットに変更する"""
+        result = await session.execute(
+            update(cls)
+            .where(cls.id == chat_id, cls.chat_type == ChatType.DIRECT)
+            .values(chat_type=ChatType.GROUP, updated_at=func.now())
+        )
+        return result.rowcount > 0  # type: ignore
+
     @classmethod
     async def delete(cls, session: AsyncSession, chat_id: int, user_id: int) -> None:
-        session_instance = await cls.read_by_id_and_user_id(session, chat_id, user_id)
-        if session_instance:
-            await session.delete(session_instance)
-            await session.flush()
+        # 論理削除のみ行い、メッセージと参加者は ChatPurge が分割して削除する
+        await session.execute(
+            update(cls)
+            .where(
+                cls.id == chat_id, cls.created_by == user_id, cls.deleted_at.is_(None)
+            )
+            .values(deleted_at=func.now(), updated_at=func.now())
+        )
+
+    @classmethod
+    async def read_deleted_id_for_update(cls, session: AsyncSession) -> int | None:
+        """削除待ちのチャットを古い順に1件ロックする。他のプロセスが処理中なら飛ばす"""
+        stmt = (
+            select(cls.id)
+            .where(cls.deleted_at.is_not(None))
+            .order_by(cls.deleted_at)
+            .limit(1)
+            .with_for_update(skip_locked=True)
+        )
+        return await session.scalar(stmt)
+
+    @classmethod
+    async def purge(cls, session: AsyncSession, chat_id: int) -> None:
+        """メッセージと参加者を削除し終えた論理削除済みのチャットを削除する"""
+        await session.execute(
+            delete(cls).where(cls.id == chat_id, cls.deleted_at.is_not(None))
+        )
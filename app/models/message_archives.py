@@ -0,0 +1,106 @@
+from __future__ import annotations
+
+from typing import AsyncIterator
+
+from sqlalchemy import Column, DateTime, Integer, String, func, select, update
+from sqlalchemy.dialects.postgresql import ARRAY
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Mapped
+
+from .base import TimestampedEntity
+
+
+class MessageArchive(TimestampedEntity):
+    """
+    切り離してストレージに退避したmessagesのパーティション
+
+    切り離した時点で作成し、storage_key以下にチャットごとのアーカイブをアップロード
+    してパーティションを削除した時点でarchived_atを記録する。
+    """
+
+    __tablename__ = "message_archives"
+
+    id: Mapped[int] = Column(Integer, primary_key=True, autoincrement=True)  # type: ignore
+    partition_name: Mapped[str] = Column(String(length=63), nullable=False, unique=True)  # type: ignore
+    range_start = Column(DateTime, nullable=False)
+    range_end = Column(DateTime, nullable=False)
+    storage_key: Mapped[str] = Column(String(length=255), nullable=False)  # type: ignore
+    row_count: Mapped[int] = Column(Integer, nullable=False)  # type: ignore
+    # アーカイブを開かずに対象チャットの有無を判定するために保持する
+    chat_ids: Mapped[list[int]] = Column(ARRAY(Integer), server_default="{}")  # type: ignore
+    archived_at = Column(DateTime, nullable=True)
+
+    @property
+    def per_chat(self) -> bool:
+        # 以前は月ごとに1つのアーカイブにまとめていた
+        return not self.storage_key.endswith(".ndjson.gz")
+
+    def chat_storage_key(self, chat_id: int) -> str:
+        if not self.per_chat:
+            return self.storage_key
+        return f"{self.storage_key}{chat_id}.ndjson.gz"
+
+    @classmethod
+    async def read_by_partition_name(
+        cls, session: AsyncSession, partition_name: str
+    ) -> MessageArchive | None:
+        stmt = select(cls).where(cls.partition_name == partition_name)
+        return (await session.execute(stmt)).scalar_one_or_none()
+
+    @classmethod
+    async def read_pending_names(cls, session: AsyncSession) -> list[str]:
+        # 切り離した後、退避を完了する前に中断したパーティション
+        stmt = (
+            select(cls.partition_name)
+            .where(cls.archived_at.is_(None))
+            .order_by(cls.range_start)
+        )
+        return list((await session.execute(stmt)).scalars())
+
+    @classmethod
+    async def read_all_by_chat_id(
+        cls, session: AsyncSession, chat_id: int
+    ) -> AsyncIterator[MessageArchive]:
+        stmt = (
+            select(cls)
+            .where(
+                cls.chat_ids.any(chat_id),  # type: ignore
+                cls.archived_at.is_not(None),
+            )
+            .order_by(cls.range_start.desc())
+        )
+        stream = await session.stream_scalars(stmt)
+        async for row in stream:
+            yield row
+
+    @classmethod
+    async def remove_chat_id(cls, session: AsyncSession, chat_id: int) -> None:
+        stmt = (
+            update(cls)
+            .where(cls.chat_ids.any(chat_id))  # type: ignore
+            .values(chat_ids=func.array_remove(cls.chat_ids, chat_id))
+        )
+        await session.execute(stmt)
+
+    @classmethod
+    async def create(cls, session: AsyncSession, **kwargs) -> MessageArchive:
+        archive = cls(**kwargs)
+        session.add(archive)
+        await session.flush()
+        return archive
+
+    @classmethod
+    async def complete(
+        cls,
+        session: AsyncSession,
+        partition_name: str,
+        row_count: int,
+        chat_ids: list[int],
+    ) -> bool:
+        stmt = (
+            update(cls)
+            .where(cls.partition_name == partition_name, cls.archived_at.is_(None))
+            .values(row_count=row_count, chat_ids=chat_ids, archived_at=func.now())
+        )
+        result = await session.execute(stmt)
+        return result.rowcount > 0  # type: ignore
@@ -0,0 +1,49 @@
+from __future__ import annotations
+
+from sqlalchemy import BigInteger, Column, Integer, delete, insert, select
+from sqlalchemy.dialects.postgresql import ARRAY
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Mapped
+
+from .base import TimestampedEntity
+
+
+class MessageOutbox(TimestampedEntity):
+    """
+    WebSocketへの配信待ちのメッセージ
+
+    メッセージと同じトランザクションで書き込み、リレーがRedisへ配信した後に削除する。
+    """
+
+    __tablename__ = "message_outbox"
+
+    id: Mapped[int] = Column(BigInteger, primary_key=True, autoincrement=True)  # type: ignore
+    chat_id: Mapped[int] = Column(Integer, nullable=False)  # type: ignore
+    # 一括投稿は1件のイベントとしてまとめて配信する
+    message_ids: Mapped[list[int]] = Column(ARRAY(BigInteger), nullable=False)  # type: ignore
+
+    @classmethod
+    async def read_all_for_update(
+        cls, session: AsyncSession, limit: int
+    ) -> list[MessageOutbox]:
+        # 他のリレーが処理中の行は飛ばす
+        stmt = (
+            select(cls).order_by(cls.id).limit(limit).with_for_update(skip_locked=True)
+        )
+        return list((await session.scalars(stmt)).all())
+
+    @classmethod
+    async def create(
+        cls, session: AsyncSession, chat_id: int, message_ids: list[int]
+    ) -> None:
+        await session.execute(
+            insert(cls).values(chat_id=chat_id, message_ids=message_ids)
+        )
+
+    @classmethod
+    async def delete_by_ids(cls, session: AsyncSession, outbox_ids: list[int]) -> None:
+        await session.execute(delete(cls).where(cls.id.in_(outbox_ids)))
+
+    @classmethod
+    async def delete_by_chat_id(cls, session: AsyncSession, chat_id: int) -> None:
+        await session.execute(delete(cls).where(cls.chat_id == chat_id))
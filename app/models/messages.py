@@ -2,22 +2,61 @@ from __future__ import annotations
 
 from typing import AsyncIterator
 
-from sqlalchemy import Column, ForeignKey, Index, Integer, String, select, update
-from sqlalchemy.dialects.postgresql import ARRAY
+from sqlalchemy import (
+    DDL,
+    BigInteger,
+    Column,
+    DateTime,
+    ForeignKey,
+    Index,
+    Integer,
+    String,
+    delete,
+    event,
+    exists,
+    func,
+    insert,
+    literal,
+    or_,
+    select,
+    true,
+    tuple_,
+    update,
+)
+from sqlalchemy.dialects.postgresql import ARRAY, array
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy.orm import Mapped, relationship
+from sqlalchemy.orm import Mapped, aliased, relationship
+from sqlalchemy.sql.elements import ColumnElement
+
+from app.commons.snowflake import generate_id, snowflake
+from app.commons.types import ChatEventType
 
 from .base import TimestampedEntity
+from .chat_events import ChatEvent
+from .chat_participants import ChatParticipants
+from .chats import Chat
+from .message_outbox import MessageOutbox
+from .retention_policies import RetentionPolicy
+from .users import User
 
 
 class Message(TimestampedEntity):
     __tablename__ = "messages"
 
-    id: Mapped[int] = Column(Integer, primary_key=True, index=True, autoincrement=True)  # type: ignore
+    # シーケンスを使わずアプリケーションで時刻順のIDを採番する
+    id: Mapped[int] = Column(  # type: ignore
+        BigInteger,
+        primary_key=True,
+        index=True,
+        autoincrement=False,
+        default=generate_id,
+    )
     chat_id: Mapped[int] = Column(ForeignKey("chats.id"), nullable=False)  # type: ignore
     sender_id: Mapped[int] = Column(ForeignKey("users.id"), nullable=False)  # type: ignore
     content: Mapped[str] = Column(String(length=1024), nullable=False)  # type: ignore
     read_by_list: Mapped[list[int]] = Column(ARRAY(Integer), server_default="{}")  # type: ignore
+    # パーティションキーは主キーに含める必要がある
+    created_at = Column(DateTime, primary_key=True, nullable=False, default=func.now())
 
     chat = relationship("Chat", back_populates="messages")
     sender = relationship("User", back_populates="sent_messages")
@@ -26,20 +65,49 @@ class Message(TimestampedEntity):
         Index("ix_messages_sender_id", "sender_id"),
         Index("ix_messages_content", "content"),
         Index("ix_messages_created_at", "created_at"),
+        Index("ix_messages_chat_id_id", "chat_id", "id"),
+        # created_atで月ごとにパーティション分割する
+        {"postgresql_partition_by": "RANGE (created_at)"},
     )
 
     @classmethod
     async def read_all(
-        cls, session: AsyncSession, chat_id: int, offset: int, limit: int
+        cls,
+        session: AsyncSession,
+        chat_id: int,
+        offset: int,
+        limit: int,
+        before_id: int | None = None,
     ) -> AsyncIterator[Message]:
+        stmt = select(cls).where(cls.chat_id == chat_id)
+        if before_id is not None:
+            stmt = stmt.where(cls.id < before_id)
+        stmt = stmt.order_by(cls.id.desc()).offset(offset).limit(limit)
+        stream = await session.stream_scalars(stmt.order_by(cls.id))
+        async for row in stream:
+            yield row
+
+    @classmethod
+    async def read_all_for_export(
+        cls, session: AsyncSession, chat_id: int, batch_size: int
+    ) -> AsyncIterator[Message]:
+        # サーバーサイドカーソルでbatch_size件ずつ取得する
         stmt = (
             select(cls)
             .where(cls.chat_id == chat_id)
-            .order_by(cls.id.desc())
-            .offset(offset)
-            .limit(limit)
+            .order_by(cls.id)
+            .execution_options(yield_per=batch_size)
         )
-        stream = await session.stream_scalars(stmt.order_by(cls.id))
+        stream = await session.stream_scalars(stmt)
+        async for row in stream:
+            yield row
+
+    @classmethod
+    async def read_all_by_ids(
+        cls, session: AsyncSession, message_ids: list[int]
+    ) -> AsyncIterator[Message]:
+        stmt = select(cls).where(cls.id.in_(message_ids)).order_by(cls.id)
+        stream = await session.stream_scalars(stmt)
         async for row in stream:
             yield row
 
@@ -60,8 +128,130 @@ class Message(TimestampedEntity):
         message = cls(**kwargs)
         session.add(message)
         await session.flush()
+        await ChatEvent.create(
+            session,
+            message.chat_id,
+            ChatEventType.MESSAGE_CREATED,
+            message_ids=[message.id],
+        )
+        await MessageOutbox.create(session, message.chat_id, [message.id])
         return message
 
+    @classmethod
+    async def create_authorized(
+        cls, session: AsyncSession, chat_id: int, sender_id: int, content: str
+    ) -> tuple[Message, str] | None:
+        """
+        送信者がチャットの作成者か参加者の場合のみメッセージを作成し、
+        作成したメッセージと送信者のusernameを返す。権限がなければNone
+
+        権限の確認、INSERT、差分同期のイベントと配信待ちの記録を1つの文で行う。
+        """
+        # 論理削除済みのチャットには送信できない
+        is_member = exists().where(
+            Chat.id == chat_id,
+            Chat.deleted_at.is_(None),
+            or_(
+                Chat.created_by == sender_id,
+                exists().where(
+                    ChatParticipants.chat_id == chat_id,
+                    ChatParticipants.user_id == sender_id,
+                ),
+            ),
+        )
+        authorized = (
+            select(User.username)
+            .where(User.id == sender_id, is_member)
+            .cte("authorized")
+        )
+        inserted = (
+            insert(cls)
+            .from_select(
+                ["id", "chat_id", "sender_id", "content", "created_at", "updated_at"],
+                select(
+                    literal(generate_id(), BigInteger),
+                    literal(chat_id),
+                    literal(sender_id),
+                    literal(content, String),
+                    func.now(),
+                    func.now(),
+                ).select_from(authorized),
+            )
+            .returning(*cls.__table__.c)
+            .cte("inserted")
+        )
+        created_event = (
+            insert(ChatEvent)
+            .from_select(
+                ["chat_id", "event_type", "message_ids", "created_at", "updated_at"],
+                select(
+                    inserted.c.chat_id,
+                    literal(ChatEventType.MESSAGE_CREATED, Integer),
+                    array([inserted.c.id]),
+                    func.now(),
+                    func.now(),
+                ),
+            )
+            .cte("created_event")
+        )
+        # 同じ文でWebSocketへの配信待ちに積む
+        queued = (
+            insert(MessageOutbox)
+            .from_select(
+                ["chat_id", "message_ids", "created_at", "updated_at"],
+                select(
+                    inserted.c.chat_id,
+                    array([inserted.c.id]),
+                    func.now(),
+                    func.now(),
+                ),
+            )
+            .cte("queued")
+        )
+        message = aliased(cls, inserted)
+        stmt = (
+            select(message, authorized.c.username)
+            .select_from(inserted)
+            .join(authorized, true())
+            .add_cte(created_event, queued)
+        )
+        row = (await session.execute(stmt)).first()
+        if row is None:
+            return None
+        return row[0], row[1]
+
+    @classmethod
+    async def create_all(
+        cls, session: AsyncSession, chat_id: int, sender_id: int, contents: list[str]
+    ) -> list[Message]:
+        """1回のINSERTで複数のメッセージを作成する"""
+        # 作成順に並ぶよう先にIDを採番してから複数行のVALUESで挿入する
+        message_ids = snowflake.generate_many(len(contents))
+        stmt = (
+            insert(cls)
+            .values(
+                [
+                    {
+                        "id": message_id,
+                        "chat_id": chat_id,
+                        "sender_id": sender_id,
+                        "content": content,
+                    }
+                    for message_id, content in zip(message_ids, contents)
+                ]
+            )
+            .returning(cls)
+        )
+        messages = sorted((await session.scalars(stmt)).all(), key=lambda m: m.id)
+        await ChatEvent.create(
+            session,
+            chat_id,
+            ChatEventType.MESSAGE_CREATED,
+            message_ids=message_ids,
+        )
+        await MessageOutbox.create(session, chat_id, message_ids)
+        return messages
+
     async def update(self, session: AsyncSession, **kwargs) -> None:
         for key, value in kwargs.items():
             setattr(self, key, value)
@@ -76,14 +266,117 @@ class Message(TimestampedEntity):
             .where(cls.id.in_(message_ids))
             .values({cls.read_by_list: cls.read_by_list.op("||")(user_id)})
             .where(~cls.read_by_list.any(user_id))  # type: ignore
-            .returning(cls.id)
+            .returning(cls.id, cls.chat_id)
         )
-        await session.execute(stmt)
+        result = await session.execute(stmt)
+
+        # 既読になったメッセージをチャットごとにまとめてイベントを記録する
+        read_ids: dict[int, list[int]] = {}
+        for message_id, chat_id in result:
+            read_ids.setdefault(chat_id, []).append(message_id)
+        for chat_id, ids in read_ids.items():
+            await ChatEvent.create(
+                session,
+                chat_id,
+                ChatEventType.MESSAGES_READ,
+                user_id=user_id,
+                message_ids=sorted(ids),
+            )
         await session.flush()
 
     @classmethod
     async def delete(cls, session: AsyncSession, message_id: int, user_id: int) -> None:
         message = await cls.read_by_id_and_user_id(session, message_id, user_id)
         if message:
+            chat_id, message_id = message.chat_id, message.id
             await session.delete(message)
+            await ChatEvent.create(
+                session,
+                chat_id,
+                ChatEventType.MESSAGE_DELETED,
+                message_ids=[message_id],
+            )
             await session.flush()
+
+    @classmethod
+    def _expired(cls, min_retention_days: int) -> list[ColumnElement[bool]]:
+        # 最短の保持期間による絞り込みでcreated_atのインデックスとパーティションを使う
+        retention_days = RetentionPolicy.retention_days_for_chat()
+        return [
+            cls.chat_id == Chat.id,
+            cls.created_at
+            < func.now() - func.make_interval(0, 0, 0, min_retention_days),
+            cls.created_at < func.now() - func.make_interval(0, 0, 0, retention_days),
+        ]
+
+    @classmethod
+    async def read_retention_range(
+        cls, session: AsyncSession, min_retention_days: int
+    ) -> tuple[int | None, int | None]:
+        """保持期間を過ぎたメッセージのIDの範囲"""
+        stmt = select(func.min(cls.id), func.max(cls.id)).where(
+            *cls._expired(min_retention_days)
+        )
+        lower, upper = (await session.execute(stmt)).one()
+        return lower, upper
+
+    @classmethod
+    async def read_batch_end_id(
+        cls, session: AsyncSession, start_id: int, upper_bound: int, batch_size: int
+    ) -> int:
+        """start_idからbatch_size件目の次のID (なければupper_bound + 1)"""
+        # IDは連番ではないため、幅ではなく件数でバッチの範囲を決める
+        stmt = (
+            select(cls.id)
+            .where(cls.id >= start_id, cls.id <= upper_bound)
+            .order_by(cls.id)
+            .offset(batch_size)
+            .limit(1)
+        )
+        end_id = await session.scalar(stmt)
+        return upper_bound + 1 if end_id is None else end_id
+
+    @classmethod
+    async def delete_expired(
+        cls, session: AsyncSession, start_id: int, end_id: int, min_retention_days: int
+    ) -> list[tuple[int, int]]:
+        """IDの範囲内で保持期間を過ぎたメッセージを削除し、(id, chat_id)を返す"""
+        stmt = (
+            delete(cls)
+            .where(
+                cls.id >= start_id, cls.id < end_id, *cls._expired(min_retention_days)
+            )
+            .returning(cls.id, cls.chat_id)
+            .execution_options(synchronize_session=False)
+        )
+        result = await session.execute(stmt)
+        return [(message_id, chat_id) for message_id, chat_id in result]
+
+    @classmethod
+    async def delete_batch_by_chat_id(
+        cls, session: AsyncSession, chat_id: int, batch_size: int
+    ) -> int:
+        """チャットのメッセージを最大batch_size件削除し、削除した件数を返却する"""
+        keys = (
+            select(cls.id, cls.created_at)
+            .where(cls.chat_id == chat_id)
+            .limit(batch_size)
+            .subquery()
+        )
+        stmt = (
+            delete(cls)
+            .where(
+                tuple_(cls.id, cls.created_at).in_(select(keys.c.id, keys.c.created_at))
+            )
+            .execution_options(synchronize_session=False)
+        )
+        result = await session.execute(stmt)
+        return result.rowcount  # type: ignore
+
+
+# create_allで作成した場合もパーティション作成前に書き込めるようにする
+event.listen(
+    Message.__table__,
+    "after_create",
+    DDL("CREATE TABLE IF NOT EXISTS messages_default PARTITION OF messages DEFAULT"),
+)
@@ -0,0 +1,70 @@
+from __future__ import annotations
+
+from sqlalchemy import (
+    Column,
+    ForeignKey,
+    Index,
+    Integer,
+    func,
+    select,
+)
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Mapped
+from sqlalchemy.sql.elements import ColumnElement
+
+from app.commons.types import ChatType
+
+from .base import TimestampedEntity
+from .chats import Chat
+
+
+class RetentionPolicy(TimestampedEntity):
+    """
+    メッセージの保持期間
+
+    chat_idを指定したものがチャット単位、chat_typeのみ指定したものがチャット種別単位、
+    どちらも指定しないものが全体の設定となり、この順に優先される。
+    """
+
+    __tablename__ = "retention_policies"
+
+    id: Mapped[int] = Column(Integer, primary_key=True, autoincrement=True)  # type: ignore
+    chat_id: Mapped[int | None] = Column(
+        ForeignKey("chats.id", ondelete="CASCADE"), nullable=True
+    )  # type: ignore
+    chat_type: Mapped[ChatType | None] = Column(Integer, nullable=True)  # type: ignore
+    retention_days: Mapped[int] = Column(Integer, nullable=False)  # type: ignore
+
+    __table_args__ = (
+        Index("ix_retention_policies_chat_id", "chat_id", unique=True),
+        Index(
+            "ix_retention_policies_chat_type",
+            "chat_type",
+            unique=True,
+            postgresql_where=chat_id.is_(None),
+        ),
+    )
+
+    @classmethod
+    def retention_days_for_chat(cls) -> ColumnElement:
+        # チャット単位 > チャット種別単位 > 全体 の順に適用する
+        return func.coalesce(
+            select(cls.retention_days).where(cls.chat_id == Chat.id).scalar_subquery(),
+            select(cls.retention_days)
+            .where(cls.chat_id.is_(None), cls.chat_type == Chat.chat_type)
+            .scalar_subquery(),
+            select(cls.retention_days)
+            .where(cls.chat_id.is_(None), cls.chat_type.is_(None))
+            .scalar_subquery(),
+        )
+
+    @classmethod
+    async def read_min_retention_days(cls, session: AsyncSession) -> int | None:
+        return await session.scalar(select(func.min(cls.retention_days)))
+
+    @classmethod
+    async def create(cls, session: AsyncSession, **kwargs) -> RetentionPolicy:
+        policy = cls(**kwargs)
+        session.add(policy)
+        await session.flush()
+        return policy
@@ -0,0 +1,45 @@
+from __future__ import annotations
+
+from datetime import datetime
+
+from sqlalchemy import BigInteger, Column, DateTime, Integer, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Mapped
+
+from .base import TimestampedEntity
+
+
+class RetentionRun(TimestampedEntity):
+    """保持期間による削除の進捗。中断しても cursor から再開する"""
+
+    __tablename__ = "retention_runs"
+
+    id: Mapped[int] = Column(Integer, primary_key=True, autoincrement=True)  # type: ignore
+    cursor: Mapped[int] = Column(BigInteger, nullable=False)  # type: ignore
+    upper_bound: Mapped[int] = Column(BigInteger, nullable=False)  # type: ignore
+    deleted_count: Mapped[int] = Column(BigInteger, nullable=False, default=0)  # type: ignore
+    finished_at: Mapped[datetime | None] = Column(DateTime, nullable=True)  # type: ignore
+
+    @classmethod
+    async def read_active_for_update(cls, session: AsyncSession) -> RetentionRun | None:
+        # 他のプロセスが処理中の場合は取得しない
+        stmt = (
+            select(cls)
+            .where(cls.finished_at.is_(None))
+            .order_by(cls.id)
+            .limit(1)
+            .with_for_update(skip_locked=True)
+        )
+        return await session.scalar(stmt)
+
+    @classmethod
+    async def has_active(cls, session: AsyncSession) -> bool:
+        stmt = select(cls.id).where(cls.finished_at.is_(None)).limit(1)
+        return await session.scalar(stmt) is not None
+
+    @classmethod
+    async def create(cls, session: AsyncSession, **kwargs) -> RetentionRun:
+        run = cls(**kwargs)
+        session.add(run)
+        await session.flush()
+        return run
@@ -54,6 +54,11 @@ class UserSchema(BaseModel):
     notification_type: str = Field(
         "DISABLED", description="The type of notification settings for the user."
     )
+    notification_digest_delay: int | None = Field(
+        None,
+        description="Seconds to wait while the user is away before sending "
+        "the notifications of a chat as one digest.",
+    )
 
     model_config = ConfigDict(from_attributes=True)
 
@@ -150,3 +155,10 @@ class MessageSchema(BaseModel):
     )
 
     model_config = ConfigDict(from_attributes=True)
+
+
+class ArchivedMessageSchema(MessageSchema):
+    chat_id: int = Field(..., description="The ID of the chat.")
+    updated_at: datetime | None = Field(
+        None, description="The time when the message was last updated."
+    )
@@ -1,18 +1,30 @@
 from __future__ import annotations
 
-import os
 from typing import AsyncIterator
 
-from sqlalchemy import Column, DateTime, ForeignKey, Integer, delete, func, select
+from sqlalchemy import (
+    Column,
+    DateTime,
+    ForeignKey,
+    Integer,
+    String,
+    delete,
+    func,
+    select,
+    update,
+)
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy.orm import Mapped, relationship
+from sqlalchemy.orm import Mapped, relationship, validates
 
-from app.commons.type_decorators import PGPString
+from app.commons.crypto import blind_index
+from app.commons.type_decorators import EncryptedString
 from app.commons.types import PlatformType
+from app.settings import settings
 
 from .base import TimestampedEntity
 
-secret = os.environ["SECRET"]
+# refresh_tokenの検索に使うHMACの用途
+REFRESH_TOKEN_INDEX = "sessions.refresh_token"
 
 
 class Session(TimestampedEntity):
@@ -20,15 +32,29 @@ class Session(TimestampedEntity):
 
     id: Mapped[int] = Column(Integer, primary_key=True, index=True, autoincrement=True)  # type: ignore
     user_id: Mapped[int] = Column(ForeignKey("users.id"), nullable=False)  # type: ignore
-    device_token: Mapped[PGPString] = Column(PGPString, nullable=True)  # type: ignore
+    # SESSION_ENCRYPTION_MODEでpgcryptoかアプリケーションのAES-GCMで暗号化する
+    device_token: Mapped[EncryptedString] = Column(
+        EncryptedString("sessions.device_token", settings.SESSION_ENCRYPTION_MODE),
+        nullable=True,
+    )  # type: ignore
     platform_type: Mapped[PlatformType] = Column(Integer, nullable=True)  # type: ignore
-    refresh_token: Mapped[PGPString] = Column(PGPString, nullable=False)  # type: ignore
+    refresh_token: Mapped[EncryptedString] = Column(
+        EncryptedString("sessions.refresh_token", settings.SESSION_ENCRYPTION_MODE),
+        nullable=False,
+    )  # type: ignore
+    # 暗号文では検索できないため、refresh_tokenのHMACで検索する
+    refresh_token_hash: Mapped[str] = Column(String(64), nullable=True, index=True)  # type: ignore
     refresh_token_expired_at: Mapped[DateTime] = Column(
         DateTime(timezone=True), nullable=False
     )  # type: ignore
 
     user = relationship("User", back_populates="sessions")
 
+    @validates("refresh_token")
+    def validate_refresh_token(self, key: str, refresh_token: str) -> str:
+        self.refresh_token_hash = blind_index(refresh_token, REFRESH_TOKEN_INDEX)
+        return refresh_token
+
     @classmethod
     async def read_all(cls, session: AsyncSession) -> AsyncIterator[Session]:
         stmt = select(cls)
@@ -55,7 +81,7 @@ class Session(TimestampedEntity):
     ) -> Session | None:
         stmt = select(cls).where(
             cls.user_id == user_id,
-            func.pgp_sym_decrypt(cls.refresh_token, secret) == refresh_token,
+            cls.refresh_token_hash == blind_index(refresh_token, REFRESH_TOKEN_INDEX),
         )
         return await session.scalar(stmt.order_by(cls.id))
 
@@ -69,7 +95,7 @@ class Session(TimestampedEntity):
         cls, session: AsyncSession, refresh_token: str
     ) -> Session | None:
         stmt = select(cls).where(
-            func.pgp_sym_decrypt(cls.refresh_token, secret) == refresh_token
+            cls.refresh_token_hash == blind_index(refresh_token, REFRESH_TOKEN_INDEX)
         )
         return await session.scalar(stmt.order_by(cls.id))
 
@@ -89,6 +115,17 @@ class Session(TimestampedEntity):
             setattr(self, key, value)
         await session.flush()
 
+    @classmethod
+    async def clear_device_tokens(
+        cls, session: AsyncSession, session_ids: list[int]
+    ) -> None:
+        # プッシュ通知の送信先として無効になった端末には以後送らない
+        await session.execute(
+            update(cls)
+            .where(cls.id.in_(session_ids))
+            .values(device_token=None, updated_at=func.now())
+        )
+
     @classmethod
     async def delete(
         cls, session: AsyncSession, user_id: int, refresh_token: str
@@ -96,6 +133,7 @@ class Session(TimestampedEntity):
         await session.execute(
             delete(cls).where(
                 cls.user_id == user_id,
-                func.pgp_sym_decrypt(cls.refresh_token, secret) == refresh_token,
+                cls.refresh_token_hash
+                == blind_index(refresh_token, REFRESH_TOKEN_INDEX),
             )
         )
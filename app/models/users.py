@@ -40,6 +40,10 @@ class User(TimestampedEntity):
     notification_type: Mapped[NotificationType] = mapped_column(
         "notification_type", Integer, nullable=False, default=NotificationType.DISABLED
     )
+    # 設定した場合は入室しないまま指定の秒数が過ぎてから通知をまとめて送る
+    notification_digest_delay: Mapped[int | None] = mapped_column(
+        "notification_digest_delay", Integer, nullable=True, default=None
+    )
     first_name: Mapped[str] = mapped_column(
         "first_name", String(length=30), nullable=True
     )
@@ -1,5 +1,6 @@
 import os
 from pathlib import Path
+from typing import Literal
 
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
@@ -16,6 +17,85 @@ class Settings(BaseSettings):
     THROTTLING: bool
     REQUEST_TIMEOUT: int
     REGION: str
+    # チャットごとに保持する最新メッセージ数 (0で無効)
+    RECENT_MESSAGES_CACHE_SIZE: int = 60
+    RECENT_MESSAGES_CACHE_EXPIRY: int = 60 * 60
+    # キャッシュヒット時にDBとの整合性を検証する割合
+    RECENT_MESSAGES_CACHE_VERIFY_RATE: float = 0.01
+    # NDJSONのストリームで1回のトランザクションに読み込む件数
+    STREAM_BATCH_SIZE: int = 100
+    # エクスポートファイルの保存先 (localではファイルシステムを使用)
+    STORAGE_BUCKET: str = "chat-service-storage"
+    STORAGE_LOCAL_DIR: str = "/tmp/chat-service/storage"
+    EXPORT_BATCH_SIZE: int = 1000
+    EXPORT_JOB_EXPIRY: int = 60 * 60 * 24
+    EXPORT_LINK_EXPIRY: int = 60 * 60
+    # 実行中のエクスポートが進捗を記録する間隔と、記録が途絶えて失敗とみなすまでの時間
+    EXPORT_HEARTBEAT_INTERVAL: int = 10
+    EXPORT_JOB_TIMEOUT: int = 60
+    # messagesの月次パーティションを何か月先まで作成しておくか
+    MESSAGE_PARTITION_MONTHS_AHEAD: int = 3
+    MESSAGE_PARTITION_CHECK_INTERVAL: int = 60 * 60 * 24
+    # パーティションを切り離す際にmessagesのロックを待つ上限 (秒)
+    MESSAGE_PARTITION_LOCK_TIMEOUT: float = 5.0
+    # 保持期間による削除のバッチ (IDの範囲に含まれる件数) と負荷の上限
+    MESSAGE_RETENTION_INTERVAL: int = 60 * 60
+    MESSAGE_RETENTION_BATCH_SIZE: int = 5000
+    MESSAGE_RETENTION_ROWS_PER_SECOND: int = 2000
+    MESSAGE_RETENTION_MAX_REPLICATION_LAG: float = 5.0
+    # メッセージIDのワーカーID (未設定の場合は起動時にRedisのリースで払い出す)
+    SNOWFLAKE_WORKER_ID: int | None = None
+    SNOWFLAKE_LEASE_EXPIRY: int = 30
+    # メッセージ投稿の冪等キーの保持期間と、処理中として確保しておく期間
+    IDEMPOTENCY_KEY_EXPIRY: int = 60 * 60 * 24
+    IDEMPOTENCY_PENDING_EXPIRY: int = 60
+    # 一括投稿で1リクエストに含められるメッセージ数
+    MESSAGE_BATCH_MAX_SIZE: int = 100
+    # WebSocketへの配信待ちを1回に配信する件数と、起こされない場合のポーリング間隔
+    MESSAGE_OUTBOX_BATCH_SIZE: int = 100
+    MESSAGE_OUTBOX_POLL_INTERVAL: float = 1.0
+    # チャットの作成者と参加者のキャッシュ (プロセス内は短期間で失効させる)
+    CHAT_MEMBERSHIP_CACHE_EXPIRY: int = 60 * 5
+    CHAT_MEMBERSHIP_LOCAL_EXPIRY: float = 5.0
+    CHAT_MEMBERSHIP_LOCAL_SIZE: int = 10000
+    # チャット一覧と参加者一覧のキャッシュと、再計算中に他の処理が結果を待つ上限
+    RESPONSE_CACHE_EXPIRY: int = 60 * 60
+    RESPONSE_CACHE_LOCK_EXPIRY: float = 5.0
+    RESPONSE_CACHE_POLL_INTERVAL: float = 0.05
+    # チャットごとの通知先のキャッシュ (プロセス内は短期間で失効させる)
+    NOTIFICATION_TARGET_CACHE_EXPIRY: int = 60 * 5
+    NOTIFICATION_TARGET_LOCAL_EXPIRY: float = 5.0
+    NOTIFICATION_TARGET_LOCAL_SIZE: int = 10000
+    # sessionsの暗号化する列の方式 (pgp: Postgresのpgcrypto, aes_gcm: アプリケーション)
+    SESSION_ENCRYPTION_MODE: Literal["pgp", "aes_gcm"] = "pgp"
+    SESSION_REENCRYPT_BATCH_SIZE: int = 1000
+    # アプリケーションで暗号化する鍵のバージョンごとの秘密 (未設定ならSECRETをv1とする)
+    ENCRYPTION_KEYS: dict[int, str] = {}
+    ENCRYPTION_KEY_VERSION: int = 1
+    # ユーザーごとのプッシュ通知先の端末のキャッシュ (Redisには暗号化して保持する)
+    DEVICE_ENDPOINT_CACHE_EXPIRY: int = 60 * 60
+    # WebSocketのハートビートの間隔と、更新がなければ退室したとみなすまでの秒数
+    PRESENCE_HEARTBEAT_INTERVAL: float = 10.0
+    PRESENCE_EXPIRY: int = 30
+    # 通知をまとめる設定の上限と、期限が来た通知を確認する間隔・件数
+    NOTIFICATION_DIGEST_MAX_DELAY: int = 60 * 60 * 24
+    NOTIFICATION_DIGEST_POLL_INTERVAL: float = 5.0
+    NOTIFICATION_DIGEST_BATCH_SIZE: int = 100
+    NOTIFICATION_DIGEST_MAX_MESSAGES: int = 20
+    # 取り出したまとめた通知の送信を確定するまでの秒数 (過ぎた場合は再送する)
+    NOTIFICATION_DIGEST_LEASE: int = 60
+    # メールの通知を1通にまとめる期間 (0で無効) と、SESの送信元とテンプレート名
+    NOTIFICATION_EMAIL_WINDOW: int = 60
+    NOTIFICATION_EMAIL_SOURCE: str = "SENDER <from-address@test.com>"
+    NOTIFICATION_EMAIL_TEMPLATE: str | None = None
+    # プッシュ通知を同時に送る上限と、一時的なエラーの再送回数・待機の基準秒数
+    PUSH_CONCURRENCY: int = 32
+    PUSH_MAX_RETRIES: int = 3
+    PUSH_RETRY_BASE_DELAY: float = 0.2
+    # 論理削除したチャットの子の行を1トランザクションで削除する件数と負荷の上限
+    CHAT_PURGE_INTERVAL: int = 60
+    CHAT_PURGE_BATCH_SIZE: int = 5000
+    CHAT_PURGE_ROWS_PER_SECOND: int = 2000
 
     model_config = SettingsConfigDict(
         env_file=Path(__file__).parent / f"config/{os.environ['APP_CONFIG_FILE']}.env",
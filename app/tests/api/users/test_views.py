@@ -113,6 +113,7 @@ async def test_users_read(
         "email": "user1@example.com",
         "new_email": "new-user1@example.com",
         "notification_type": "disabled",
+        "notification_digest_delay": None,
     }
     assert expected == response.json()
 
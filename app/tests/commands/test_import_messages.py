@@ -0,0 +1,74 @@
+from datetime import UTC, datetime
+
+from pytest_mock import MockFixture
+
+from app.commands.import_messages import ImportStats, MessageImporter, message_ids
+from app.commons.snowflake import SnowflakeGenerator
+
+
+def test_import_messages_convert() -> None:
+    """旧IDを新IDに置き換えてCOPY用の行に変換する"""
+
+    importer = MessageImporter({1: 10, 2: 20}, {5: 50}, batch_size=2)
+
+    record = importer.convert(
+        {
+            "chat_id": 5,
+            "sender_id": 1,
+            "content": "Message content 1",
+            "created_at": "2023-03-05T19:52:33+09:00",
+            "read_by_list": [2, 3],
+        }
+    )
+
+    created_at = datetime(2023, 3, 5, 10, 52, 33)
+    assert (50, 10, "Message content 1", [20], created_at, created_at) == record
+
+
+def test_import_messages_convert_skips_invalid_rows() -> None:
+    """対応表にないIDや不正な行はスキップする"""
+
+    importer = MessageImporter({1: 10}, {5: 50}, batch_size=2)
+
+    lines = [
+        '{"chat_id": 5, "sender_id": 1, "content": "a", "created_at": "2023-03-05"}',
+        '{"chat_id": 6, "sender_id": 1, "content": "b", "created_at": "2023-03-05"}',
+        '{"chat_id": 5, "sender_id": 2, "content": "c", "created_at": "2023-03-05"}',
+        '{"chat_id": 5, "sender_id": 1, "content": "", "created_at": "2023-03-05"}',
+        '{"chat_id": 5, "sender_id": 1, "content": "d"}',
+        "not json",
+        "",
+        '{"chat_id": 5, "sender_id": 1, "content": "e", "created_at": "2023-03-05"}',
+        '{"chat_id": 5, "sender_id": 1, "content": "f", "created_at": "2023-03-05"}',
+    ]
+    stats = ImportStats()
+
+    batches = list(importer._batches(iter(lines), stats))
+
+    assert [["a", "e"], ["f"]] == [[row[2] for row in batch] for batch in batches]
+    assert 5 == stats.skipped
+
+
+def test_import_messages_ids_follow_created_at(mocker: MockFixture) -> None:
+    """取り込むメッセージのIDは取り込んだ時刻ではなく作成時刻から採番する"""
+
+    generator = SnowflakeGenerator(3)
+    mocker.patch("app.commands.import_messages.snowflake", generator)
+    created_at = [
+        datetime(2024, 5, 1, 12, 0, 0),
+        datetime(2024, 3, 1, 12, 0, 0),
+        datetime(2024, 3, 1, 12, 0, 0),
+        datetime(2023, 3, 5, 10, 52, 33),
+    ]
+    batch: list[tuple] = [(50, 10, "a", [], value, value) for value in created_at]
+
+    ids = message_ids(batch)
+
+    # 作成時刻の順に並び、同じ時刻でも重複しない
+    assert [ids[3], ids[1], ids[2], ids[0]] == sorted(ids)
+    assert (created_at[0].replace(tzinfo=UTC), 3, 0) == generator.parse(ids[0])
+    assert (created_at[2].replace(tzinfo=UTC), 3, 1) == generator.parse(ids[2])
+    # IDのエポックより前の行はエポックの時刻で採番する
+    assert datetime(2024, 1, 1, tzinfo=UTC) == generator.parse(ids[3])[0]
+    # 取り込み後に生成したIDは取り込んだIDより大きい
+    assert max(ids) < generator.generate()
@@ -1,33 +1,22 @@
-from functools import wraps
 from typing import AsyncGenerator, Generator
-from unittest import mock
 
 import pytest
+import redis
 from httpx import ASGITransport, AsyncClient
 from sqlalchemy import create_engine, event, text
 from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.orm import Session, SessionTransaction
 
+from app.commons.chat_membership import ChatMembershipCache
+from app.commons.notification_targets import NotificationTargetCache
+from app.commons.snowflake import snowflake
+from app.commons.types import CacheType
 from app.db import get_session
 from app.models.base import Base
 from app.settings import settings
 
 
-def mock_cache(*args, **kwargs):
-    def wrapper(func):
-        @wraps(func)
-        async def inner(*args, **kwargs):
-            return await func(*args, **kwargs)
-
-        return inner
-
-    return wrapper
-
-
-mock.patch("fastapi_cache.decorator.cache", mock_cache).start()
-
-
 @pytest.fixture
 def anyio_backend() -> str:
     return "asyncio"
@@ -89,6 +78,39 @@ def setup_test_db(setup_db: Generator) -> Generator:
     engine.dispose()
 
 
+@pytest.fixture(autouse=True)
+def flush_caches() -> Generator:
+    # テスト間でDBのIDが再利用されるため、IDをキーにしたキャッシュを毎回破棄する
+    for cache_type in (
+        CacheType.CACHE,
+        CacheType.RECENT_MESSAGES,
+        CacheType.IDEMPOTENCY,
+        CacheType.MEMBERSHIP,
+        CacheType.NOTIFICATION_TARGETS,
+        CacheType.NOTIFICATION_DIGESTS,
+        CacheType.DEVICE_ENDPOINTS,
+        CacheType.PUBSUB,
+    ):
+        client = redis.from_url(f"{settings.REDIS_URI}/{cache_type}")
+        try:
+            client.flushdb()
+        except redis.exceptions.RedisError:
+            pass
+        finally:
+            client.close()
+    ChatMembershipCache.clear_local()
+    NotificationTargetCache.clear_local()
+    yield
+
+
+@pytest.fixture(autouse=True)
+def snowflake_worker_id() -> Generator:
+    # lifespanを経由しないため、リースの代わりにワーカーIDを直接設定する
+    snowflake.worker_id = 0
+    yield
+    snowflake.worker_id = 0
+
+
 @pytest.fixture
 async def session() -> AsyncGenerator:
     from app.main import app
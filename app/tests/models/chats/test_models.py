@@ -1,12 +1,19 @@
+import json
 from datetime import datetime
+from pathlib import Path
 
 import pytest
+from fastapi import HTTPException
 from httpx import AsyncClient
 from pytest_mock import MockFixture
-from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import func, select, text
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
 
+from app.commons.chat_membership import ChatMembershipCache, authorize
+from app.commons.chat_purge import ChatPurge
+from app.commons.storage import LocalStorage
 from app.commons.types import ChatType, NotificationType
-from app.models import Chat, User
+from app.models import Chat, ChatParticipants, Message, MessageArchive, User
 
 now_datetime = datetime(2023, 3, 5, 10, 52, 33)
 
@@ -151,3 +158,287 @@ async def test_chat_delete_function(
     # Verify the deletion
     deleted_chat = await Chat.read_by_id(session, chat_id=new_chat_id)
     assert deleted_chat is None
+
+
+@pytest.mark.anyio
+async def test_chat_purge(
+    ac: AsyncClient, session: AsyncSession, mocker: MockFixture, tmp_path: Path
+) -> None:
+    """Test purging the messages and participants of a deleted chat"""
+
+    # Set up test data
+    await setup_data(session)
+    user1 = await User.read_by_email(session, "user1@example.com")
+    user2 = await User.read_by_email(session, "user2@example.com")
+    assert user1 is not None and user2 is not None
+    chat = await Chat.create(
+        session, created_by=user1.id, chat_type=ChatType.GROUP, name="Big Chat"
+    )
+    session.add(ChatParticipants(chat_id=chat.id, user_id=user2.id))
+    for i in range(5):
+        await Message.create(
+            session, chat_id=chat.id, sender_id=user1.id, content=f"Message {i}"
+        )
+    await session.commit()
+    chat_id = chat.id
+
+    # 退避済みのメッセージのアーカイブ
+    storage = LocalStorage(str(tmp_path))
+    archive = await MessageArchive.create(
+        session,
+        partition_name="messages_p202303",
+        range_start=datetime(2023, 3, 1),
+        range_end=datetime(2023, 4, 1),
+        storage_key="archives/messages/messages_p202303/",
+        row_count=2,
+        chat_ids=[chat_id, chat_id + 1],
+        archived_at=now_datetime,
+    )
+    for archived_chat_id in archive.chat_ids:
+        source = tmp_path / f"{archived_chat_id}.ndjson.gz"
+        source.write_bytes(b"")
+        await storage.upload_file(
+            source, archive.chat_storage_key(archived_chat_id), "application/gzip"
+        )
+    archive_id = archive.id
+    await session.commit()
+
+    # 削除は論理削除のみで、子の行は残る
+    await Chat.delete(session, chat_id=chat_id, user_id=user1.id)
+    await session.commit()
+    assert await Chat.read_by_id(session, chat_id=chat_id) is None
+    assert await Chat.read_members(session, chat_id) is None
+    assert 5 == await session.scalar(
+        select(func.count()).where(Message.chat_id == chat_id)
+    )
+
+    # execute
+    purge = ChatPurge(async_sessionmaker(bind=session.bind), storage)
+    purge.batch_size = 2
+    purge.rows_per_second = 0
+    deleted = await purge.execute()
+
+    # メッセージ5件と参加者1件を削除し、チャットも削除される
+    assert 6 == deleted
+    session.expunge_all()
+    assert 0 == await session.scalar(
+        select(func.count()).where(Message.chat_id == chat_id)
+    )
+    assert 0 == await session.scalar(
+        select(func.count()).where(ChatParticipants.chat_id == chat_id)
+    )
+    assert await session.scalar(select(Chat.id).where(Chat.id == chat_id)) is None
+
+    # 退避済みのメッセージもチャットの分だけ削除される
+    archive_dir = tmp_path / "archives/messages/messages_p202303"
+    assert [f"{chat_id + 1}.ndjson.gz"] == [path.name for path in archive_dir.iterdir()]
+    assert [chat_id + 1] == await session.scalar(
+        select(MessageArchive.chat_ids).where(MessageArchive.id == archive_id)
+    )
+
+    # 削除待ちのチャットがなければ何もしない
+    assert 0 == await purge.execute()
+
+
+@pytest.mark.anyio
+async def test_chat_membership_cache(
+    ac: AsyncClient, session: AsyncSession, mocker: MockFixture
+) -> None:
+    """Test the membership cache backed by Chat.read_members"""
+
+    # Set up test data
+    await setup_data(session)
+
+    user1 = await User.read_by_email(session, "user1@example.com")
+    user2 = await User.read_by_email(session, "user2@example.com")
+    assert user1 is not None and user2 is not None
+    chat = [
+        c
+        async for c in Chat.read_all(
+            session, user_id=user1.id, offset=0, limit=10, desc=True
+        )
+    ][0]
+
+    # 参加者がいないチャットは作成者のみ
+    assert await Chat.read_members(session, chat.id) == (user1.id, [])
+    assert await Chat.read_members(session, 0) is None
+
+    cache = ChatMembershipCache()
+    members = await cache.read(session, chat.id)
+    assert members is not None
+    assert user1.id in members
+    assert user2.id not in members
+
+    # 無効化するまではキャッシュから返す
+    session.add(ChatParticipants(chat_id=chat.id, user_id=user2.id))
+    await session.commit()
+    read_members = mocker.spy(Chat, "read_members")
+    members = await cache.read(session, chat.id)
+    assert members is not None
+    assert user2.id not in members
+    read_members.assert_not_called()
+
+    # プロセス内のキャッシュが失効してもRedisから返す
+    ChatMembershipCache.clear_local()
+    members = await cache.read(session, chat.id)
+    assert members is not None
+    assert user2.id not in members
+    read_members.assert_not_called()
+
+    await cache.invalidate(chat.id)
+    members = await authorize(session, chat.id, user2.id)
+    assert members.created_by == user1.id
+    assert members.participant_ids == frozenset([user2.id])
+    read_members.assert_called_once()
+
+    with pytest.raises(HTTPException) as e:
+        await authorize(session, chat.id, 0)
+    assert e.value.status_code == 403
+
+
+def plan_nodes(plan: dict) -> list[dict]:
+    nodes = [plan]
+    for child in plan.get("Plans", []):
+        nodes.extend(plan_nodes(child))
+    return nodes
+
+
+class StatementRecorder:
+    """stream_scalarsに渡されたSQLを実行せずに記録する"""
+
+    def __init__(self) -> None:
+        self.statements: list = []
+
+    async def stream_scalars(self, stmt):  # type: ignore
+        self.statements.append(stmt)
+        return self
+
+    def __aiter__(self):  # type: ignore
+        return self
+
+    async def __anext__(self):  # type: ignore
+        raise StopAsyncIteration
+
+
+async def seed_chats(session: AsyncSession, chats_per_user: int) -> None:
+    # 200人のユーザーがそれぞれチャットを作成し、各チャットに2人ずつ参加させる
+    last_chat_id = await session.scalar(text("SELECT coalesce(max(id), 0) FROM chats"))
+    await session.execute(
+        text(
+            "INSERT INTO users (email, notification_type, is_name_visible) "
+            "SELECT 'explain' || g || '@example.com', 0, true "
+            "FROM generate_series(1, 200) g ON CONFLICT (email) DO NOTHING"
+        )
+    )
+    await session.execute(
+        text(
+            "INSERT INTO chats (created_by, chat_type, name) "
+            "SELECT u.id, :chat_type, 'Explain' FROM users u "
+            "CROSS JOIN generate_series(1, :chats_per_user) "
+            "WHERE u.email LIKE 'explain%'"
+        ),
+        {"chat_type": ChatType.GROUP, "chats_per_user": chats_per_user},
+    )
+    await session.execute(
+        text(
+            "INSERT INTO chat_participants (chat_id, user_id) "
+            "SELECT c.id, u.id FROM chats c JOIN users u "
+            "ON u.email LIKE 'explain%' AND (u.id + c.id) % 100 = 0 "
+            "WHERE c.id > :last_chat_id"
+        ),
+        {"last_chat_id": last_chat_id},
+    )
+    await session.execute(text("ANALYZE users, chats, chat_participants"))
+
+
+@pytest.mark.anyio
+async def test_chat_read_all_plan(
+    ac: AsyncClient, session: AsyncSession, mocker: MockFixture
+) -> None:
+    """Test that Chat.read_all stays on indexes as the tables grow"""
+
+    recorder = StatementRecorder()
+    for chats_per_user in (20, 60):
+        await seed_chats(session, chats_per_user)
+        user_id = await session.scalar(
+            text("SELECT min(id) FROM users WHERE email LIKE 'explain%'")
+        )
+        assert user_id is not None
+
+        # 作成者または参加者のチャットがIDの降順でページングされる
+        expected = sorted(
+            await session.scalars(
+                text(
+                    "SELECT chat_id FROM chat_participants WHERE user_id = :id "
+                    "UNION SELECT id FROM chats WHERE created_by = :id"
+                ),
+                {"id": user_id},
+            ),
+            reverse=True,
+        )
+        chat_ids = []
+        for offset in (0, 10, 20):
+            async for chat in Chat.read_all(
+                session, user_id=user_id, offset=offset, limit=10, desc=True
+            ):
+                chat_ids.append(chat.id)
+        assert chat_ids == expected[:30]
+
+        async for _ in Chat.read_all(
+            recorder,  # type: ignore[arg-type]
+            user_id=user_id,
+            offset=20,
+            limit=10,
+            desc=True,
+        ):
+            pass
+        sql = recorder.statements[-1].compile(
+            dialect=session.bind.dialect, compile_kwargs={"literal_binds": True}
+        )
+        result = await session.scalar(text(f"EXPLAIN (FORMAT JSON) {sql}"))
+        plan = result if isinstance(result, list) else json.loads(result)
+        nodes = plan_nodes(plan[0]["Plan"])
+
+        assert not [n for n in nodes if n["Node Type"] == "Seq Scan"]
+        index_names = {n.get("Index Name") for n in nodes}
+        assert "ix_chat_participants_user_id_chat_id" in index_names
+        assert "ix_chats_created_by_id" in index_names
+
+
+@pytest.mark.anyio
+async def test_chat_participants_create_all_by_names(
+    ac: AsyncClient, session: AsyncSession, mocker: MockFixture
+) -> None:
+    """Test the bulk participant creation by usernames"""
+
+    # Set up test data
+    await setup_data(session)
+    user = await User.read_by_email(session, "user1@example.com")
+    assert user is not None
+    chat = await Chat.create(
+        session, created_by=user.id, chat_type=ChatType.GROUP, name="Large Chat"
+    )
+    await session.execute(
+        text(
+            "INSERT INTO users (username, email, notification_type, is_name_visible) "
+            "SELECT 'bulk' || g, 'bulk' || g || '@example.com', 0, true "
+            "FROM generate_series(1, 3000) g"
+        )
+    )
+
+    # 存在しないユーザー名と重複は参加者にならない
+    names = [f"bulk{i}" for i in range(1, 3001)] + ["bulk1", "nobody"]
+    added, unresolved = await ChatParticipants.create_all_by_names(
+        session, chat.id, names
+    )
+    assert 3000 == len(added)
+    assert ["nobody"] == unresolved
+
+    members = await Chat.read_members(session, chat.id)
+    assert members is not None
+    assert added == sorted(members[1])
+
+    # 既に参加しているユーザーは追加せず、未解決にも含めない
+    assert ([], []) == await ChatParticipants.create_all_by_names(
+        session, chat.id, ["bulk1"]
+    )
@@ -1,12 +1,36 @@
-from datetime import datetime
+import json
+from datetime import date, datetime
+from pathlib import Path
 
 import pytest
 from httpx import AsyncClient
 from pytest_mock import MockFixture
-from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select, text
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
 
-from app.commons.types import ChatType, NotificationType
-from app.models import Chat, Message, User
+from app.commons.message_outbox import MessageOutboxRelay
+from app.commons.message_partitions import MessagePartitionManager
+from app.commons.message_retention import MessageRetention
+from app.commons.redis_cache import redis_connection
+from app.commons.snowflake import (
+    MAX_ID,
+    WORKER_ID_KEY,
+    SnowflakeGenerator,
+    WorkerIdLease,
+    generate_id,
+    snowflake,
+)
+from app.commons.storage import LocalStorage
+from app.commons.types import CacheType, ChatEventType, ChatType, NotificationType
+from app.models import (
+    Chat,
+    ChatEvent,
+    Message,
+    MessageOutbox,
+    RetentionPolicy,
+    RetentionRun,
+    User,
+)
 
 now_datetime = datetime(2023, 3, 5, 10, 52, 33)
 
@@ -188,3 +212,285 @@ async def test_message_delete_function(
     # Verify the deletion
     deleted_message = await Message.read_by_id(session, message_id=new_message_id)
     assert deleted_message is None
+
+
+@pytest.mark.anyio
+async def test_message_partition_and_archive_functions(
+    ac: AsyncClient, session: AsyncSession, mocker: MockFixture, tmp_path: Path
+) -> None:
+    """Test the partition and archive functions of the Message model"""
+
+    # Set up test data
+    await setup_data(session)
+    user = await User.read_by_email(session, "user1@example.com")
+    assert user is not None
+    chat = [
+        chat
+        async for chat in Chat.read_all(
+            session, user_id=user.id, offset=0, limit=10, desc=True
+        )
+    ][0]
+    manager = MessagePartitionManager(
+        LocalStorage(str(tmp_path)), async_sessionmaker(bind=session.bind)
+    )
+
+    # デフォルトパーティションの行は作成した月のパーティションに移る
+    assert await manager.create_partition(session, date(2023, 3, 1))
+    assert not await manager.create_partition(session, date(2023, 3, 1))
+    assert ["messages_p202303"] == await manager.read_partitions(session)
+    messages = [
+        message
+        async for message in Message.read_all(
+            session, chat_id=chat.id, offset=0, limit=10
+        )
+    ]
+    assert ["Hello, this is message 1."] == [message.content for message in messages]
+
+    # 切り離したテーブルには外部キーを残さず、退避中もチャットを削除できる
+    assert await manager._detach("messages_p202303")
+    foreign_keys = await session.scalars(
+        text(
+            "SELECT conname FROM pg_constraint "
+            "WHERE conrelid = 'messages_p202303'::regclass AND contype = 'f'"
+        )
+    )
+    assert [] == list(foreign_keys)
+
+    # 退避したメッセージはテーブルからは消え、アーカイブから読める
+    archives = await manager.archive_before(date(2023, 4, 1))
+    assert ["messages_p202303"] == [archive.partition_name for archive in archives]
+    assert 2 == archives[0].row_count
+    assert archives[0].archived_at is not None
+    # チャットごとに別のアーカイブとして退避される
+    assert sorted(
+        path.name
+        for path in (tmp_path / "archives/messages/messages_p202303").iterdir()
+    ) == sorted(f"{chat_id}.ndjson.gz" for chat_id in archives[0].chat_ids)
+    assert [] == await manager.read_partitions(session)
+    messages = [
+        message
+        async for message in Message.read_all(
+            session, chat_id=chat.id, offset=0, limit=10
+        )
+    ]
+    assert [] == messages
+    archived = [
+        message
+        async for message in manager.read_archived(
+            session, chat_id=chat.id, offset=0, limit=10
+        )
+    ]
+    assert ["Hello, this is message 1."] == [message.content for message in archived]
+
+
+@pytest.mark.anyio
+async def test_message_retention(
+    ac: AsyncClient, session: AsyncSession, mocker: MockFixture
+) -> None:
+    """Test deleting messages past the retention period"""
+
+    # Set up test data
+    await setup_data(session)
+    await RetentionPolicy.create(session, chat_type=ChatType.GROUP, retention_days=30)
+    await session.commit()
+
+    # execute
+    retention = MessageRetention(async_sessionmaker(bind=session.bind))
+    deleted = await retention.execute()
+
+    # グループチャットのメッセージのみ削除される
+    assert 1 == deleted
+    contents = (await session.execute(select(Message.content))).scalars().all()
+    assert ["Hello, this is message 1."] == list(contents)
+
+    run = await session.scalar(select(RetentionRun))
+    assert run is not None
+    assert run.finished_at is not None
+    assert 1 == run.deleted_count
+
+    events = (
+        await session.execute(
+            select(ChatEvent).where(
+                ChatEvent.event_type == ChatEventType.MESSAGE_DELETED
+            )
+        )
+    ).scalars()
+    assert 1 == len(list(events))
+
+    # 削除対象がなければ何もしない
+    assert 0 == await retention.execute()
+
+
+@pytest.mark.anyio
+async def test_message_snowflake_ids(
+    ac: AsyncClient, session: AsyncSession, mocker: MockFixture
+) -> None:
+    """Test the application generated message ids"""
+
+    # Set up test data
+    await setup_data(session)
+    user = await User.read_by_email(session, "user1@example.com")
+    assert user is not None
+    chat_id = (await session.scalars(select(Chat.id).order_by(Chat.id))).first()
+    assert chat_id is not None
+
+    # execute
+    messages = [
+        await Message.create(
+            session, chat_id=chat_id, sender_id=user.id, content=f"Message {i}"
+        )
+        for i in range(3)
+    ]
+    message_ids = [message.id for message in messages]
+
+    # 作成順に増加し、JSONの数値で正確に扱える範囲に収まる
+    assert sorted(message_ids) == message_ids
+    assert all(0 < message_id <= MAX_ID for message_id in message_ids)
+    _, worker_id, _ = snowflake.parse(message_ids[0])
+    assert snowflake.worker_id == worker_id
+
+    # 新しい順の一覧は作成の逆順になる
+    latest = [
+        message.id
+        async for message in Message.read_all(
+            session, chat_id=chat_id, offset=0, limit=3
+        )
+    ]
+    assert message_ids[::-1] == latest
+
+    # バッチの範囲はIDの幅ではなく件数で区切られる
+    end_id = await Message.read_batch_end_id(
+        session, message_ids[0], message_ids[-1], 2
+    )
+    assert message_ids[2] == end_id
+    end_id = await Message.read_batch_end_id(
+        session, message_ids[0], message_ids[-1], 3
+    )
+    assert message_ids[-1] + 1 == end_id
+
+
+def test_snowflake_without_worker_id() -> None:
+    """Test that ids are not generated before a worker id lease is acquired"""
+
+    generator = SnowflakeGenerator(None)
+    with pytest.raises(RuntimeError):
+        generator.generate()
+
+    # リースの取得でワーカーIDが設定されると生成できる
+    generator.worker_id = 4
+    assert 4 == generator.parse(generator.generate())[1]
+
+
+@pytest.mark.anyio
+async def test_worker_id_lease() -> None:
+    """Test that ids are not generated while the worker id lease is lost"""
+
+    lease = WorkerIdLease()
+    original_worker_id = snowflake.worker_id
+    worker_ids = []
+    try:
+        worker_id = await lease.acquire()
+        assert worker_id is not None
+        worker_ids.append(worker_id)
+        assert await lease.renew()
+
+        # 他のプロセスにリースを奪われた場合は生成しない
+        async with redis_connection(CacheType.SNOWFLAKE) as cache:
+            await cache.set(WORKER_ID_KEY.format(worker_id), "other")
+        assert not await lease.renew()
+        assert lease.worker_id is None
+        with pytest.raises(RuntimeError):
+            generate_id()
+
+        # 取り直した後は再び生成できる
+        worker_id = await lease.acquire()
+        assert worker_id is not None
+        worker_ids.append(worker_id)
+        assert worker_id == snowflake.parse(generate_id())[1]
+    finally:
+        async with redis_connection(CacheType.SNOWFLAKE) as cache:
+            for worker_id in worker_ids:
+                await cache.delete(WORKER_ID_KEY.format(worker_id))
+        snowflake.worker_id = original_worker_id
+
+
+@pytest.mark.anyio
+async def test_message_create_authorized(
+    ac: AsyncClient, session: AsyncSession, mocker: MockFixture
+) -> None:
+    """Test creating a message only when the sender belongs to the chat"""
+
+    # Set up test data
+    await setup_data(session)
+    user1 = await User.read_by_email(session, "user1@example.com")
+    user2 = await User.read_by_email(session, "user2@example.com")
+    assert user1 is not None and user2 is not None
+    chat = await session.scalar(select(Chat).where(Chat.created_by == user1.id))
+    assert chat is not None
+
+    # 作成者はメッセージを作成でき、usernameが返される
+    created = await Message.create_authorized(
+        session, chat.id, user1.id, "Authorized message."
+    )
+    assert created is not None
+    message, username = created
+    assert "user1" == username
+    assert "Authorized message." == message.content
+    assert [] == message.read_by_list
+
+    event = await session.scalar(
+        select(ChatEvent).where(ChatEvent.message_ids.any(message.id))  # type: ignore
+    )
+    assert event is not None
+    assert ChatEventType.MESSAGE_CREATED == event.event_type
+
+    # 関係者でない場合は作成されない
+    created = await Message.create_authorized(
+        session, chat.id, user2.id, "Unauthorized message."
+    )
+    assert created is None
+    contents = (
+        await session.execute(select(Message.content).where(Message.chat_id == chat.id))
+    ).scalars()
+    assert "Unauthorized message." not in list(contents)
+
+
+@pytest.mark.anyio
+async def test_message_outbox_relay(
+    ac: AsyncClient, session: AsyncSession, mocker: MockFixture
+) -> None:
+    """Test relaying created messages to the chat channels"""
+
+    # Set up test data
+    await setup_data(session)
+    user = await User.read_by_email(session, "user1@example.com")
+    assert user is not None
+    chat = await session.scalar(select(Chat).where(Chat.created_by == user.id))
+    assert chat is not None
+    chat_id, user_id = chat.id, user.id
+
+    single = await Message.create(
+        session, chat_id=chat_id, sender_id=user_id, content="Single message."
+    )
+    batch = await Message.create_all(session, chat_id, user_id, ["Batch 1", "Batch 2"])
+    single_id, batch_ids = single.id, [message.id for message in batch]
+    await session.commit()
+
+    pubsub = mocker.MagicMock()
+    pipe = pubsub.pipeline.return_value.__aenter__.return_value
+    pipe.execute = mocker.AsyncMock()
+
+    # execute
+    relay = MessageOutboxRelay(async_sessionmaker(bind=session.bind), pubsub)
+    assert 2 == await relay.relay()
+
+    # 作成単位で1件ずつ配信され、一括投稿は配列になる
+    published = [call.args for call in pipe.publish.call_args_list]
+    assert [f"chat_messages_{chat_id}"] * 2 == [channel for channel, _ in published]
+    assert single_id == json.loads(published[0][1])["id"]
+    assert batch_ids == [message["id"] for message in json.loads(published[1][1])]
+    pipe.execute.assert_awaited_once()
+
+    # 配信済みの行は削除される
+    assert [] == list((await session.scalars(select(MessageOutbox))).all())
+    assert 0 == await relay.relay()
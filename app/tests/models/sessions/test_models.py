@@ -1,12 +1,22 @@
+import json
 from datetime import UTC, datetime, timedelta
 
 import pytest
 from httpx import AsyncClient
 from pytest_mock import MockFixture
+from sqlalchemy import LargeBinary, func, select, type_coerce
 from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session as SyncSession
 
-from app.commons.types import NotificationType, PlatformType
-from app.models import Session, User
+from app.commons.crypto import VersionedCipher
+from app.commons.notification_targets import (
+    DeviceEndpointCache,
+    NotificationTargetCache,
+)
+from app.commons.redis_cache import redis_connection
+from app.commons.session_encryption import reencrypt_sessions_batch
+from app.commons.types import CacheType, ChatType, NotificationType, PlatformType
+from app.models import Chat, ChatParticipants, Session, User
 
 now_datetime = datetime(2023, 3, 5, 10, 52, 33)
 
@@ -182,3 +192,144 @@ async def test_session_delete_function(
     # Verify the deletion
     deleted_session = await Session.read_by_id(session, session_id=new_session_id)
     assert deleted_session is None
+
+
+@pytest.mark.anyio
+async def test_notification_target_cache(
+    ac: AsyncClient, session: AsyncSession, mocker: MockFixture
+) -> None:
+    """Test the shared notification targets of a chat"""
+
+    # Set up test data
+    await setup_data(session)
+    user1 = await User.read_by_email(session, "user1@example.com")
+    user2 = await User.read_by_email(session, "user2@example.com")
+    assert user1 is not None and user2 is not None
+    chat = await Chat.create(
+        session, created_by=user2.id, chat_type=ChatType.GROUP, name="Chat"
+    )
+    session.add(ChatParticipants(chat_id=chat.id, user_id=user1.id))
+    await user1.update(session, notification_type=NotificationType.MOBILE_PUSH)
+    await session.commit()
+    chat_id = chat.id
+    user1_id = user1.id
+
+    # execute
+    cache = NotificationTargetCache()
+    targets = await cache.read(session, chat_id)
+    assert [] == targets.emails()
+    assert [("device_token_ios", PlatformType.IOS)] == [
+        (device.device_token, device.platform_type) for device in targets.push_devices()
+    ]
+    assert [] == targets.push_devices([user1_id])
+
+    # チャットごとのキャッシュには端末を含めない
+    async with redis_connection(CacheType.NOTIFICATION_TARGETS) as redis:
+        cached = await redis.get(f"{chat_id}:targets")
+    assert cached is not None
+    assert "devices" not in json.loads(cached)
+    assert "device_token_ios" not in cached
+
+    # 無効化するまではキャッシュした通知先を返す
+    mobile_session = await Session.read_by_user_id_and_refresh_token(
+        session, user1_id, "refresh_token_2"
+    )
+    assert mobile_session is not None
+    await mobile_session.update(session, device_token="device_token_ios_2")
+    await user1.update(session, notification_type=NotificationType.EMAIL)
+    await session.commit()
+    assert targets == await cache.read(session, chat_id)
+
+    # 無効化すると端末と通知設定の変更を読み直す
+    await cache.invalidate([chat_id])
+    targets = await cache.read(session, chat_id)
+    assert ["user1@example.com"] == targets.emails()
+    assert [] == targets.push_devices()
+
+
+@pytest.mark.anyio
+async def test_device_endpoint_cache(session: AsyncSession) -> None:
+    """Test the per-user device endpoints cached without decrypting in SQL"""
+
+    # Set up test data
+    await setup_data(session)
+    user1 = await User.read_by_email(session, "user1@example.com")
+    assert user1 is not None
+    user1_id = user1.id
+
+    # execute
+    cache = DeviceEndpointCache()
+    devices = await cache.read(session, [user1_id])
+    assert [("device_token_ios", PlatformType.IOS)] == [
+        (device.device_token, device.platform_type) for device in devices
+    ]
+
+    # Redisにはdevice_tokenを平文で保持しない
+    async with redis_connection(CacheType.DEVICE_ENDPOINTS) as redis:
+        cached = await redis.get(f"{user1_id}:devices")
+    assert cached is not None
+    assert "device_token_ios" not in cached
+
+    # 無効化するまではDBから読み直さない
+    mobile_session = await Session.read_by_user_id_and_refresh_token(
+        session, user1_id, "refresh_token_2"
+    )
+    assert mobile_session is not None
+    await mobile_session.update(session, device_token="device_token_ios_2")
+    await session.commit()
+    assert devices == await cache.read(session, [user1_id])
+
+    await cache.invalidate([user1_id])
+    devices = await cache.read(session, [user1_id])
+    assert ["device_token_ios_2"] == [device.device_token for device in devices]
+
+
+@pytest.mark.anyio
+async def test_reencrypt_sessions(session: AsyncSession) -> None:
+    """Test switching the encrypted sessions columns between pgp and aes_gcm"""
+
+    # Set up test data
+    await setup_data(session)
+    user1 = await User.read_by_email(session, "user1@example.com")
+    assert user1 is not None
+    user1_id = user1.id
+    count = await session.scalar(select(func.count()).select_from(Session))
+
+    def reencrypt(sync_session: SyncSession, mode: str) -> list[int]:
+        ids: list[int] = []
+        while batch := reencrypt_sessions_batch(
+            sync_session.connection(), mode, ids[-1] if ids else 0, 1
+        ):
+            ids += batch
+        return ids
+
+    # execute
+    # 作成時にrefresh_token_hashを設定するため、同じ方式では暗号化し直さない
+    assert [] == await session.run_sync(reencrypt, "pgp")
+
+    ids = await session.run_sync(reencrypt, "aes_gcm")
+    assert count == len(ids)
+    raw = await session.scalar(
+        select(type_coerce(Session.refresh_token, LargeBinary)).where(
+            Session.id == ids[0]
+        )
+    )
+    assert raw is not None and raw.startswith(b"aes:v1:")
+    assert [] == await session.run_sync(reencrypt, "aes_gcm")
+
+    # 方式を切り替える前の設定でも復号でき、refresh_tokenのHMACで検索できる
+    session.expire_all()
+    mobile_session = await Session.read_by_user_id_and_refresh_token(
+        session, user1_id, "refresh_token_2"
+    )
+    assert mobile_session is not None
+    assert "device_token_ios" == mobile_session.device_token
+
+    # pgcryptoに戻す
+    assert ids == await session.run_sync(reencrypt, "pgp")
+
+    # 鍵を切り替えた後も以前のバージョンの鍵で復号できる
+    token = VersionedCipher("test", {1: "old"}, 1).encrypt("value")
+    cipher = VersionedCipher("test", {1: "old", 2: "new"}, 2)
+    assert "value" == cipher.decrypt(token)
+    assert cipher.encrypt("value").startswith("v2:")
@@ -0,0 +1,29 @@
+import pytest
+from pydantic import ValidationError
+
+from app.ws.messages.schema import CreateMessageRequest, ErrorFrame
+
+
+def test_create_message_request_from_text() -> None:
+    """typeが"message"のJSONだけをリクエストとして扱い、それ以外は本文とする"""
+
+    request = CreateMessageRequest.from_text(
+        '{"type": "message", "content": "Hello", "client_message_id": "key-1"}'
+    )
+    assert ("Hello", "key-1") == (request.content, request.client_message_id)
+
+    # JSONの本文もそのまま投稿できる
+    for data in ['{"content": "Hello"}', '{"a": 1}', "{not json", "Hello"]:
+        request = CreateMessageRequest.from_text(data)
+        assert (data, None) == (request.content, request.client_message_id)
+
+
+def test_create_message_request_from_text_invalid() -> None:
+    """不正なリクエストはエラーのフレームに変換できる"""
+
+    for data in ['{"type": "message", "content": ""}', "a" * 1025]:
+        with pytest.raises(ValidationError) as e:
+            CreateMessageRequest.from_text(data)
+        frame = ErrorFrame.from_error(e.value)
+        assert "error" == frame.type
+        assert 1 == len(frame.detail)
@@ -1,12 +1,39 @@
+import json
 from datetime import datetime
+from typing import Literal
 
-from pydantic import BaseModel, Field, field_validator
+from pydantic import BaseModel, Field, ValidationError, field_validator
 
 from app.models import MessageSchema
 
 
 class CreateMessageRequest(BaseModel):
+    type: Literal["message"] = "message"
     content: str = Field(..., min_length=1, max_length=1024)
+    client_message_id: str | None = Field(None, min_length=1, max_length=255)
+
+    @classmethod
+    def from_text(cls, data: str) -> "CreateMessageRequest":
+        """typeが"message"のJSONはclient_message_idを含むリクエスト、それ以外は本文として扱う"""
+        if data.lstrip().startswith("{"):
+            try:
+                payload = json.loads(data)
+            except json.JSONDecodeError:
+                payload = None
+            if isinstance(payload, dict) and payload.get("type") == "message":
+                return cls.model_validate(payload)
+        return cls(content=data)
+
+
+class ErrorFrame(BaseModel):
+    type: Literal["error"] = "error"
+    detail: list[str]
+
+    @classmethod
+    def from_error(cls, error: ValueError) -> "ErrorFrame":
+        if isinstance(error, ValidationError):
+            return cls(detail=[e["msg"] for e in error.errors()])
+        return cls(detail=[str(error)])
 
 
 class CreateMessageResponse(MessageSchema):
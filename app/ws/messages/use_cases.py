@@ -1,3 +1,6 @@
+from app.commons.idempotency import IdempotencyKey
+from app.commons.message_cache import RecentMessageCache
+from app.commons.message_outbox import wake_message_outbox_relay
 from app.db import AsyncSession
 from app.models import Message
 
@@ -7,6 +10,7 @@ from .schema import CreateMessageRequest, CreateMessageResponse
 class CreateMessage:
     def __init__(self, session: AsyncSession) -> None:
         self.async_session = session
+        self.message_cache = RecentMessageCache()
 
     async def execute(
         self,
@@ -14,6 +18,36 @@ class CreateMessage:
         chat_id: int,
         current_participants: list[int],
         request: CreateMessageRequest,
+    ) -> tuple[CreateMessageResponse, bool]:
+        """作成したメッセージと、新たに作成したかどうかを返す"""
+        if not request.client_message_id:
+            return await self._create(
+                user_id, chat_id, current_participants, request
+            ), True
+
+        # 同じclient_message_idの再送には作成済みのメッセージを返す
+        idempotency = IdempotencyKey(
+            user_id, chat_id, request.client_message_id, request.content
+        )
+        stored = await idempotency.begin()
+        if stored is not None:
+            return CreateMessageResponse.model_validate(stored), False
+        try:
+            response = await self._create(
+                user_id, chat_id, current_participants, request
+            )
+        except BaseException:
+            await idempotency.release()
+            raise
+        await idempotency.complete(response)
+        return response, True
+
+    async def _create(
+        self,
+        user_id: int,
+        chat_id: int,
+        current_participants: list[int],
+        request: CreateMessageRequest,
     ) -> CreateMessageResponse:
         async with self.async_session.begin() as session:
             # Messageを作成
@@ -24,4 +58,8 @@ class CreateMessage:
                 content=request.content,
                 read_by_list=current_participants,
             )
-            return CreateMessageResponse.model_validate(message)
+            response = CreateMessageResponse.model_validate(message)
+
+        wake_message_outbox_relay()
+        await self.message_cache.push(chat_id, [response])
+        return response
@@ -1,22 +1,24 @@
 import asyncio
 import json
 
-from fastapi import WebSocket, WebSocketDisconnect, status
+from fastapi import HTTPException, WebSocket, WebSocketDisconnect, status
 from starlette.websockets import WebSocketState
 
+from app.commons.chat_membership import parse_membership_event
 from app.commons.logging import logger
+from app.commons.notifications import MessageNotifier
+from app.commons.presence import ChatPresence
+from app.commons.types import ChatEventType
 from app.db import AsyncSessionLocal, PubSubSessionLocal
 from app.models.schema import AccessTokenSchema
+from app.settings import settings
 
 from .repositories import (
-    AwsClientRepository,
-    ChatParticipantsRepository,
     ChatRepository,
-    NotificationRepository,
-    SessionRepository,
+    NotificationTargetRepository,
     UserRepository,
 )
-from .schema import CreateMessageRequest
+from .schema import CreateMessageRequest, ErrorFrame
 from .use_cases import CreateMessage
 
 
@@ -26,11 +28,10 @@ class WebsocketEndpointView:
         self.pubsub_session = PubSubSessionLocal
         self.chat_repo = ChatRepository(self.async_session)  # type: ignore
         self.user_repo = UserRepository(self.async_session)  # type: ignore
-        self.chat_participants_repo = ChatParticipantsRepository(self.async_session)  # type: ignore
-        self.session_repo = SessionRepository(self.async_session)  # type: ignore
-        self.aws_repo = AwsClientRepository()
-        self.notification_repo = NotificationRepository()
+        self.notification_target_repo = NotificationTargetRepository(self.async_session)  # type: ignore
         self.use_case = CreateMessage(self.async_session)
+        self.presence = ChatPresence()
+        self.notifier = MessageNotifier()
 
     async def execute(
         self,
@@ -40,39 +41,19 @@ class WebsocketEndpointView:
     ):
         user_id = schema.user_id
 
-        chat, result = await self.chat_repo.verify_chat_participant(chat_id, user_id)
-        if not chat or not result:
+        members = await self.chat_repo.verify_chat_participant(chat_id, user_id)
+        if not members:
             await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
             return
 
         # Userの取得
         user = await self.user_repo.get_user(user_id)
 
-        # ChatParticipantsの取得
-        chat_participants = [
-            row async for row in self.chat_participants_repo.get_all(chat_id)
-        ]
-
-        # Sessionの取得
-        sessions = [
-            {"user_id": row.user_id, "session": row}
-            async for row in self.session_repo.get_all(
-                [
-                    participant.user_id
-                    for participant in chat_participants
-                    if participant.user_id != user_id
-                ]
-                + ([] if user_id == chat.created_by else [user_id])
-            )
-        ]
-
-        # boto3クライアントの初期化
-        mail_client, push_client = self.aws_repo.get_ses_sns_client()
-
         pubsub = self.pubsub_session.pubsub()
         channel_name = f"chat_messages_{chat_id}"
         await pubsub.subscribe(channel_name)
-        await self.pubsub_session.sadd(f"active_users_{chat_id}", user_id)
+        # 入室中は通知を送らない
+        connection_id = await self.presence.enter(chat_id, user_id)
 
         # 排他制御用のロックを作成
         lock = asyncio.Lock()
@@ -90,7 +71,9 @@ class WebsocketEndpointView:
                     # WebSocketの 'ping_interval' と 'ping_timeout' を設定している場合は、
                     # その間隔で 'ping' を送信する必要があります。
                     await websocket.send_text("ping")
-                    await asyncio.sleep(10)  # 10秒ごとに 'ping' を送信
+                    await self.presence.touch(chat_id, user_id, connection_id)
+                    # PRESENCE_HEARTBEAT_INTERVAL秒ごとに 'ping' を送信
+                    await asyncio.sleep(settings.PRESENCE_HEARTBEAT_INTERVAL)
                 except asyncio.CancelledError:
                     # タスクがキャンセルされた場合は終了
                     break
@@ -99,8 +82,20 @@ class WebsocketEndpointView:
             while True:
                 async with lock:
                     message = await pubsub.get_message(ignore_subscribe_messages=True)
-                    if message and message["type"] == "message":
-                        await websocket.send_text(message["data"])
+                    if not message or message["type"] != "message":
+                        continue
+                    await websocket.send_text(message["data"])
+
+                event = parse_membership_event(message["data"])
+                if event is None:
+                    continue
+                if (
+                    event["event"] == ChatEventType.PARTICIPANT_REMOVED.name.lower()
+                    and user_id in event["user_ids"]
+                ):
+                    # 参加者から外れた場合は接続を閉じる
+                    await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+                    return
 
         async def receive_from_websocket(websocket, lock, pubsub):
             while True:
@@ -108,36 +103,55 @@ class WebsocketEndpointView:
                 if not data.strip():
                     continue
 
-                # メッセージを処理してレスポンスを生成
-                request = CreateMessageRequest(content=data)
+                try:
+                    request = CreateMessageRequest.from_text(data)
+                except ValueError as e:
+                    # 不正なフレームは送信者にエラーを返し、接続は維持する
+                    async with lock:
+                        await websocket.send_text(
+                            ErrorFrame.from_error(e).model_dump_json()
+                        )
+                    continue
 
                 # メッセージを処理してレスポンスを生成
-                current_participants = await self.pubsub_session.smembers(
-                    f"active_users_{chat_id}"
-                )
                 current_participants = [
-                    int(pid) for pid in current_participants if int(pid) != user_id
+                    pid
+                    for pid in await self.presence.online_user_ids(chat_id)
+                    if pid != user_id
                 ]
-                response = await self.use_case.execute(
-                    user_id, chat_id, current_participants, request
-                )
+                try:
+                    response, created = await self.use_case.execute(
+                        user_id, chat_id, current_participants, request
+                    )
+                except HTTPException as e:
+                    # 同じclient_message_idを処理中などの場合は破棄する
+                    logger.warning(f"Message was not created: {e.detail}")
+                    continue
 
-                async with lock:
-                    # レスポンスをRedisチャネルにブロードキャスト
-                    response_data = response.model_dump()
-                    if isinstance(response_data, dict):
-                        response_data = json.dumps(response_data, ensure_ascii=False)
-                    await self.pubsub_session.publish(channel_name, response_data)
-
-                # 通知送信処理
-                self.notification_repo.send_notifications(
-                    user,
-                    request.content,
-                    chat_participants,
-                    mail_client,
-                    push_client,
-                    sessions,
+                if not created:
+                    # 再送の場合は送信者にのみ作成済みのメッセージを返す
+                    async with lock:
+                        await websocket.send_text(
+                            json.dumps(response.model_dump(), ensure_ascii=False)
+                        )
+                    continue
+
+                # ブロードキャストはmessage_outboxを経由してリレーが行う
+
+                # 通知送信処理 (通知先は投稿のたびに共有のキャッシュから読む)
+                payload = f"{user.username}: {request.content}"
+                targets = await self.notification_target_repo.get(chat_id)
+                excluded = await self.notifier.exclude_recipients(
+                    chat_id,
+                    targets,
+                    payload,
+                    [user_id, *current_participants],
+                    response.id,
                 )
+                disabled = await self.notifier.send(targets, payload, excluded)
+                if disabled:
+                    async with self.async_session() as session:
+                        await self.notifier.disable_devices(session, disabled)
 
         # 独立した pubsub インスタンスを作成
         listen_pubsub = await create_pubsub_instance(
@@ -169,6 +183,7 @@ class WebsocketEndpointView:
             receive_task.cancel()
             await listen_pubsub.unsubscribe(channel_name)
             await receive_pubsub.unsubscribe(channel_name)
+            await self.presence.leave(chat_id, user_id, connection_id)
             # クライアントの状態を確認
             if websocket.client_state != WebSocketState.DISCONNECTED:
                 # クライアントがまだ接続されている場合はクローズ
@@ -30,6 +30,10 @@ def include_object(obj, name, type_, reflected, compare_to):
     if obj.info.get("skip_autogen", False):
         return False
 
+    # 実行時に作成されるmessagesのパーティションは比較対象から外す
+    if type_ == "table" and reflected and name.startswith("messages_"):
+        return False
+
     return True
 
 
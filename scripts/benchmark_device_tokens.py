@@ -0,0 +1,116 @@
+"""
+プッシュ通知先のdevice_tokenの復号にかかる時間を計測する
+
+    python scripts/benchmark_device_tokens.py --tokens 10000 --users 2000 --db
+
+- cache: DeviceEndpointCacheと同じく、ユーザーごとの端末の一覧をAES-GCMで復号
+- db: 一時テーブルにpgp_sym_encryptで保存したtokensを、Session.read_all_mobileと
+  同じくpgp_sym_decryptで読み出す (--dbを指定し、DB_URIのPostgresに接続できる場合のみ)
+1件あたりの時間を比較し、通知のたびにDBで復号する負荷を見積もる。
+"""
+
+import argparse
+import asyncio
+import time
+from collections import defaultdict
+
+from sqlalchemy import text
+
+from app.commons.crypto import AesGcmCipher
+from app.commons.notification_targets import (
+    NotificationDevice,
+    dumps_devices,
+    loads_devices,
+)
+from app.commons.types import PlatformType
+from app.settings import settings
+
+
+def make_devices(tokens: int, users: int) -> dict[int, list[NotificationDevice]]:
+    devices: dict[int, list[NotificationDevice]] = defaultdict(list)
+    for i in range(tokens):
+        devices[i % users].append(
+            NotificationDevice(
+                user_id=i % users,
+                platform_type=PlatformType.IOS,
+                device_token=f"arn:aws:sns:ap-northeast-1:123456789012:endpoint/APNS/{i}",
+                session_id=i,
+            )
+        )
+    return devices
+
+
+def report(name: str, tokens: int, elapsed: float) -> None:
+    print(
+        f"{name}: {tokens} tokens in {elapsed:.3f}s "
+        f"({elapsed / tokens * 1_000_000:.1f}us/token, "
+        f"{tokens / elapsed:,.0f} tokens/sec)"
+    )
+
+
+def run_cache(devices: dict[int, list[NotificationDevice]], repeat: int) -> None:
+    cipher = AesGcmCipher("device_endpoints")
+    cached = [dumps_devices(i, cipher) for i in devices.values()]
+    tokens = sum(len(i) for i in devices.values())
+
+    started_at = time.perf_counter()
+    for _ in range(repeat):
+        for data in cached:
+            loads_devices(data, cipher)
+    report("cache", tokens * repeat, time.perf_counter() - started_at)
+
+
+async def run_db(devices: dict[int, list[NotificationDevice]], repeat: int) -> None:
+    from app.db import async_engine
+
+    rows = [
+        {"user_id": device.user_id, "token": device.device_token}
+        for i in devices.values()
+        for device in i
+    ]
+    async with async_engine.connect() as conn:
+        await conn.execute(
+            text(
+                "CREATE TEMPORARY TABLE bench_device_tokens "
+                "(user_id integer, device_token bytea)"
+            )
+        )
+        await conn.execute(
+            text(
+                "INSERT INTO bench_device_tokens "
+                "VALUES (:user_id, pgp_sym_encrypt(:token, :secret))"
+            ),
+            [{**row, "secret": settings.SECRET} for row in rows],
+        )
+
+        started_at = time.perf_counter()
+        for _ in range(repeat):
+            result = await conn.execute(
+                text(
+                    "SELECT user_id, pgp_sym_decrypt(device_token, :secret) "
+                    "FROM bench_device_tokens"
+                ),
+                {"secret": settings.SECRET},
+            )
+            result.all()
+        report("db", len(rows) * repeat, time.perf_counter() - started_at)
+        await conn.rollback()
+    await async_engine.dispose()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tokens", type=int, default=10000)
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--db", action="store_true")
+    args = parser.parse_args()
+
+    devices = make_devices(args.tokens, args.users)
+    run_cache(devices, args.repeat)
+    if args.db:
+        asyncio.run(run_db(devices, args.repeat))
+
+
+if __name__ == "__main__":
+    main()
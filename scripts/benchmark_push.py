@@ -0,0 +1,84 @@
+"""
+プッシュ通知の送信のスループットを計測する
+
+    python scripts/benchmark_push.py --devices 200 --latency 0.05 --concurrency 1 32
+
+SNSのスタブ (LocalSnsClient) にlatency秒の応答時間を持たせ、同時に送る上限ごとに
+端末数を送り終えるまでの時間を計測する。--throttle-rateでスロットリングを、
+--disabled-rateでEndpointDisabledの端末を混ぜ、再送と無効な端末の検出も確認する。
+"""
+
+import argparse
+import asyncio
+import time
+from logging import WARNING
+
+from app.commons.logging import logger
+from app.commons.notification_targets import NotificationDevice
+from app.commons.push import LocalSnsClient, PushDispatcher
+from app.commons.types import PlatformType
+
+
+def make_devices(count: int) -> list[NotificationDevice]:
+    platforms = [PlatformType.IOS, PlatformType.ANDROID]
+    return [
+        NotificationDevice(
+            user_id=i,
+            platform_type=platforms[i % len(platforms)],
+            device_token=f"arn:aws:sns:local:endpoint/{i}",
+            session_id=i,
+        )
+        for i in range(count)
+    ]
+
+
+async def run(
+    devices: list[NotificationDevice],
+    concurrency: int,
+    latency: float,
+    throttle_rate: float,
+    disabled_rate: float,
+) -> None:
+    disabled_arns = [
+        device.device_token for device in devices[: int(len(devices) * disabled_rate)]
+    ]
+    client = LocalSnsClient(latency, disabled_arns, throttle_rate)
+    dispatcher = PushDispatcher(client, concurrency)
+
+    started_at = time.perf_counter()
+    result = await dispatcher.dispatch(devices, "user1: Hello")
+    elapsed = time.perf_counter() - started_at
+    print(
+        f"concurrency={concurrency}: {len(devices)} devices in {elapsed:.2f}s "
+        f"({len(devices) / elapsed:,.0f} devices/sec), sent={result.sent}, "
+        f"retried={result.retried}, failed={result.failed}, "
+        f"disabled={len(result.disabled)}"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--devices", type=int, default=200)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--throttle-rate", type=float, default=0.0)
+    parser.add_argument("--disabled-rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    # スタブが送信ごとに出力するログを計測に含めない
+    logger.setLevel(WARNING)
+    devices = make_devices(args.devices)
+    for concurrency in args.concurrency:
+        asyncio.run(
+            run(
+                devices,
+                concurrency,
+                args.latency,
+                args.throttle_rate,
+                args.disabled_rate,
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
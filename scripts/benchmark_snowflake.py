@@ -0,0 +1,97 @@
+"""
+メッセージIDの生成器のスループットと衝突を計測する
+
+    python scripts/benchmark_snowflake.py --ids 1000000 --threads 8 --workers 4
+
+- single: 1スレッドで連続生成
+- threads: 1つの生成器を複数スレッドで共有して生成
+- workers: ワーカーIDの異なる生成器を別プロセスで同時に生成
+それぞれで重複、単調増加、53ビットに収まることを確認する。
+"""
+
+import argparse
+import multiprocessing
+import threading
+import time
+from datetime import datetime, timezone
+
+from app.commons.snowflake import MAX_ID, SnowflakeGenerator
+
+
+def check(name: str, ids: list[int], elapsed: float, ordered: bool) -> None:
+    duplicates = len(ids) - len(set(ids))
+    monotonic = all(a < b for a, b in zip(ids, ids[1:])) if ordered else "-"
+    # シーケンスを使い切ると論理時刻が実時刻より先に進む
+    lead = SnowflakeGenerator().parse(max(ids))[0] - datetime.now(timezone.utc)
+    print(
+        f"{name}: {len(ids)} ids in {elapsed:.2f}s "
+        f"({len(ids) / elapsed:,.0f} ids/sec), duplicates={duplicates}, "
+        f"monotonic={monotonic}, max_bits={max(ids).bit_length()}, "
+        f"within_53_bits={max(ids) <= MAX_ID}, "
+        f"clock_lead={max(lead.total_seconds(), 0):.2f}s"
+    )
+
+
+def run_single(count: int) -> None:
+    generator = SnowflakeGenerator()
+    started_at = time.perf_counter()
+    ids = [generator.generate() for _ in range(count)]
+    check("single", ids, time.perf_counter() - started_at, ordered=True)
+
+
+def run_threads(count: int, threads: int) -> None:
+    generator = SnowflakeGenerator()
+    results: list[list[int]] = [[] for _ in range(threads)]
+
+    def work(result: list[int]) -> None:
+        for _ in range(count // threads):
+            result.append(generator.generate())
+
+    workers = [threading.Thread(target=work, args=(r,)) for r in results]
+    started_at = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - started_at
+
+    # スレッドごとの生成順でも単調増加していることを確認する
+    for result in results:
+        assert all(a < b for a, b in zip(result, result[1:]))
+    check("threads", [i for r in results for i in r], elapsed, ordered=False)
+
+
+def generate_in_process(args: tuple[int, int]) -> list[int]:
+    worker_id, count = args
+    generator = SnowflakeGenerator(worker_id)
+    return [generator.generate() for _ in range(count)]
+
+
+def run_workers(count: int, workers: int) -> None:
+    started_at = time.perf_counter()
+    with multiprocessing.Pool(workers) as pool:
+        results = pool.map(
+            generate_in_process, [(i, count // workers) for i in range(workers)]
+        )
+    check(
+        "workers",
+        [i for r in results for i in r],
+        time.perf_counter() - started_at,
+        ordered=False,
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--ids", type=int, default=1_000_000)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--workers", type=int, default=4)
+    args = parser.parse_args()
+
+    run_single(args.ids)
+    run_threads(args.ids, args.threads)
+    run_workers(args.ids, args.workers)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""
+一覧APIのレスポンス生成方式ごとのピークRSSを計測する
+
+    python scripts/measure_stream_rss.py --rows 100000
+
+stream_scalarsの代わりにORMオブジェクト相当の行を1件ずつ返すジェネレータを用意し、
+- list: 全件をリストに集めてレスポンスモデルに包み、FastAPIと同様に再検証してJSON化
+- stream: ndjson_responseで1件ずつシリアライズして書き出す
+をそれぞれ別プロセスで実行してピークRSSを比較する。
+"""
+
+import argparse
+import asyncio
+import resource
+import subprocess
+import sys
+from datetime import datetime
+from types import SimpleNamespace
+from typing import AsyncIterator
+
+from fastapi.encoders import jsonable_encoder
+
+
+async def fake_rows(count: int) -> AsyncIterator[SimpleNamespace]:
+    now = datetime.now()
+    for i in range(count):
+        yield SimpleNamespace(
+            id=i,
+            sender_id=i % 100,
+            content="x" * 200,
+            created_at=now,
+            read_by_list=[1, 2, 3],
+        )
+
+
+async def run_list(count: int) -> None:
+    from app.api.messages.schema import ReadAllMessageResponse, ReadMessageResponse
+
+    response = ReadAllMessageResponse(
+        messages=[
+            ReadMessageResponse.model_validate(row) async for row in fake_rows(count)
+        ]
+    )
+    # FastAPIのresponse_model処理と同様に再検証してからエンコードする
+    validated = ReadAllMessageResponse.model_validate(response.model_dump())
+    body = jsonable_encoder(validated)
+    del body
+
+
+async def run_stream(count: int) -> None:
+    from app.api.messages.schema import ReadMessageResponse
+    from app.commons.streaming import ndjson_response
+
+    async def rows() -> AsyncIterator[ReadMessageResponse]:
+        async for row in fake_rows(count):
+            yield ReadMessageResponse.model_validate(row)
+
+    response = await ndjson_response(rows())
+    async for _ in response.body_iterator:
+        pass
+
+
+def peak_rss_mb() -> float:
+    # Linuxではru_maxrssはKB単位
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--mode", choices=["list", "stream"])
+    args = parser.parse_args()
+
+    if args.mode:
+        baseline = peak_rss_mb()
+        runner = run_list if args.mode == "list" else run_stream
+        asyncio.run(runner(args.rows))
+        print(f"{args.mode}: baseline={baseline:.1f}MB peak={peak_rss_mb():.1f}MB")
+        return
+
+    for mode in ("list", "stream"):
+        subprocess.run(
+            [sys.executable, __file__, "--rows", str(args.rows), "--mode", mode],
+            check=True,
+        )
+
+
+if __name__ == "__main__":
+    main()